@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Build of fingerprinted and precompressed static assets.
+
+Assets referenced by the templates with url_for('asset', filename=...) are
+copied into static/dist under a name containing a hash of their content,
+together with gzip (and brotli, when installed) compressed variants. The
+hashed names never change their content, so they are served with an
+immutable Cache-Control.
+
+Usage:
+    python3 assets.py
+"""
+
+import os
+import re
+import gzip
+import json
+import hashlib
+import tempfile
+from threading import Lock
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#: Directory with the source assets
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'static')
+#: Directory with the templates referencing the assets
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'templates')
+#: Reference of an asset in a template
+ASSET_REFERENCE = re.compile(
+    r"""url_for\(\s*['"]asset['"]\s*,\s*filename\s*=\s*['"]([^'"]+)['"]""")
+#: Compressed variants by Content-Encoding, in the order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def referenced_assets(template_dir):
+    """
+    Get names of the assets referenced by the templates.
+    :param string template_dir: - directory with the templates
+    """
+    _names = set()
+    for _template in os.listdir(template_dir):
+        with open(os.path.join(template_dir, _template),
+                  encoding='utf-8') as _file:
+            _names.update(ASSET_REFERENCE.findall(_file.read()))
+    return sorted(_names)
+
+
+def hashed_name(name, data):
+    """
+    Get the file name of an asset containing a hash of its content.
+    :param string name: - path of the asset relative to the static directory
+    :param bytes data: - content of the asset
+    """
+    _base, _ext = os.path.splitext(name)
+    return '%s.%s%s' % (_base, hashlib.sha256(data).hexdigest()[:12], _ext)
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False,
+                                     suffix='.tmp') as _file:
+        _file.write(data)
+    os.replace(_file.name, path)
+
+
+def compress(data):
+    """
+    Get compressed variants of an asset by Content-Encoding. Variants that
+    are not smaller than the original are skipped.
+    :param bytes data: - content of the asset
+    """
+    _variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        _variants['br'] = brotli.compress(data)
+    return {_encoding: _data for _encoding, _data in _variants.items()
+            if len(_data) < len(data)}
+
+
+class AssetPipeline:
+    """
+    Manifest of the built assets mapping source names to hashed names.
+    """
+
+    def __init__(self, static_dir=STATIC_DIR, template_dir=TEMPLATE_DIR):
+        #: Directory with the source assets
+        self.static_dir = static_dir
+        #: Directory with the built assets
+        self.dist_dir = os.path.join(static_dir, 'dist')
+        #: Directory with the templates referencing the assets
+        self.template_dir = template_dir
+        self._manifest = None
+        self._files = None
+        self._sources = None
+        self._lock = Lock()
+
+    @property
+    def manifest_path(self):
+        """
+        Path to the manifest of the built assets.
+        """
+        return os.path.join(self.dist_dir, 'manifest.json')
+
+    def build(self):
+        """
+        Build all referenced assets. Assets with unchanged content are not
+        rewritten. Returns the manifest.
+        """
+        _manifest = {}
+        for _name in referenced_assets(self.template_dir):
+            with open(os.path.join(self.static_dir, _name), 'rb') as _file:
+                _data = _file.read()
+            _hashed = hashed_name(_name, _data)
+            _path = os.path.join(self.dist_dir, _hashed)
+            if not os.path.isfile(_path):
+                _write(_path, _data)
+                _variants = compress(_data)
+                for _encoding, _suffix in ENCODINGS:
+                    if _encoding in _variants:
+                        _write(_path + _suffix, _variants[_encoding])
+            _manifest[_name] = _hashed
+        _write(self.manifest_path,
+               json.dumps(_manifest, indent=2, sort_keys=True).encode('utf-8'))
+        with self._lock:
+            self._manifest = _manifest
+            self._files = set(_manifest.values())
+            self._sources = set(_manifest)
+        return _manifest
+
+    def _load(self):
+        with self._lock:
+            if self._manifest is None:
+                try:
+                    with open(self.manifest_path, encoding='utf-8') as _file:
+                        self._manifest = json.load(_file)
+                except FileNotFoundError:
+                    self._manifest = {}
+                self._files = set(self._manifest.values())
+                self._sources = set(referenced_assets(self.template_dir))
+            return self._manifest, self._files, self._sources
+
+    def url_name(self, name):
+        """
+        Get the hashed name of an asset, or the source name when the asset
+        is not built.
+        :param string name: - path of the asset relative to the static directory
+        """
+        return self._load()[0].get(name, name)
+
+    def find(self, name, accept_encodings=()):
+        """
+        Find the file serving an asset. Returns (path, encoding, immutable)
+        or None. Built assets are served precompressed in the best encoding
+        accepted by the client.
+        :param string name: - requested asset name
+        :param iterable accept_encodings: - encodings accepted by the client
+        """
+        _manifest, _files, _sources = self._load()
+        if name in _files:
+            _path = os.path.join(self.dist_dir, name)
+            for _encoding, _suffix in ENCODINGS:
+                if _encoding in accept_encodings and \
+                        os.path.isfile(_path + _suffix):
+                    return _path + _suffix, _encoding, True
+            return _path, None, True
+        if name in _sources:
+            # Not built yet - serve the source without long caching
+            return os.path.join(self.static_dir, name), None, False
+        return None
+
+
+#: Assets of the web interface
+ASSETS = AssetPipeline()
+
+
+if __name__ == '__main__':
+    for _source, _hashed in sorted(ASSETS.build().items()):
+        print("%s -> %s" % (_source, _hashed))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark of the gamedetails.json parsers.
+
+For synthetic catalogs of growing size the peak memory allocated by
+json.load, by iterating over catalog.iter_games and by building a complete
+catalog.CatalogSnapshot is measured with tracemalloc. Results are printed as
+JSON.
+
+Usage:
+    python3 benchmarks/catalog_memory.py [--games N [N ...]]
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import tracemalloc
+from time import monotonic
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalog  # noqa: E402
+from synthetic import write_catalog  # noqa: E402
+
+
+def measure(function):
+    """
+    Measure run time and peak allocated memory of a function.
+    """
+    tracemalloc.start()
+    _start = monotonic()
+    function()
+    _time = monotonic() - _start
+    _peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': round(_time, 3), 'peak_mb': round(_peak / 2**20, 2)}
+
+
+def _json_load(path):
+    with open(path, encoding='utf-8') as _file:
+        json.load(_file)
+
+
+def _iterate(path):
+    for _game in catalog.iter_games(path):
+        pass
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    _parser.add_argument('--games', type=int, nargs='+',
+                         default=[500, 2000, 8000])
+    _args = _parser.parse_args()
+    _results = []
+    with tempfile.TemporaryDirectory(prefix='lgog-bench-') as _dir:
+        for _games in _args.games:
+            _path = os.path.join(_dir, 'gamedetails.json')
+            write_catalog(_path, _games)
+            _results.append({
+                'games': _games,
+                'file_mb': round(os.path.getsize(_path) / 2**20, 2),
+                'json_load': measure(lambda: _json_load(_path)),
+                'iter_games': measure(lambda: _iterate(_path)),
+                'snapshot': measure(
+                    lambda: catalog.CatalogSnapshot(
+                        catalog.iter_games(_path)))
+            })
+    print(json.dumps(_results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Stand-in HTTP server for the http download backend.
+
+It serves files with Range support over keep-alive connections, either from
+a directory (e.g. a library written by benchmarks/synthetic.py with
+--downloaded 1) or generated: every path is a file of a given size filled
+with a fixed pseudo random pattern, so large files need no disk space. The
+transfer rate of every connection can be limited and a fraction of responses
+can be cut off to test the retries. With --no-ranges the Range headers are
+ignored and whole files are sent, like by servers without range support.
+
+Usage:
+    python3 benchmarks/range_server.py [--directory DIR | --size MB]
+                                       [--port N] [--rate MB/s]
+                                       [--error-rate F] [--no-ranges]
+"""
+
+import os
+import re
+import random
+import hashlib
+import argparse
+from threading import Thread
+from time import monotonic, sleep
+from urllib.parse import urlsplit, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#: Size of the blocks written to a connection at once
+CHUNK_SIZE = 256 * 1024
+#: Content of the generated files, repeated. The prime length makes
+#: misplaced segments show up in the checksum.
+PATTERN = random.Random(0).randbytes(65521)
+_REPEATED = PATTERN * (CHUNK_SIZE // len(PATTERN) + 2)
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def generated(offset, length):
+    """
+    Get a part of a generated file.
+    :param int offset: - position in the file
+    :param int length: - number of bytes, at most CHUNK_SIZE
+    """
+    _start = offset % len(PATTERN)
+    return _REPEATED[_start:_start + length]
+
+
+def generated_md5(size):
+    """
+    Get the MD5 checksum of a generated file.
+    :param int size: - file size in bytes
+    """
+    _md5 = hashlib.md5()
+    for _offset in range(0, size, CHUNK_SIZE):
+        _md5.update(generated(_offset, min(CHUNK_SIZE, size - _offset)))
+    return _md5.hexdigest()
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Handler of GET and HEAD requests with single byte ranges.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _content(self):
+        if self.server.directory is None:
+            return self.server.size, generated
+        _root = os.path.realpath(self.server.directory)
+        _path = os.path.realpath(os.path.join(
+            _root, unquote(urlsplit(self.path).path).lstrip('/')))
+        if not _path.startswith(_root + os.sep) or not os.path.isfile(_path):
+            return None
+
+        def _read(offset, length):
+            with open(_path, 'rb') as _file:
+                _file.seek(offset)
+                return _file.read(length)
+        return os.path.getsize(_path), _read
+
+    def do_HEAD(self):
+        self._respond(False)
+
+    def do_GET(self):
+        self._respond(True)
+
+    def _respond(self, body):
+        _content = self._content()
+        if _content is None:
+            self.send_error(404)
+            return
+        _size, _read = _content
+        _start, _end = 0, _size
+        _range = self.headers.get('Range')
+        if _range is not None and self.server.ranges:
+            _match = _RANGE.fullmatch(_range.strip())
+            if _match is None or _match.groups() == ('', ''):
+                self.send_error(400, "Unsupported range")
+                return
+            _first, _last = _match.groups()
+            if _first:
+                _start = int(_first)
+                if _last:
+                    _end = min(int(_last) + 1, _size)
+            else:
+                # Suffix range with the last bytes of the file
+                _start = max(_size - int(_last), 0)
+            if _start >= _end:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%s' % _size)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %s-%s/%s' % (
+                _start, _end - 1, _size))
+        else:
+            self.send_response(200)
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(_end - _start))
+        self.end_headers()
+        if not body:
+            return
+        _cut = None
+        if random.random() < self.server.error_rate:
+            _cut = random.randrange(_start, _end)
+        _started = monotonic()
+        _offset = _start
+        try:
+            while _offset < _end:
+                _length = min(CHUNK_SIZE, _end - _offset)
+                if _cut is not None and _offset + _length > _cut:
+                    # Drop the connection in the middle of the response
+                    self.wfile.write(_read(_offset, _cut - _offset))
+                    self.close_connection = True
+                    return
+                self.wfile.write(_read(_offset, _length))
+                _offset += _length
+                if self.server.rate:
+                    _ahead = (_offset - _start) / self.server.rate - \
+                        (monotonic() - _started)
+                    if _ahead > 0:
+                        sleep(_ahead)
+        except ConnectionError:
+            # The client stopped the download
+            self.close_connection = True
+
+
+def serve(directory=None, size=64 * 2**20, rate=None, error_rate=0.0,
+          host='127.0.0.1', port=0, verbose=False, ranges=True):
+    """
+    Start the server in a background thread. Returns the server, its
+    address is in server_address.
+    :param string directory: - served directory, None for generated files
+    :param int size: - size of the generated files in bytes
+    :param float rate: - limit of the transfer rate per connection in
+                         bytes per second
+    :param float error_rate: - fraction of responses cut off
+    :param string host: - listening address
+    :param int port: - listening port, 0 for any free port
+    :param bool verbose: - log the requests
+    :param bool ranges: - serve byte ranges, False sends whole files
+    """
+    _server = ThreadingHTTPServer((host, port), RangeHandler)
+    _server.daemon_threads = True
+    _server.directory = directory
+    _server.size = size
+    _server.rate = rate
+    _server.error_rate = error_rate
+    _server.verbose = verbose
+    _server.ranges = ranges
+    Thread(target=_server.serve_forever, name="RangeServer",
+           daemon=True).start()
+    return _server
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    _parser.add_argument('--directory',
+                         help="serve files from a directory")
+    _parser.add_argument('--size', type=float, default=64,
+                         help="size of the generated files in MB")
+    _parser.add_argument('--host', default='127.0.0.1')
+    _parser.add_argument('--port', type=int, default=8586)
+    _parser.add_argument('--rate', type=float, default=0,
+                         help="limit of every connection in MB/s")
+    _parser.add_argument('--error-rate', type=float, default=0.0,
+                         help="fraction of responses cut off")
+    _parser.add_argument('--no-ranges', action='store_true',
+                         help="ignore Range headers")
+    _args = _parser.parse_args()
+    _server = serve(_args.directory, int(_args.size * 2**20),
+                    _args.rate * 2**20, _args.error_rate, _args.host,
+                    _args.port, verbose=True, ranges=not _args.no_ranges)
+    print("Serving on http://%s:%s/" % _server.server_address[:2])
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        _server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Timing of the lgogwebui routes and daemon jobs on synthetic libraries.
+
+For every library size a synthetic catalog and GOG library are generated in
+a temporary directory (see benchmarks/synthetic.py) and lgogwebui is started
+in a separate process with the stand-in lgogdownloader of benchmarks/bin on
+PATH. The scenarios time:
+- library: the main page, cold (first request) and warm, and a synchronous
+  rebuild of the library snapshot
+- status: POST /status with a list of games
+- default_platform: toggles of a default platform
+- update_pass: a full update_loop pass - cache update, rescan of the library
+  and the status checks due right away (set FAKE_LGOG_CHANGED_GAMES to change
+  games on every pass)
+- downloads: concurrent downloads through the download scheduler
+- http_download: downloads of generated files served by
+  benchmarks/range_server.py with the segmented HTTP engine, with a single
+  and with the configured number of segments per file
+
+Results are printed (or written with --output) as JSON. With --baseline the
+median times are compared with an earlier result file.
+
+Usage:
+    python3 benchmarks/scenarios.py [--games N [N ...]] [--output FILE]
+                                    [--baseline FILE]
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from statistics import median
+from time import perf_counter, sleep
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARK_DIR)
+
+sys.path.insert(0, ROOT_DIR)
+
+from synthetic import game_name, write_catalog, write_library  # noqa: E402
+import range_server  # noqa: E402
+
+#: 1x1 transparent PNG returned instead of the GOG icons
+PIXEL_PNG = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000001e221bc330000'
+    '000049454e44ae426082')
+
+
+def timings(function, repeat):
+    """
+    Run a function repeatedly and summarize the run times in milliseconds.
+    :param callable function: - timed function
+    :param int repeat: - number of runs
+    """
+    _times = []
+    for _ in range(repeat):
+        _start = perf_counter()
+        function()
+        _times.append((perf_counter() - _start) * 1000)
+    _times.sort()
+    return {
+        'runs': repeat,
+        'min_ms': round(_times[0], 3),
+        'median_ms': round(median(_times), 3),
+        'p95_ms': round(_times[min(int(repeat * 0.95), repeat - 1)], 3),
+        'max_ms': round(_times[-1], 3)
+    }
+
+
+def _check(response):
+    if response.status_code >= 400:
+        raise RuntimeError("%s: %s" % (response.status_code,
+                                       response.get_data(as_text=True)))
+    return response
+
+
+def _wait_idle(scheduler, timeout):
+    _end = perf_counter() + timeout
+    while scheduler.queued() or scheduler.running():
+        if perf_counter() > _end:
+            raise RuntimeError("Downloads did not finish in %s s" % timeout)
+        sleep(0.005)
+
+
+def http_download(args):
+    """
+    Time downloads with the segmented HTTP engine from a local server with
+    a limited rate per connection.
+    """
+    import shutil
+    import httpdownload
+    from httpdownload import HttpDownloader
+    httpdownload.MAX_BACKOFF = 0.1
+    _size = int(args.http_mb * 2**20)
+    _server = range_server.serve(size=_size, rate=args.http_rate * 2**20,
+                                 error_rate=args.http_error_rate)
+    _url = 'http://%s:%s/' % _server.server_address[:2]
+    _md5 = range_server.generated_md5(_size)
+    _results = {}
+    with tempfile.TemporaryDirectory(prefix='lgog-http-') as _dir:
+        _files = [{
+            'url': _url + 'setup_%s.exe' % _index,
+            'path': os.path.join(_dir, 'game', 'setup_%s.exe' % _index),
+            'md5': _md5
+        } for _index in range(args.http_files)]
+        for _segments in sorted({1, httpdownload.HTTP_DOWNLOADER.segments}):
+            _engine = HttpDownloader(_segments, retries=20, poll=0.1)
+
+            def _download():
+                shutil.rmtree(os.path.join(_dir, 'game'), ignore_errors=True)
+                _engine.download(_files)
+            _timing = timings(_download, 1)
+            _timing['mb_s'] = round(
+                args.http_files * args.http_mb / _timing['median_ms'] * 1000,
+                1)
+            _results['segments_%s' % _segments] = _timing
+    _server.shutdown()
+    return _results
+
+
+def run_scenarios(args):
+    """
+    Run all scenarios in the current process. The environment has to point
+    lgogwebui to the synthetic library before it is imported.
+    """
+    import logging
+    import threading
+    import main  # noqa: F401 - configures the logging
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    _start = perf_counter()
+    import lgogwebui
+    import lgogdaemon
+    from icons import ICONS
+    from ondisk import ONDISK
+    from snapshot import LIBRARY
+    from scheduler import TrackedExecutor
+    from models import Game, Session, User, LoginStatus
+    _startup = perf_counter() - _start
+    # The update timer started by lgogwebui would run during the scenarios
+    for _thread in threading.enumerate():
+        if isinstance(_thread, threading.Timer):
+            _thread.cancel()
+    # Keep the benchmark offline
+    ICONS.fetcher = lambda url, timeout=10: PIXEL_PNG
+    _session = Session()
+    _user = _session.query(User).one()
+    _user.state = LoginStatus.logon
+    _user.platform = 5
+    _session.commit()
+    Session.remove()
+    _client = lgogwebui.app.test_client()
+    _results = {'games': args.child, 'startup_s': round(_startup, 3)}
+
+    _results['library'] = {
+        'cold': timings(lambda: _check(_client.get('/')), 1),
+        'warm': timings(lambda: _check(_client.get('/')), args.repeat),
+        'rebuild': timings(LIBRARY.build, max(args.repeat // 10, 1))
+    }
+
+    _names = [game_name(_index) for _index in range(0, args.child,
+                                                    max(args.child // 100, 1))]
+    _results['status'] = timings(
+        lambda: _check(_client.post('/status', json=_names)), args.repeat)
+
+    _results['default_platform'] = timings(
+        lambda: _check(_client.get('/default_platform/2')),
+        max(args.repeat // 10, 2))
+
+    _checks = lgogdaemon.STATUS_CHECKS
+    _checks.min_interval = 0
+
+    def _update_pass():
+        _executor = TrackedExecutor(max_workers=2, name="Benchmark")
+        # The pass schedules the next one far beyond the benchmark
+        lgogdaemon.update_loop(86400, lgogdaemon.update, (_executor,))
+        _executor.shutdown(wait=True)
+        # Wait for the status checks due now, the rest is spread over a day
+        while _checks.due() or _checks.counts()[1]:
+            sleep(0.005)
+    _results['update_pass'] = timings(_update_pass, args.update_passes)
+    _results['update_pass'].update({
+        'ondisk_games': len(ONDISK.games()),
+        'planned_checks': _checks.counts()[0]
+    })
+
+    _ondisk = set(ONDISK.games())
+    _downloads = [_name for _name in (game_name(_index)
+                                      for _index in range(args.child))
+                  if _name not in _ondisk][:args.downloads]
+
+    def _download_all():
+        for _name in _downloads:
+            _check(_client.get('/download/%s' % _name))
+        _wait_idle(lgogwebui.download_scheduler, args.timeout)
+    _results['downloads'] = timings(_download_all, 1)
+    _states = {}
+    for _game in Session().query(Game).filter(Game.name.in_(_downloads)):
+        _states[_game.state.name] = _states.get(_game.state.name, 0) + 1
+    Session.remove()
+    _results['downloads'].update({
+        'games': len(_downloads),
+        'workers': lgogwebui.download_scheduler.max_workers,
+        'states': _states
+    })
+
+    if args.http_files:
+        _results['http_download'] = http_download(args)
+    return _results
+
+
+def run_size(games, args):
+    """
+    Generate a library of a given size and run the scenarios on it in a new
+    process. Returns the results.
+    :param int games: - number of games
+    """
+    with tempfile.TemporaryDirectory(prefix='lgog-bench-') as _dir:
+        _cache = os.path.join(_dir, 'cache')
+        _library = os.path.join(_dir, 'library')
+        os.makedirs(_cache)
+        os.makedirs(_library)
+        _path = os.path.join(_cache, 'gamedetails.json')
+        write_catalog(_path, games)
+        write_library(_library, games, args.downloaded)
+        _env = dict(os.environ)
+        _env.update({
+            'LGOG_CACHE': _cache,
+            'LGOG_ICONS': os.path.join(_dir, 'icons'),
+            'GOG_DIR': _library,
+            'PATH': os.path.join(BENCHMARK_DIR, 'bin') + os.pathsep +
+                    _env.get('PATH', ''),
+            'LGOG_DOWNLOAD_WORKERS': str(args.workers),
+            'LGOG_DOWNLOAD_MAX_THREADS': str(args.workers)
+        })
+        _cmd = [sys.executable, os.path.abspath(__file__),
+                '--child', str(games),
+                '--repeat', str(args.repeat),
+                '--update-passes', str(args.update_passes),
+                '--downloads', str(args.downloads),
+                '--timeout', str(args.timeout),
+                '--http-files', str(args.http_files),
+                '--http-mb', str(args.http_mb),
+                '--http-rate', str(args.http_rate),
+                '--http-error-rate', str(args.http_error_rate)]
+        if args.verbose:
+            _cmd.append('--verbose')
+        _proc = subprocess.run(_cmd, env=_env, cwd=ROOT_DIR,
+                               stdout=subprocess.PIPE, check=True)
+        _results = json.loads(_proc.stdout.decode('utf-8').splitlines()[-1])
+        _results['catalog_mb'] = round(os.path.getsize(_path) / 2**20, 2)
+        return _results
+
+
+def _medians(results, prefix=''):
+    _values = {}
+    for _key, _value in results.items():
+        if isinstance(_value, dict):
+            if 'median_ms' in _value:
+                _values[prefix + _key] = _value['median_ms']
+            else:
+                _values.update(_medians(_value, prefix + _key + '.'))
+    return _values
+
+
+def compare(baseline, results):
+    """
+    Print changes of the median times against a baseline.
+    :param list baseline: - results of an earlier run
+    :param list results: - results of this run
+    """
+    _baseline = {_entry['games']: _medians(_entry) for _entry in baseline}
+    for _entry in results:
+        _old = _baseline.get(_entry['games'])
+        if _old is None:
+            continue
+        for _name, _value in sorted(_medians(_entry).items()):
+            if _old.get(_name):
+                print("%6s games %-24s %10.3f ms %+7.1f%%" % (
+                    _entry['games'], _name, _value,
+                    (_value / _old[_name] - 1) * 100), file=sys.stderr)
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    _parser.add_argument('--games', type=int, nargs='+',
+                         default=[100, 1000, 5000])
+    _parser.add_argument('--repeat', type=int, default=50,
+                         help="runs of the fast scenarios")
+    _parser.add_argument('--update-passes', type=int, default=3)
+    _parser.add_argument('--downloads', type=int, default=10,
+                         help="number of downloaded games")
+    _parser.add_argument('--workers', type=int, default=2,
+                         help="concurrent downloads")
+    _parser.add_argument('--downloaded', type=float, default=0.2,
+                         help="fraction of games already on disk")
+    _parser.add_argument('--timeout', type=float, default=600)
+    _parser.add_argument('--http-files', type=int, default=4,
+                         help="files downloaded by the HTTP engine, 0 skips "
+                              "the scenario")
+    _parser.add_argument('--http-mb', type=float, default=32,
+                         help="size of every file in MB")
+    _parser.add_argument('--http-rate', type=float, default=50,
+                         help="limit of every connection in MB/s")
+    _parser.add_argument('--http-error-rate', type=float, default=0.05,
+                         help="fraction of responses cut off")
+    _parser.add_argument('--output', help="write the results to a file")
+    _parser.add_argument('--baseline', help="compare with earlier results")
+    _parser.add_argument('--verbose', action='store_true',
+                         help="show the lgogwebui log")
+    _parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    _args = _parser.parse_args()
+    if _args.child:
+        print(json.dumps(run_scenarios(_args)))
+        sys.stdout.flush()
+        # Skip the update timer started by lgogwebui
+        os._exit(0)
+    _results = [run_size(_games, _args) for _games in _args.games]
+    _text = json.dumps(_results, indent=2)
+    if _args.output:
+        with open(_args.output, 'w', encoding='utf-8') as _file:
+            _file.write(_text + '\n')
+    else:
+        print(_text)
+    if _args.baseline:
+        with open(_args.baseline, encoding='utf-8') as _file:
+            compare(json.load(_file), _results)
+
+
+if __name__ == '__main__':
+    main()
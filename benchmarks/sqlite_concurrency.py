@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Benchmark of concurrent DB access by web readers and daemon writers.
+
+The same workload is executed against a DB with the default SQLite settings
+and no indexes and against a DB configured by models.create_db_engine and
+models.init_db. Results are printed as JSON.
+
+Usage:
+    python3 benchmarks/sqlite_concurrency.py [--games N] [--readers N]
+        [--writers N] [--duration SECONDS]
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import threading
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import models  # noqa: E402
+from models import Game, Status  # noqa: E402
+
+
+def percentile(values, fraction):
+    """
+    Get a percentile of measured values.
+    :param list values: - measured values
+    :param float fraction: - percentile as a fraction, e.g. 0.99
+    """
+    if not values:
+        return None
+    _values = sorted(values)
+    return _values[min(int(len(_values) * fraction), len(_values) - 1)]
+
+
+def prepare(engine, games, tuned):
+    """
+    Create the schema and fill it with synthetic games.
+    """
+    if tuned:
+        models.init_db(engine)
+    else:
+        models.Base.metadata.create_all(engine)
+        with engine.begin() as _connection:
+            for _index in Game.__table__.indexes:
+                _connection.execute(text("DROP INDEX %s" % _index.name))
+    with engine.begin() as _connection:
+        _connection.execute(Game.__table__.insert(), [{
+            'name': 'game_%05d' % _index,
+            'platform': -1,
+            'platform_available': 5,
+            'platform_ondisk': 0,
+            'progress': 0,
+            'state': Status.new,
+            'done_count': 0,
+            'missing_count': 0,
+            'update_count': 0
+        } for _index in range(games)])
+
+
+def run(tuned, args):
+    """
+    Execute the workload and return measured statistics.
+    """
+    _dir = tempfile.mkdtemp(prefix='lgog-bench-')
+    _engine = models.create_db_engine(os.path.join(_dir, 'bench.db'),
+                                      tuned=tuned)
+    prepare(_engine, args.games, tuned)
+    _factory = sessionmaker(bind=_engine)
+    _stop = threading.Event()
+    _lock = threading.Lock()
+    _stats = {'read': [], 'write': [], 'locked': 0}
+
+    def _record(kind, value):
+        with _lock:
+            _stats[kind].append(value)
+
+    def _locked():
+        with _lock:
+            _stats['locked'] += 1
+
+    def _reader():
+        _session = _factory()
+        while not _stop.is_set():
+            _start = monotonic()
+            try:
+                _session.query(Game).filter(
+                    Game.name == 'game_%05d' % random.randrange(args.games)
+                ).one()
+                _session.query(Game).filter(
+                    Game.state.in_([Status.queued, Status.running])).all()
+                _session.commit()
+                _record('read', monotonic() - _start)
+            except OperationalError:
+                _session.rollback()
+                _locked()
+        _session.close()
+
+    def _writer(index):
+        _session = _factory()
+        _name = 'game_%05d' % index
+        while not _stop.is_set():
+            _start = monotonic()
+            try:
+                _game = _session.query(Game).filter(Game.name == _name).one()
+                _game.progress = random.randrange(100)
+                _game.state = Status.running
+                _session.commit()
+                _record('write', monotonic() - _start)
+            except OperationalError:
+                _session.rollback()
+                _locked()
+            sleep(0.001)
+        _session.close()
+
+    _threads = [threading.Thread(target=_reader) for _ in range(args.readers)]
+    _threads += [threading.Thread(target=_writer, args=(_index,))
+                 for _index in range(args.writers)]
+    for _thread in _threads:
+        _thread.start()
+    sleep(args.duration)
+    _stop.set()
+    for _thread in _threads:
+        _thread.join()
+    _engine.dispose()
+    return {
+        'tuned': tuned,
+        'reads': len(_stats['read']),
+        'writes': len(_stats['write']),
+        'locked_errors': _stats['locked'],
+        'read_p50_ms': percentile(_stats['read'], 0.5) * 1000,
+        'read_p99_ms': percentile(_stats['read'], 0.99) * 1000,
+        'write_p50_ms': percentile(_stats['write'], 0.5) * 1000,
+        'write_p99_ms': percentile(_stats['write'], 0.99) * 1000,
+    }
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    _parser.add_argument('--games', type=int, default=5000)
+    _parser.add_argument('--readers', type=int, default=8)
+    _parser.add_argument('--writers', type=int, default=4)
+    _parser.add_argument('--duration', type=float, default=10)
+    _args = _parser.parse_args()
+    print(json.dumps([run(False, _args), run(True, _args)], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Generator of synthetic lgogdownloader caches and GOG libraries.
+
+Every game has INSTALLERS installers spread over the three platforms. The
+installer files written into the library are named by installer_name, which
+is also used by the stand-in lgogdownloader in benchmarks/bin to answer the
+status queries and to write the downloaded files.
+
+Usage:
+    python3 benchmarks/synthetic.py --games N --cache DIR --library DIR
+"""
+
+import os
+import json
+import hashlib
+import argparse
+
+#: Number of installers of every game
+INSTALLERS = 6
+#: Installer file suffixes by platform
+PLATFORM_SUFFIXES = {1: '.exe', 2: '.pkg', 4: '.sh'}
+#: Content of the installer files
+INSTALLER_DATA = b'\0' * 1024
+
+
+def game_name(index):
+    """
+    Get the name of a synthetic game.
+    :param int index: - number of the game
+    """
+    return 'game_%05d' % index
+
+
+def installer_platform(number):
+    """
+    Get the platform of an installer.
+    :param int number: - number of the installer
+    """
+    return 1 << (number % 3)
+
+
+def installer_name(name, number):
+    """
+    Get the file name of an installer.
+    :param string name: - game name
+    :param int number: - number of the installer
+    """
+    return 'setup_%s_%s%s' % (
+        name, number, PLATFORM_SUFFIXES[installer_platform(number)])
+
+
+def synthetic_game(index):
+    """
+    Create a game record resembling the lgogdownloader cache.
+    :param int index: - number of the game
+    """
+    _name = game_name(index)
+
+    def _file(kind, number, platform, file_name=None):
+        _record = {
+            'gamename': _name,
+            'id': '%s%s' % (kind, number),
+            'name': '%s %s' % (kind, number),
+            'path': '/%s/%s' % (_name,
+                                file_name or 'en1%s%s' % (kind, number)),
+            'platform': platform,
+            'language': 1,
+            'size': '%s MB' % (100 + number),
+            'silent': 0,
+            'type': 1,
+            'updated': 0,
+            'version': '1.%s.%s' % (index, number),
+            'galaxy_downloadlink_json_url': 'https://api.gog.com/%s/%s' % (
+                _name, 'x' * 120)
+        }
+        if file_name is not None:
+            _record['md5'] = hashlib.md5(INSTALLER_DATA).hexdigest()
+        return _record
+
+    return {
+        'gamename': _name,
+        'title': 'Synthetic Game %s' % index,
+        'icon': 'https://images.gog.com/%s.png' % _name,
+        'product_id': str(1000000 + index),
+        'serials': '',
+        'changelog': 'Changes ' * 200,
+        'installers': [_file('installer', _number,
+                             installer_platform(_number),
+                             installer_name(_name, _number))
+                       for _number in range(INSTALLERS)],
+        'extras': [_file('extra', _number, 0) for _number in range(10)],
+        'patches': [_file('patch', _number, 1) for _number in range(4)],
+        'languagepacks': [],
+        'dlcs': []
+    }
+
+
+def write_catalog(path, games):
+    """
+    Write a synthetic catalog without holding it in memory.
+    :param string path: - output path
+    :param int games: - number of games
+    """
+    with open(path, 'w', encoding='utf-8') as _file:
+        _file.write('{"date": "20200101T000000", "games": [')
+        for _index in range(games):
+            if _index:
+                _file.write(',\n')
+            json.dump(synthetic_game(_index), _file)
+        _file.write('], "gamedetails-cache-version": 3}')
+
+
+def write_library(root, games, downloaded=0.2, partial=0.05):
+    """
+    Write a GOG library with installers of a part of the catalog games.
+    Returns names of the games with files on disk.
+    :param string root: - path to the library
+    :param int games: - number of games in the catalog
+    :param float downloaded: - fraction of games with all installers
+    :param float partial: - fraction of games with the Windows installers only
+    """
+    _names = []
+    _full = int(games * downloaded)
+    _partial = int(games * partial)
+    # Spread the downloaded games over the whole catalog
+    _step = games / max(_full + _partial, 1)
+    for _position in range(_full + _partial):
+        _name = game_name(int(_position * _step))
+        _path = os.path.join(root, _name)
+        os.makedirs(_path, exist_ok=True)
+        for _number in range(INSTALLERS):
+            if _position >= _full and installer_platform(_number) != 1:
+                continue
+            with open(os.path.join(_path, installer_name(_name, _number)),
+                      'wb') as _file:
+                _file.write(INSTALLER_DATA)
+        _names.append(_name)
+    return _names
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    _parser.add_argument('--games', type=int, default=1000)
+    _parser.add_argument('--cache', required=True,
+                         help="directory for gamedetails.json")
+    _parser.add_argument('--library', required=True,
+                         help="directory for the GOG library")
+    _parser.add_argument('--downloaded', type=float, default=0.2,
+                         help="fraction of downloaded games")
+    _args = _parser.parse_args()
+    os.makedirs(_args.cache, exist_ok=True)
+    os.makedirs(_args.library, exist_ok=True)
+    write_catalog(os.path.join(_args.cache, 'gamedetails.json'), _args.games)
+    _names = write_library(_args.library, _args.games, _args.downloaded)
+    print(json.dumps({'games': _args.games, 'ondisk': len(_names)}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Process wide cache of the parsed lgogdownloader catalog (gamedetails.json).
+"""
+
+import os
+import json
+from threading import Lock, Thread
+
+import config
+from main import app
+from metrics import CATALOG_CHANGES
+
+
+#: Fields of the game records used by lgogwebui
+GAME_FIELDS = ('gamename', 'title', 'icon')
+#: Fields of the installer records used by lgogwebui
+INSTALLER_FIELDS = ('platform', 'name', 'path', 'filepath', 'size', 'version',
+                    'md5')
+#: Size of chunks read from the catalog file
+CHUNK_SIZE = 65536
+
+
+def _trim(game_data):
+    """
+    Keep only the fields used by lgogwebui from a game record.
+    :param dict game_data: - full game record from gamedetails.json
+    """
+    _game = {_key: game_data[_key] for _key in GAME_FIELDS
+             if _key in game_data}
+    if 'installers' in game_data:
+        _game['installers'] = [
+            {_key: _inst[_key] for _key in INSTALLER_FIELDS if _key in _inst}
+            for _inst in game_data['installers']]
+    return _game
+
+
+class _Reader:
+    """
+    Incremental reader of JSON values from a text file.
+    """
+
+    _WHITESPACE = ' \t\n\r'
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        _data = self._stream.read(CHUNK_SIZE)
+        if not _data:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + _data
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """
+        Get the next non-whitespace character without consuming it.
+        """
+        while True:
+            while self._pos < len(self._buffer) and \
+                    self._buffer[self._pos] in self._WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of the catalog file")
+
+    def expect(self, chars):
+        """
+        Consume the next non-whitespace character if it is one of chars.
+        """
+        _char = self.peek()
+        if _char not in chars:
+            raise ValueError("Expected %r in the catalog, got %r" %
+                             (chars, _char))
+        self._pos += 1
+        return _char
+
+    def value(self):
+        """
+        Decode the next JSON value, reading more data until it is complete.
+        """
+        self.peek()
+        while True:
+            try:
+                _value, _end = self._decoder.raw_decode(self._buffer,
+                                                        self._pos)
+                # A number may continue in the next chunk
+                if _end < len(self._buffer) or self._eof or \
+                        not isinstance(_value, (int, float)):
+                    self._pos = _end
+                    return _value
+            except ValueError:
+                if self._eof:
+                    raise
+            self._fill()
+
+
+def iter_games(path):
+    """
+    Iterate over game records of gamedetails.json without loading the whole
+    file. Only the fields listed in GAME_FIELDS and INSTALLER_FIELDS are kept,
+    so the memory use does not depend on the size of the catalog.
+    :param string path: - path to gamedetails.json
+    """
+    with open(path, encoding='utf-8') as _file:
+        _reader = _Reader(_file)
+        _reader.expect('{')
+        if _reader.peek() == '}':
+            return
+        while True:
+            _key = _reader.value()
+            _reader.expect(':')
+            if _key == 'games' and _reader.peek() == '[':
+                _reader.expect('[')
+                if _reader.peek() == ']':
+                    _reader.expect(']')
+                else:
+                    while True:
+                        yield _trim(_reader.value())
+                        if _reader.expect(',]') == ']':
+                            break
+            else:
+                _reader.value()
+            if _reader.expect(',}') == '}':
+                return
+
+
+class CatalogSnapshot:
+    """
+    Immutable view of a single version of the lgogdownloader catalog.
+    """
+
+    def __init__(self, games=(), signature=None):
+        #: Tuple with game records in the order of the cache file
+        self.games = tuple(games)
+        #: Game records indexed by the lgogdownloader game name
+        self.index = {_game['gamename']: _game for _game in self.games}
+        #: (mtime, inode, size) of the file the snapshot was loaded from
+        self.signature = signature
+
+    def get(self, game_name):
+        """
+        Get the catalog record of a game.
+        :param string game_name: - lgogdownloader game name
+        """
+        return self.index.get(game_name)
+
+    def __len__(self):
+        return len(self.games)
+
+    def __iter__(self):
+        return iter(self.games)
+
+
+class CatalogChanges:
+    """
+    Difference between two catalog snapshots.
+    """
+
+    def __init__(self, added=(), removed=(), changed=(), updated=()):
+        #: Names of games new in the catalog
+        self.added = tuple(added)
+        #: Names of games no longer in the catalog
+        self.removed = tuple(removed)
+        #: Names of games with new, removed or changed installers
+        self.changed = tuple(changed)
+        #: Names of games with changed title or icon only
+        self.updated = tuple(updated)
+
+    @property
+    def installers(self):
+        """
+        Names of games whose installers have to be checked again.
+        """
+        return self.added + self.changed
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed or
+                    self.updated)
+
+    def __str__(self):
+        return "%s added, %s removed, %s changed, %s updated" % (
+            len(self.added), len(self.removed), len(self.changed),
+            len(self.updated))
+
+
+def diff_catalogs(old, new):
+    """
+    Compare two catalog snapshots. Installers are compared by all fields
+    kept in the catalog, i.e. also by version, size and md5.
+    :param CatalogSnapshot old: - previous snapshot
+    :param CatalogSnapshot new: - current snapshot
+    """
+    _added = []
+    _changed = []
+    _updated = []
+    for _game in new:
+        _old = old.get(_game['gamename'])
+        if _old is None:
+            _added.append(_game['gamename'])
+        elif _old.get('installers') != _game.get('installers'):
+            _changed.append(_game['gamename'])
+        elif _old != _game:
+            _updated.append(_game['gamename'])
+    _removed = [_game['gamename'] for _game in old
+                if new.get(_game['gamename']) is None]
+    return CatalogChanges(_added, _removed, _changed, _updated)
+
+
+def available_platforms(game_data):
+    """
+    Get the bitmask of platforms with installers available for a game.
+    :param dict game_data: - game record from the catalog
+    """
+    _available = 0
+    for inst in game_data.get('installers', ()):
+        _available |= inst['platform']
+    return _available
+
+
+class Catalog:
+    """
+    Lazily loaded catalog that is reloaded in the background whenever the
+    underlying file changes. Readers always get a complete snapshot - the old
+    one is served until the new one is fully parsed. Every reload records the
+    changes against the previous snapshot.
+    """
+
+    def __init__(self, path):
+        #: Path to gamedetails.json
+        self.path = path
+        #: CatalogChanges of the last reload
+        self.changes = CatalogChanges()
+        self._snapshot = None
+        self._lock = Lock()
+        self._reloading = False
+
+    def _stat(self):
+        try:
+            _stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (_stat.st_mtime_ns, _stat.st_ino, _stat.st_size)
+
+    def _load(self, signature):
+        if signature is None:
+            return CatalogSnapshot()
+        try:
+            return CatalogSnapshot(iter_games(self.path), signature)
+        except FileNotFoundError:
+            return CatalogSnapshot()
+
+    def _publish(self, snapshot, since=None):
+        """
+        Replace the current snapshot and record the changes against since
+        or the current snapshot. Must be called with the lock held.
+        """
+        if since is None:
+            since = self._snapshot
+        if since is not None:
+            self.changes = diff_catalogs(since, snapshot)
+            for _kind in ('added', 'removed', 'changed', 'updated'):
+                CATALOG_CHANGES.inc(_kind,
+                                    amount=len(getattr(self.changes, _kind)))
+        else:
+            self.changes = CatalogChanges(
+                added=[_game['gamename'] for _game in snapshot])
+        self._snapshot = snapshot
+        app.logger.info("Catalog reloaded: %s games, %s.", len(snapshot),
+                        self.changes)
+        return self.changes
+
+    def _reload(self, signature):
+        try:
+            _snapshot = self._load(signature)
+            with self._lock:
+                self._publish(_snapshot)
+        except Exception:
+            app.logger.error("Catalog reload raised an error", exc_info=True)
+        finally:
+            with self._lock:
+                self._reloading = False
+
+    def snapshot(self):
+        """
+        Get the current catalog snapshot. The first call parses the file
+        synchronously, subsequent changes are picked up in the background.
+        """
+        _signature = self._stat()
+        with self._lock:
+            _current = self._snapshot
+            if _current is not None and _current.signature == _signature:
+                return _current
+            if _current is not None:
+                if not self._reloading:
+                    self._reloading = True
+                    Thread(target=self._reload, args=(_signature,),
+                           name="CatalogReload", daemon=True).start()
+                return _current
+        # Nothing loaded yet - parse in the calling thread
+        _snapshot = self._load(_signature)
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = _snapshot
+            return self._snapshot
+
+    def reload(self, since=None):
+        """
+        Synchronously reload the catalog, e.g. after a cache update.
+        Returns (snapshot, CatalogChanges).
+        :param CatalogSnapshot since: - snapshot the changes are computed
+                                        against, the current one by default
+        """
+        _signature = self._stat()
+        _snapshot = self._load(_signature)
+        with self._lock:
+            _changes = self._publish(_snapshot, since)
+        return _snapshot, _changes
+
+
+#: Catalog shared by the web routes and the daemon workers
+CATALOG = Catalog(os.path.join(config.lgog_cache, 'gamedetails.json'))
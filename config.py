@@ -6,6 +6,8 @@ import os
 lgog_config = os.path.expanduser(os.environ.get("LGOG_CONFIG", "~/.config/lgogdownloader"))
 #: Path to lgogdownloader cache
 lgog_cache = os.path.expanduser(os.environ.get("LGOG_CACHE", "~/.cache/lgogdownloader"))
+#: Path to the cache of game icons
+icon_cache = os.path.expanduser(os.environ.get("LGOG_ICONS", os.path.join(lgog_cache, "icons")))
 #: Path to GOG game library
 lgog_library = os.path.expanduser(os.environ.get("GOG_DIR", "~/GOG"))
 #: Script name - set when behind reverse proxy
@@ -14,3 +16,46 @@ script_name = os.environ.get("SCRIPT_NAME", "")
 command_timeout = 600
 #: Time between updates
 update_period = 86400
+#: Minimal time between rescans of the GOG library directories
+ondisk_refresh_period = 60
+#: Time to collect changes of the library before its snapshot is rebuilt
+library_rebuild_delay = 1
+#: Time between writes of the download progress to the DB
+progress_persist_period = 10
+#: Time between keep-alive messages sent to the event stream clients
+events_keepalive = 15
+#: Maximal number of games checked by a single lgogdownloader status query
+status_batch_size = 50
+#: Maximal run time of a status query per checked game. lgogdownloader
+#: hashes the installers on disk, so the time grows with the batch size.
+status_game_timeout = 600
+#: Minimal time between two lgogdownloader status queries
+status_check_interval = 10
+#: Time after which the status of unchanged games is checked again
+status_max_age = 7 * 86400
+#: Number of games downloaded concurrently
+download_workers = int(os.environ.get("LGOG_DOWNLOAD_WORKERS", "2"))
+#: Number of lgogdownloader threads used by a single download
+download_threads = int(os.environ.get("LGOG_DOWNLOAD_THREADS", "1"))
+#: Limit of lgogdownloader threads used by all downloads
+download_max_threads = int(os.environ.get("LGOG_DOWNLOAD_MAX_THREADS", "2"))
+#: Download backend, "lgogdownloader" or "http"
+download_backend = os.environ.get("LGOG_DOWNLOAD_BACKEND", "lgogdownloader")
+#: Base URL the installer paths are resolved against by the http backend
+download_url = os.environ.get("LGOG_DOWNLOAD_URL", "")
+#: Number of parallel range requests of a download by the http backend
+download_segments = int(os.environ.get("LGOG_DOWNLOAD_SEGMENTS", "4"))
+#: Retries of a range request failing without progress
+download_retries = 5
+#: Number of threads verifying installer checksums, 0 leaves it to lgogdownloader
+verify_workers = int(os.environ.get("LGOG_VERIFY_WORKERS", "2"))
+#: Limit of the read rate of every verifying thread in MB/s
+verify_rate = float(os.environ.get("LGOG_VERIFY_RATE", "100"))
+#: Enable request timing and the profiling hooks
+profiling = os.environ.get("LGOG_PROFILING", "0") == "1"
+#: Requests taking longer (in seconds) are logged when profiling is enabled
+slow_request_threshold = float(os.environ.get("LGOG_SLOW_REQUEST", "1.0"))
+#: Directory for the profiler reports
+profile_dir = os.path.expanduser(os.environ.get("LGOG_PROFILE_DIR", os.path.join(lgog_cache, "profiles")))
+#: Time in seconds to wait for a locked DB
+db_busy_timeout = 30
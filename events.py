@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Publish/subscribe bus pushing download and login state changes to clients.
+"""
+
+import json
+import uuid
+from collections import deque
+from threading import Condition
+
+from sqlalchemy import event, inspect
+
+from models import Game, User, Status
+
+
+class EventBus:
+    """
+    Bounded history of events with monotonically increasing ids. Subscribers
+    wait for events newer than the last one they have seen, so a reconnecting
+    client can resume from its Last-Event-ID.
+    """
+
+    def __init__(self, history=1000):
+        self._events = deque(maxlen=history)
+        self._seq = 0
+        self._version = 0
+        self._cond = Condition()
+        #: Unique id of the process, keeps versions distinct across restarts
+        self.epoch = uuid.uuid4().hex[:8]
+
+    @property
+    def seq(self):
+        """
+        Id of the last published event.
+        """
+        return self._seq
+
+    @property
+    def version(self):
+        """
+        Counter incremented on every change of the data served to clients.
+        """
+        return self._version
+
+    def touch(self):
+        """
+        Mark a change of the served data that is not pushed as an event.
+        """
+        with self._cond:
+            self._version += 1
+            return self._version
+
+    def publish(self, kind, data):
+        """
+        Publish an event to all subscribers.
+        :param string kind: - event type (progress, status, user, library)
+        :param dict data: - JSON serializable event payload
+        """
+        with self._cond:
+            self._seq += 1
+            self._version += 1
+            self._events.append((self._seq, kind, data))
+            self._cond.notify_all()
+            return self._seq
+
+    def wait(self, after, timeout=None):
+        """
+        Get events published after the given id. Blocks until at least one
+        event is available or the timeout expires.
+        :param int after: - id of the last event seen by the subscriber
+        :param float timeout: - maximal wait time in seconds
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after, timeout)
+            return [_event for _event in self._events if _event[0] > after]
+
+
+def format_sse(seq, kind, data):
+    """
+    Format an event for the text/event-stream response.
+    :param int seq: - event id
+    :param string kind: - event type
+    :param dict data: - event payload
+    """
+    return "id: %s\nevent: %s\ndata: %s\n\n" % (seq, kind, json.dumps(data))
+
+
+def game_status(game):
+    """
+    Get the status of a game as reported to the web clients.
+    :param Game game: - game loaded from the DB
+    """
+    _result = {
+        'state': game.state.name,
+        'progress': game.progress
+        }
+    if game.state == Status.done:
+        _result['progress'] = 100
+    elif game.state != Status.queued and game.state != Status.running:
+        _result['progress'] = 0
+    return _result
+
+
+def user_status(user):
+    """
+    Get the status of the user session as reported to the web clients.
+    :param User user: - user loaded from the DB
+    """
+    _last_update = user.last_update
+    if _last_update is not None:
+        _last_update = int(_last_update.timestamp())
+    else:
+        _last_update = 0
+    return {
+        'user_status': user.state.name,
+        'last_update': _last_update
+        }
+
+
+#: Bus shared by the daemon workers and the web routes
+EVENTS = EventBus()
+
+
+def _collect_changes(session, flush_context):
+    """
+    Remember state of games and users changed by the flush.
+    """
+    _changes = session.info.setdefault('events', {})
+    for _obj in list(session.new) + list(session.dirty) + \
+            list(session.deleted):
+        if isinstance(_obj, (Game, User)):
+            session.info['touched'] = True
+        if _obj in session.deleted:
+            continue
+        if isinstance(_obj, Game):
+            _attrs = inspect(_obj).attrs
+            if _obj in session.new or \
+                    _attrs.state.history.has_changes() or \
+                    _attrs.progress.history.has_changes():
+                _changes.setdefault('status', {})[_obj.name] = \
+                    game_status(_obj)
+        elif isinstance(_obj, User):
+            _changes['user'] = user_status(_obj)
+
+
+def _publish_changes(session):
+    """
+    Publish state of games and users changed in the committed transaction.
+    """
+    _changes = session.info.pop('events', None)
+    if session.info.pop('touched', False):
+        EVENTS.touch()
+    if not _changes:
+        return
+    for _kind, _data in _changes.items():
+        EVENTS.publish(_kind, _data)
+
+
+def _discard_changes(session, previous_transaction):
+    session.info.pop('events', None)
+    session.info.pop('touched', None)
+
+
+def install(session_factory):
+    """
+    Publish events for Game and User changes committed by the sessions
+    created by the factory.
+    :param sessionmaker session_factory: - session factory to observe
+    """
+    event.listen(session_factory, 'after_flush', _collect_changes)
+    event.listen(session_factory, 'after_commit', _publish_changes)
+    event.listen(session_factory, 'after_soft_rollback', _discard_changes)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Compact column oriented in-memory table of the game library.
+"""
+
+from array import array
+
+from icons import icon_key
+from models import Status
+
+#: Platform bits (1 - windows, 2 - macos, 4 - linux)
+PLATFORMS = (1, 2, 4)
+
+
+def platform_flags(mask):
+    """
+    Convert platform bitmask into a dictionary of flags.
+    :param int mask: - platform bitmask (1 - windows, 2 - macos, 4 - linux)
+    """
+    return {
+        'windows': (mask & 1 == 1),
+        'macos': (mask & 2 == 2),
+        'linux': (mask & 4 == 4)
+        }
+
+
+def selected_platforms(platform, available, user_platform):
+    """
+    Get the bitmask of platforms selected for download for a game.
+    :param int platform: - platforms selected for the game, -1 for default
+    :param int available: - bitmask of available platforms
+    :param int user_platform: - default platforms bitmask of the user
+    """
+    if platform >= 0:
+        return platform
+    return available & user_platform
+
+
+def bitset(values):
+    """
+    Build a bitset with the bit of every row set when its value is true.
+    :param iterable values: - truth values in the row order
+    """
+    _bits = ''.join(['1' if _value else '0' for _value in values])
+    return int(_bits[::-1] or '0', 2)
+
+
+def bitset_rows(bits):
+    """
+    Get indices of rows set in a bitset in ascending order.
+    :param int bits: - bitset
+    """
+    _bits = bin(bits)[:1:-1]
+    _rows = []
+    _row = _bits.find('1')
+    while _row >= 0:
+        _rows.append(_row)
+        _row = _bits.find('1', _row + 1)
+    return _rows
+
+
+class GameTable:
+    """
+    Library stored as parallel columns: lists of strings and arrays of
+    integers. Every platform bit, state and counter test is additionally kept
+    as a bitset over all rows (a Python integer), so filters combine whole
+    columns with a few big integer operations instead of a per-row loop.
+    """
+
+    __slots__ = ('names', 'titles', 'icons', 'icon_ids', 'index', 'available',
+                 'selected', 'ondisk', 'user_selected', 'state', 'progress',
+                 'done_count', 'missing_count', 'update_count', 'all',
+                 '_platform_bits', '_state_bits', '_missing_bits',
+                 '_update_bits')
+
+    def __init__(self, rows, user_platform):
+        """
+        :param iterable rows: - (game_data, available, row) tuples with the
+                                catalog record, available platforms and the
+                                DB state of every game
+        :param int user_platform: - default platforms bitmask of the user
+        """
+        self.names = []
+        self.titles = []
+        self.icons = []
+        self.icon_ids = []
+        self.available = array('b')
+        self.selected = array('b')
+        self.ondisk = array('b')
+        self.user_selected = array('b')
+        self.state = array('b')
+        self.progress = array('f')
+        self.done_count = array('i')
+        self.missing_count = array('i')
+        self.update_count = array('i')
+        for _game_data, _available, _row in rows:
+            _selected = selected_platforms(_row['platform'], _available,
+                                           user_platform)
+            _ondisk = _row['platform_ondisk'] or 0
+            _missing = int(_row['missing_count'] or 0)
+            # Selected platforms that are not on disk count as missing
+            if _missing == 0 and _selected != (_ondisk & _selected):
+                _missing = 1
+            self.names.append(_game_data['gamename'])
+            self.titles.append(_game_data['title'])
+            self.icons.append(_game_data['icon'])
+            self.icon_ids.append(icon_key(_game_data['icon']))
+            self.available.append(_available)
+            self.selected.append(_selected)
+            self.ondisk.append(_ondisk)
+            self.user_selected.append(_row['platform'] >= 0)
+            self.state.append(_row['state'].value)
+            self.progress.append(_row['progress'] or 0)
+            self.done_count.append(int(_row['done_count'] or 0))
+            self.missing_count.append(_missing)
+            self.update_count.append(int(_row['update_count'] or 0))
+        self.index = {_name: _row for _row, _name in enumerate(self.names)}
+        #: Bitset with all rows set
+        self.all = (1 << len(self.names)) - 1
+        self._platform_bits = {}
+        for _column in ('available', 'selected', 'ondisk'):
+            _values = getattr(self, _column)
+            for _platform in PLATFORMS:
+                self._platform_bits[(_column, _platform)] = bitset(
+                    _value & _platform for _value in _values)
+        self._state_bits = {
+            _state: bitset(_value == _state.value for _value in self.state)
+            for _state in Status}
+        self._missing_bits = bitset(self.missing_count)
+        self._update_bits = bitset(self.update_count)
+
+    def __len__(self):
+        return len(self.names)
+
+    def with_platforms(self, column, mask):
+        """
+        Bitset of rows with all platforms of the mask set in a column.
+        :param string column: - one of available, selected, ondisk
+        :param int mask: - platform bitmask
+        """
+        _bits = self.all
+        for _platform in PLATFORMS:
+            if mask & _platform:
+                _bits &= self._platform_bits[(column, _platform)]
+        return _bits
+
+    def with_states(self, states):
+        """
+        Bitset of rows in any of the states.
+        :param iterable states: - Status values
+        """
+        _bits = 0
+        for _state in states:
+            _bits |= self._state_bits[_state]
+        return _bits
+
+    def with_missing(self):
+        """
+        Bitset of rows with missing files.
+        """
+        return self._missing_bits
+
+    def with_updates(self):
+        """
+        Bitset of rows with files that require an update.
+        """
+        return self._update_bits
+
+    def rows(self, bits=None):
+        """
+        Get indices of rows in a bitset, all rows by default.
+        :param int bits: - bitset
+        """
+        if bits is None:
+            return range(len(self.names))
+        return bitset_rows(bits)
+
+    def record(self, row):
+        """
+        Get the game description used by the library page and the JSON API.
+        :param int row: - row index
+        """
+        return {
+            'gamename': self.names[row],
+            'title': self.titles[row],
+            'icon': self.icons[row],
+            'icon_id': self.icon_ids[row],
+            'state': Status(self.state[row]).name,
+            'progress': int(self.progress[row]),
+            'done_count': self.done_count[row],
+            'missing_count': self.missing_count[row],
+            'update_count': self.update_count[row],
+            'user_selected': bool(self.user_selected[row]),
+            'available': platform_flags(self.available[row]),
+            'selected': platform_flags(self.selected[row]),
+            'ondisk': platform_flags(self.ondisk[row])
+            }
+
+    def records(self, rows=None):
+        """
+        Get game descriptions of rows, all rows by default.
+        :param iterable rows: - row indices
+        """
+        return [self.record(_row) for _row in
+                (self.rows() if rows is None else rows)]
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Segmented HTTP download engine, an alternative to the lgogdownloader
+downloads. Files are fetched with parallel range requests over pooled
+keep-alive connections and resumed from partial files.
+"""
+
+import os
+import json
+import http.client
+from threading import Lock, Event
+from urllib.parse import urlsplit, urljoin
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+
+import config
+from main import app
+from verify import hash_file, installer_file_name
+
+#: Size of the blocks read from a connection at once
+CHUNK_SIZE = 2**20
+#: Minimal size of a segment fetched by a single range request
+MIN_SEGMENT = 8 * 2**20
+#: Suffix of a file being downloaded
+PART_SUFFIX = '.part'
+#: Suffix of the file with the downloaded ranges of a partial file
+STATE_SUFFIX = '.part.json'
+#: Maximal number of redirects followed when a download starts
+MAX_REDIRECTS = 5
+#: Maximal time between retries of a failed range request
+MAX_BACKOFF = 30
+#: HTTP status codes of redirects
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class DownloadCancelled(Exception):
+    """
+    Exception thrown when a download is stopped by the cancellation event.
+    """
+    pass
+
+
+class DownloadError(OSError):
+    """
+    Exception thrown when a server does not return the requested data.
+    """
+    pass
+
+
+def installer_downloads(game_data, platform, base_url, directory):
+    """
+    Get the installer files of a game to download. The installer paths from
+    the catalog are resolved against a base URL.
+    :param dict game_data: - game record from the catalog
+    :param int platform: - selected platforms bitmask
+    :param string base_url: - URL of the directory with the installers
+    :param string directory: - path to the game directory
+    """
+    return [{
+        'url': urljoin(base_url.rstrip('/') + '/', _inst['path'].lstrip('/')),
+        'path': os.path.join(directory, installer_file_name(_inst)),
+        'md5': _inst.get('md5')
+    } for _inst in game_data.get('installers', ())
+        if _inst['platform'] & platform]
+
+
+def _preallocate(fd, size):
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            # Filesystems without fallocate support
+            pass
+    os.ftruncate(fd, size)
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP connections shared by the download threads. A connection
+    returns to the pool only after its response was read completely.
+    """
+
+    def __init__(self, timeout=60, max_idle=16):
+        """
+        :param float timeout: - socket timeout in seconds
+        :param int max_idle: - idle connections kept per server
+        """
+        #: Socket timeout in seconds
+        self.timeout = timeout
+        #: Idle connections kept per server
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = Lock()
+
+    def request(self, method, url, headers=None):
+        """
+        Send a request over a pooled connection. Returns (connection,
+        response), the connection has to be given back with release.
+        :param string method: - HTTP method
+        :param string url: - requested URL
+        :param dict headers: - request headers
+        """
+        _url = urlsplit(url)
+        _key = (_url.scheme, _url.netloc)
+        _target = _url.path or '/'
+        if _url.query:
+            _target += '?' + _url.query
+        while True:
+            with self._lock:
+                _idle = self._idle.get(_key)
+                _connection = _idle.pop() if _idle else None
+            _reused = _connection is not None
+            if not _reused:
+                if _url.scheme == 'https':
+                    _connection = http.client.HTTPSConnection(
+                        _url.netloc, timeout=self.timeout)
+                else:
+                    _connection = http.client.HTTPConnection(
+                        _url.netloc, timeout=self.timeout)
+            try:
+                _connection.request(method, _target, headers=headers or {})
+                return _connection, _connection.getresponse()
+            except (http.client.HTTPException, OSError):
+                _connection.close()
+                # The server may close an idle connection at any time
+                if not _reused:
+                    raise
+
+    def release(self, url, connection, response):
+        """
+        Give a connection back to the pool, or close it when the response
+        was not read completely.
+        :param string url: - requested URL
+        :param HTTPConnection connection: - connection returned by request
+        :param HTTPResponse response: - response returned by request
+        """
+        if response.isclosed() and not response.will_close:
+            _url = urlsplit(url)
+            with self._lock:
+                _idle = self._idle.setdefault((_url.scheme, _url.netloc), [])
+                if len(_idle) < self.max_idle:
+                    _idle.append(connection)
+                    return
+        connection.close()
+
+
+class PartialFile:
+    """
+    File being downloaded in segments. The data is written into
+    a preallocated file next to the target and the downloaded ranges are
+    stored aside, so an interrupted download resumes where it stopped.
+    """
+
+    def __init__(self, url, path, size, segments, md5=None):
+        """
+        :param string url: - URL of the file
+        :param string path: - target path
+        :param int size: - file size in bytes
+        :param int segments: - number of segments of a new download
+        :param string md5: - expected checksum or None
+        """
+        #: URL of the file
+        self.url = url
+        #: Target path
+        self.path = path
+        #: File size in bytes
+        self.size = size
+        #: Expected checksum or None
+        self.md5 = md5
+        #: [start, end, next offset] of every segment
+        self.segments = None
+        self.lock = Lock()
+        self._fd = None
+        _part = path + PART_SUFFIX
+        try:
+            with open(path + STATE_SUFFIX, encoding='utf-8') as _file:
+                _state = json.load(_file)
+            if _state['size'] == size and os.path.getsize(_part) == size:
+                self.segments = _state['segments']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        if self.segments is None:
+            _count = max(min(segments, size // MIN_SEGMENT), 1)
+            _bounds = [size * _index // _count for _index in range(_count + 1)]
+            self.segments = [[_start, _end, _start] for _start, _end
+                             in zip(_bounds, _bounds[1:])]
+            self._fd = os.open(_part, os.O_RDWR | os.O_CREAT | os.O_TRUNC,
+                               0o644)
+            _preallocate(self._fd, size)
+        else:
+            app.logger.info("Resume download of %s at %s of %s bytes",
+                            path, self.downloaded(), size)
+            self._fd = os.open(_part, os.O_RDWR)
+
+    def downloaded(self):
+        """
+        Number of downloaded bytes.
+        """
+        with self.lock:
+            return sum(_offset - _start for _start, _end, _offset
+                       in self.segments)
+
+    def write(self, segment, data):
+        """
+        Write data at the next offset of a segment.
+        :param list segment: - one of the segments
+        :param memoryview data: - downloaded data
+        """
+        os.pwrite(self._fd, data, segment[2])
+        with self.lock:
+            segment[2] += len(data)
+
+    def restart(self, segment):
+        """
+        Download a segment again from its start.
+        :param list segment: - one of the segments
+        """
+        with self.lock:
+            segment[2] = segment[0]
+
+    def save(self):
+        """
+        Store the downloaded ranges.
+        """
+        _path = self.path + STATE_SUFFIX
+        with self.lock:
+            _state = json.dumps({'size': self.size, 'segments': self.segments})
+        with open(_path + '.tmp', 'w', encoding='utf-8') as _file:
+            _file.write(_state)
+        os.replace(_path + '.tmp', _path)
+
+    def close(self):
+        """
+        Close the partial file, keeping it for a later resume.
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def complete(self):
+        """
+        Move the downloaded file to its target path. A file with a wrong
+        checksum is removed.
+        """
+        self.close()
+        _part = self.path + PART_SUFFIX
+        if self.md5 and hash_file(_part) != self.md5.lower():
+            os.remove(_part)
+            self._remove_state()
+            raise DownloadError("Checksum mismatch of %s" % self.path)
+        os.replace(_part, self.path)
+        self._remove_state()
+
+    def _remove_state(self):
+        # Downloads finished before the first save have no stored state
+        try:
+            os.remove(self.path + STATE_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+
+class HttpDownloader:
+    """
+    Download engine fetching every file in parallel segments. Failed range
+    requests are retried from the last written byte, so a broken connection
+    costs only the data in flight.
+    """
+
+    def __init__(self, segments=4, retries=5, timeout=60, poll=0.5):
+        """
+        :param int segments: - parallel range requests of a download
+        :param int retries: - retries of a range request without progress
+        :param float timeout: - socket timeout in seconds
+        :param float poll: - time between progress reports in seconds
+        """
+        #: Parallel range requests of a download
+        self.segments = segments
+        #: Retries of a range request without progress
+        self.retries = retries
+        #: Time between progress reports in seconds
+        self.poll = poll
+        #: Connections shared by all downloads
+        self.pool = ConnectionPool(timeout, max_idle=segments * 2)
+
+    def probe(self, url):
+        """
+        Get (URL, size, ranges supported) of a file. Redirects are followed,
+        the returned URL is the final one.
+        :param string url: - URL of the file
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            _connection, _response = self.pool.request('HEAD', url)
+            _response.read()
+            self.pool.release(url, _connection, _response)
+            if _response.status in REDIRECTS:
+                url = urljoin(url, _response.getheader('Location', ''))
+                continue
+            if _response.status != 200:
+                raise DownloadError("HTTP %s %s for %s" % (
+                    _response.status, _response.reason, url))
+            _length = _response.getheader('Content-Length')
+            if _length is None:
+                raise DownloadError("Unknown size of %s" % url)
+            return (url, int(_length),
+                    _response.getheader('Accept-Ranges', '') == 'bytes')
+        raise DownloadError("Too many redirects for %s" % url)
+
+    def _fetch(self, partial, segment, stop):
+        _failures = 0
+        while segment[2] < segment[1]:
+            if stop.is_set():
+                raise DownloadCancelled()
+            _offset = segment[2]
+            try:
+                self._fetch_range(partial, segment, stop)
+            except (OSError, http.client.HTTPException) as _error:
+                # Start counting again when the request made progress
+                _failures = 1 if segment[2] > _offset else _failures + 1
+                if _failures > self.retries:
+                    raise
+                app.logger.warning(
+                    "Download of %s failed at %s: %s. Retry %s of %s.",
+                    partial.path, segment[2], _error, _failures,
+                    self.retries)
+                if stop.wait(min(2 ** _failures, MAX_BACKOFF)):
+                    raise DownloadCancelled()
+
+    def _fetch_range(self, partial, segment, stop):
+        _start, _end = segment[2], segment[1]
+        _headers = {}
+        if _start > 0 or _end < partial.size:
+            _headers['Range'] = 'bytes=%s-%s' % (_start, _end - 1)
+        _connection, _response = self.pool.request('GET', partial.url,
+                                                   _headers)
+        try:
+            if _headers and _response.status == 200 and \
+                    segment[0] == 0 and _end == partial.size:
+                # The server ignores ranges, the whole file is sent again
+                partial.restart(segment)
+            elif _headers and _response.status != 206:
+                raise DownloadError("HTTP %s %s for a range of %s" % (
+                    _response.status, _response.reason, partial.url))
+            elif not _headers and _response.status != 200:
+                raise DownloadError("HTTP %s %s for %s" % (
+                    _response.status, _response.reason, partial.url))
+            _buffer = bytearray(CHUNK_SIZE)
+            with memoryview(_buffer) as _view:
+                while segment[2] < _end:
+                    if stop.is_set():
+                        raise DownloadCancelled()
+                    _size = _response.readinto(
+                        _view[:min(CHUNK_SIZE, _end - segment[2])])
+                    if not _size:
+                        raise http.client.IncompleteRead(
+                            b'', _end - segment[2])
+                    partial.write(segment, _view[:_size])
+        finally:
+            self.pool.release(partial.url, _connection, _response)
+
+    def download(self, files, progress=None, cancel=None):
+        """
+        Download files. Files already in place with the expected size and
+        checksum are skipped. Returns the number of files.
+        :param list files: - dictionaries with url, path and optional md5
+        :param callable progress: - called with (downloaded, total) bytes from
+                                    the calling thread only
+        :param Event cancel: - stop the download when the event is set
+        """
+        _stop = cancel if cancel is not None else Event()
+        _partials = []
+        try:
+            for _file in files:
+                if _stop.is_set():
+                    raise DownloadCancelled()
+                _url, _size, _ranges = self.probe(_file['url'])
+                if os.path.isfile(_file['path']) and \
+                        os.path.getsize(_file['path']) == _size and \
+                        (not _file.get('md5') or
+                         hash_file(_file['path']) == _file['md5'].lower()):
+                    app.logger.debug("File %s is up to date", _file['path'])
+                    continue
+                os.makedirs(os.path.dirname(_file['path']), exist_ok=True)
+                _partials.append(PartialFile(
+                    _url, _file['path'], _size,
+                    self.segments if _ranges else 1, _file.get('md5')))
+            self._run(_partials, progress, _stop)
+        finally:
+            for _partial in _partials:
+                _partial.close()
+        return len(files)
+
+    def _run(self, partials, progress, cancel):
+        _total = sum(_partial.size for _partial in partials)
+        # Stops the other segments when one of them fails
+        _stop = Event()
+        _pending = {}
+        with ThreadPoolExecutor(self.segments,
+                                thread_name_prefix="HttpDownload") as _pool:
+            _futures = {}
+            for _partial in partials:
+                _segments = [_segment for _segment in _partial.segments
+                             if _segment[2] < _segment[1]]
+                _pending[_partial] = len(_segments)
+                for _segment in _segments:
+                    _futures[_pool.submit(self._fetch, _partial, _segment,
+                                          _stop)] = _partial
+            _done = [_partial for _partial, _count in _pending.items()
+                     if _count == 0]
+            try:
+                for _partial in _done:
+                    _partial.complete()
+                while _futures:
+                    _finished, _ = wait(_futures, self.poll,
+                                        return_when=FIRST_EXCEPTION)
+                    for _future in _finished:
+                        _partial = _futures.pop(_future)
+                        _future.result()
+                        _pending[_partial] -= 1
+                        if _pending[_partial] == 0:
+                            _partial.complete()
+                    if cancel.is_set():
+                        raise DownloadCancelled()
+                    for _partial, _count in _pending.items():
+                        if _count:
+                            _partial.save()
+                    if progress is not None:
+                        progress(sum(_partial.downloaded()
+                                     for _partial in partials), _total)
+            finally:
+                _stop.set()
+                wait(_futures)
+                for _partial, _count in _pending.items():
+                    if _count:
+                        _partial.save()
+        if progress is not None:
+            progress(_total, _total)
+
+
+#: Engine of the http download backend
+HTTP_DOWNLOADER = HttpDownloader(config.download_segments,
+                                 config.download_retries)
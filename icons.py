@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Local cache of game icons downloaded from GOG.
+"""
+
+import io
+import os
+import hashlib
+import tempfile
+import urllib.request
+from threading import Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from main import app
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+#: Image formats detected from the first bytes of the file
+IMAGE_TYPES = (
+    (b'\x89PNG\r\n\x1a\n', 'png', 'image/png'),
+    (b'\xff\xd8\xff', 'jpg', 'image/jpeg'),
+    (b'GIF87a', 'gif', 'image/gif'),
+    (b'GIF89a', 'gif', 'image/gif'),
+    (b'RIFF', 'webp', 'image/webp'),
+)
+#: Mime types of the stored thumbnails by file extension
+MIME_TYPES = {_ext: _mime for _magic, _ext, _mime in IMAGE_TYPES}
+
+
+def normalize_url(url):
+    """
+    Get an absolute URL of an icon. The catalog stores protocol relative
+    links.
+    :param string url: - icon URL from the catalog
+    """
+    if url.startswith('//'):
+        return 'https:' + url
+    return url
+
+
+def icon_key(url):
+    """
+    Get the cache key of an icon. The key changes with the URL, so served
+    icons never change and can be cached by the clients forever.
+    :param string url: - icon URL from the catalog
+    """
+    if not url:
+        return None
+    return hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()[:20]
+
+
+def image_type(data):
+    """
+    Get (extension, mime type) of an image.
+    :param bytes data: - image data
+    """
+    for _magic, _ext, _mime in IMAGE_TYPES:
+        if data.startswith(_magic):
+            return _ext, _mime
+    return None
+
+
+def urllib_fetcher(url, timeout=10):
+    """
+    Download an icon with urllib.
+    :param string url: - absolute icon URL
+    :param float timeout: - connection timeout in seconds
+    """
+    _request = urllib.request.Request(
+        url, headers={'User-Agent': 'lgogwebui'})
+    with urllib.request.urlopen(_request, timeout=timeout) as _response:
+        return _response.read()
+
+
+def thumbnail(data, size):
+    """
+    Resize an icon to fit the size. Without Pillow the original image is
+    kept.
+    :param bytes data: - image data
+    :param tuple size: - maximal (width, height)
+    """
+    if Image is None:
+        return data
+    with Image.open(io.BytesIO(data)) as _image:
+        if _image.width <= size[0] and _image.height <= size[1]:
+            return data
+        _image.thumbnail(size)
+        _output = io.BytesIO()
+        if _image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            _image = _image.convert('RGBA')
+        _image.save(_output, 'PNG', optimize=True)
+        return _output.getvalue()
+
+
+class IconCache:
+    """
+    Directory with thumbnails of the catalog icons, named by icon_key. Each
+    icon is fetched only once; the fetcher is a callable taking an absolute
+    URL and returning the image data, so a local stand-in can replace GOG.
+    """
+
+    def __init__(self, path, fetcher=urllib_fetcher, size=(320, 240),
+                 workers=4):
+        #: Directory with the thumbnails
+        self.path = path
+        #: Callable downloading an icon
+        self.fetcher = fetcher
+        #: Maximal size of the thumbnails
+        self.size = size
+        #: Number of parallel downloads during prefetch
+        self.workers = workers
+        self._locks = {}
+        self._lock = Lock()
+        self._prefetching = False
+        self._pending = set()
+
+    def find(self, key):
+        """
+        Get (path, mime type) of a cached icon or None.
+        :param string key: - icon key
+        """
+        for _ext, _mime in MIME_TYPES.items():
+            _path = os.path.join(self.path, '%s.%s' % (key, _ext))
+            if os.path.isfile(_path):
+                return _path, _mime
+        return None
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, Lock())
+
+    def fetch(self, url):
+        """
+        Get (path, mime type) of an icon, downloading it if it is not
+        cached. Returns None if the icon cannot be downloaded.
+        :param string url: - icon URL from the catalog
+        """
+        _key = icon_key(url)
+        if _key is None:
+            return None
+        _cached = self.find(_key)
+        if _cached is not None:
+            return _cached
+        # Concurrent requests of the same icon wait for a single download
+        with self._key_lock(_key):
+            try:
+                _cached = self.find(_key)
+                if _cached is not None:
+                    return _cached
+                return self._download(_key, url)
+            finally:
+                with self._lock:
+                    self._locks.pop(_key, None)
+
+    def _download(self, key, url):
+        try:
+            _data = self.fetcher(normalize_url(url))
+            if image_type(_data) is None:
+                app.logger.warning("Icon %s is not an image.", url)
+                return None
+            _data = thumbnail(_data, self.size)
+        except Exception as _error:
+            app.logger.warning("Download of icon %s failed: %s", url, _error)
+            return None
+        _ext, _mime = image_type(_data)
+        os.makedirs(self.path, exist_ok=True)
+        _path = os.path.join(self.path, '%s.%s' % (key, _ext))
+        with tempfile.NamedTemporaryFile(dir=self.path, delete=False,
+                                         suffix='.tmp') as _file:
+            _file.write(_data)
+        os.replace(_file.name, _path)
+        return _path, _mime
+
+    def _prefetch(self):
+        # Drain the URLs queued while the previous batch was downloaded
+        while True:
+            with self._lock:
+                _urls, self._pending = self._pending, set()
+                if not _urls:
+                    self._prefetching = False
+                    return
+            try:
+                _missing = [_url for _url in _urls
+                            if self.find(icon_key(_url)) is None]
+                app.logger.info("Prefetch of %s icons.", len(_missing))
+                with ThreadPoolExecutor(max_workers=self.workers) as _pool:
+                    list(_pool.map(self.fetch, _missing))
+            except Exception:
+                app.logger.error("Icon prefetch raised an error",
+                                 exc_info=True)
+
+    def prefetch(self, urls):
+        """
+        Download missing icons in the background. URLs given while a
+        prefetch runs are queued and downloaded by the running prefetch.
+        Returns True if a new prefetch was started.
+        :param iterable urls: - icon URLs from the catalog
+        """
+        _urls = {_url for _url in urls if _url}
+        with self._lock:
+            self._pending.update(_urls)
+            if self._prefetching or not self._pending:
+                return False
+            self._prefetching = True
+        Thread(target=self._prefetch, name="IconPrefetch",
+               daemon=True).start()
+        return True
+
+
+#: Icon cache shared by the web routes and the daemon workers
+ICONS = IconCache(config.icon_cache)
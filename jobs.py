@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Persistent queue of download jobs.
+"""
+
+from sqlalchemy import func, update, delete
+from sqlalchemy.dialects.sqlite import insert
+
+from models import DownloadJob, JobState, Session
+
+
+def enqueue(game_name, priority=0):
+    """
+    Add a download job for a game. Returns False if the game already has
+    a queued or running job.
+    :param string game_name: - lgogdownloader game name
+    :param int priority: - jobs with higher priority are started first
+    """
+    _session = Session()
+    _position = _session.query(
+        func.coalesce(func.max(DownloadJob.position), 0) + 1).scalar()
+    _result = _session.execute(
+        insert(DownloadJob).values(
+            name=game_name,
+            state=JobState.queued,
+            priority=priority,
+            position=_position
+        ).on_conflict_do_nothing(index_elements=['name']))
+    _session.commit()
+    return _result.rowcount == 1
+
+
+def claim(game_name):
+    """
+    Atomically mark a queued job as running. Returns False if the job was
+    removed or already claimed by another worker.
+    :param string game_name: - lgogdownloader game name
+    """
+    _session = Session()
+    _result = _session.execute(
+        update(DownloadJob).where(
+            DownloadJob.name == game_name,
+            DownloadJob.state == JobState.queued
+        ).values(state=JobState.running))
+    _session.commit()
+    return _result.rowcount == 1
+
+
+def finish(game_name):
+    """
+    Remove the job of a game.
+    :param string game_name: - lgogdownloader game name
+    """
+    _session = Session()
+    _session.execute(
+        delete(DownloadJob).where(DownloadJob.name == game_name))
+    _session.commit()
+
+
+def cancel(game_name):
+    """
+    Remove the job of a game if it did not start yet. Running jobs are
+    removed by finish when their worker returns.
+    :param string game_name: - lgogdownloader game name
+    """
+    _session = Session()
+    _result = _session.execute(
+        delete(DownloadJob).where(
+            DownloadJob.name == game_name,
+            DownloadJob.state == JobState.queued))
+    _session.commit()
+    return _result.rowcount == 1
+
+
+def store_order(queue):
+    """
+    Persist the order of queued jobs.
+    :param list queue: - (game name, priority) tuples in the queue order
+    """
+    _session = Session()
+    for _position, (_name, _priority) in enumerate(queue):
+        _session.execute(
+            update(DownloadJob).where(DownloadJob.name == _name).values(
+                priority=_priority, position=_position))
+    _session.commit()
+
+
+def pending():
+    """
+    Get all jobs in the order they should be started. Jobs that were running
+    when the daemon stopped are queued again.
+    """
+    _session = Session()
+    _session.execute(
+        update(DownloadJob).where(
+            DownloadJob.state == JobState.running
+        ).values(state=JobState.queued))
+    _session.commit()
+    return [(_job.name, _job.priority) for _job in
+            _session.query(DownloadJob).order_by(
+                DownloadJob.priority.desc(), DownloadJob.position,
+                DownloadJob.job_id)]
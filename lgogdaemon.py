@@ -5,21 +5,30 @@ Module with implementation of the daemon part of lgogwebui.
 
 import os
 import re
-import json
-from fcntl import fcntl, F_GETFL, F_SETFL
-from subprocess import Popen, PIPE
 from threading import Timer
 from queue import Queue
-from time import sleep
-from datetime import datetime
-from sqlalchemy.orm.exc import NoResultFound
+from datetime import datetime, timedelta
 
 import config
+import jobs
 from main import app
+from catalog import CATALOG, CatalogChanges
+from ondisk import ONDISK
+from icons import ICONS
+from progress import PROGRESS
+from snapshot import LIBRARY
+from runner import Command, CommandCancelled, run
+from httpdownload import HTTP_DOWNLOADER, DownloadCancelled, \
+    installer_downloads
+from scheduler import PacedScheduler
+from verify import VERIFIER
 from models import Game, User, LoginStatus, Status, Session
 
 
 msgQueue = Queue()
+#: Multipliers of the size units printed by lgogdownloader
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024**2, 'GB': 1024**3,
+              'TB': 1024**4}
 
 
 class LoginRequired(Exception):
@@ -29,50 +38,6 @@ class LoginRequired(Exception):
     pass
 
 
-class InteractivePopen(Popen):
-    class BufferedStream:
-        def __init__(self, stream):
-            self.stream = stream
-            self.buff = ""
-            self.data = []
-
-    def __init__(self, opts):
-        super().__init__(opts, stdout=PIPE, stderr=PIPE, stdin=PIPE,
-                         universal_newlines=True)
-        # set the O_NONBLOCK flag of stdout and stderr file descriptors:
-        _flags = fcntl(self.stdout, F_GETFL)  # get current p.stdout flags
-        fcntl(self.stdout, F_SETFL, _flags | os.O_NONBLOCK)
-        _flags = fcntl(self.stderr, F_GETFL)  # get current p.stderr flags
-        fcntl(self.stderr, F_SETFL, _flags | os.O_NONBLOCK)
-
-        self._out = self.BufferedStream(self.stdout)
-        self._err = self.BufferedStream(self.stderr)
-
-    def _scan(self, prompt, bstream):
-        if bstream.data:
-            return bstream.data.pop(0)
-        bstream.buff += bstream.stream.read(1024)
-        bstream.data = bstream.buff.split('\n')
-        bstream.buff = bstream.data.pop()
-        if re.search(prompt, bstream.buff):
-            bstream.data.append(bstream.buff)
-            bstream.buff = ''
-        if bstream.data:
-            return bstream.data.pop(0)
-        return ''
-
-    def monitor(self, wait=None):
-        if wait is not None and self.empty():
-            sleep(wait)
-        # Split on ": " to capture lines with user input
-        _out = self._scan(': $', self._out)
-        _err = self._scan(': $', self._err)
-        return _out, _err
-
-    def empty(self):
-        return not self._out.data and not self._err.data
-
-
 def login(user, password):
     """
     Login into GOG.
@@ -81,8 +46,6 @@ def login(user, password):
     """
     # All try block to get stack trace from worker thread
     try:
-        _out = ""
-        _err = ""
         _session = Session()
         _user = _session.query(User).one()
         _user.state = LoginStatus.running
@@ -99,42 +62,38 @@ def login(user, password):
         ]
         app.logger.debug("Starting login ...")
         _result = 0
-        _proc = InteractivePopen(_opts)
-        while _proc.poll() is None or not _proc.empty():
-            _out, _err = _proc.monitor(5)
-            if not _out and not _err:
-                continue
+        _proc = Command(_opts, prompt=': $', stdin=True,
+                        kind='login')
+        # Prompts without a new line are reported as soon as they are printed
+        for _stream, _line in _proc.lines(config.command_timeout):
             # Handle login requests from lgogdownloader
-            if 'Security code' in _err:
+            if _stream == 'err' and 'Security code' in _line:
                 _user.state = LoginStatus.running_2fa
                 _session.commit()
                 app.logger.debug("Wait for security code")
-                _code = msgQueue.get()
+                _code = msgQueue.get(timeout=config.command_timeout)
                 app.logger.debug("Enter the security code")
-                _proc.stdin.write("%s\n" % _code)
-                _proc.stdin.flush()
-                _err = ""
-            elif 'Login form contains reCAPTCHA' in _out:
+                _proc.write("%s\n" % _code)
+            elif 'Login form contains reCAPTCHA' in _line:
                 app.logger.error("Stop login as reCAPTCHA is required")
                 _user.state = LoginStatus.recaptcha
                 _session.commit()
                 _proc.terminate()
                 return
-            elif 'HTTP: Login successful' in _err:
+            elif 'HTTP: Login successful' in _line:
                 _result += 1
-            elif 'Galaxy: Login successful' in _err:
+            elif 'Galaxy: Login successful' in _line:
                 _result += 1
-            elif 'API: Login successful' in _err:
+            elif 'API: Login successful' in _line:
                 _result += 1
         # Check return code. If lgogdowloader was not killed by signal
         # Popen will not rise an exception
         if _proc.returncode != 0:
-            _err += _proc.stderr.read()
             raise OSError((
                 _proc.returncode,
                 "lgogdownloader returned non zero exit code."
                 "\nOUT: %s\nERR: %s" %
-                (_out, _err)
+                (_proc.out, _proc.err)
                 ))
         if _result == 3:
             _user.state = LoginStatus.logon
@@ -154,10 +113,36 @@ def login(user, password):
         Session.remove()
 
 
-def download(game_name):
+def download_job(game_name, threads=1):
+    """
+    Execute a queued download job. The job is claimed atomically, so a game
+    is never downloaded by two workers at the same time.
+    :param string game_name: - the name of a game to download
+    :param int threads: - number of lgogdownloader download threads
+    """
+    try:
+        if not jobs.claim(game_name):
+            app.logger.info("Download job of %s already claimed or removed",
+                            game_name)
+            return
+        try:
+            download(game_name, threads)
+        finally:
+            jobs.finish(game_name)
+            LIBRARY.rebuild()
+    except Exception:
+        app.logger.error("Download job of %s raised an error", game_name,
+                         exc_info=True)
+    finally:
+        Session.remove()
+
+
+def download(game_name, threads=1):
     """
-    Download a game form GOG.
+    Download a game form GOG with the backend selected by
+    config.download_backend.
     :param string game_name: - the name of a game to download
+    :param int threads: - number of lgogdownloader download threads
     """
     # All try block to get stack trace from worker thread
     try:
@@ -170,181 +155,329 @@ def download(game_name):
             )
             return
         game = _session.query(Game).filter(Game.name == game_name).one()
-        # Run in GOG library folder
-        os.chdir(config.lgog_library)
+        _backend = DOWNLOAD_BACKENDS.get(config.download_backend)
+        if _backend is None:
+            app.logger.error("Unknown download backend: %s",
+                             config.download_backend)
+            game.state = Status.failed
+            _session.commit()
+            return
         app.logger.debug("Download thread: %s", game.name)
         _platform = game.platform
         if _platform < 0:
             _platform = (game.platform_available & _user.platform)
-        _count = 0  # Number of retries
-        _all = 0  # Number of files to download
-        _progress = 0  # Progress in %
-        _waiting = 0  # Number of files waiting in queue
-        # Extract progress for active file
-        _re_progress = re.compile(r"(\d+)%.*ETA")
-        # Extract number of files in queue
-        _re_remain = re.compile(r"Remaining:\s+(\d+)")
+        # Register before the state is checked, so a stop request is either
+        # seen in the DB or delivered through the cancellation event
+        _download = PROGRESS.start(game.name, _platform)
+        _session.refresh(game)
+        if game.state == Status.stop:
+            app.logger.info("Game %s download stopped before start",
+                            game.name)
+            return
         game.state = Status.running
+        game.platform_ondisk = _platform
         _session.commit()
         app.logger.debug("Game %s state changed to running", game.name)
-        while _count < 5:
-            try:
-                _opts = [
-                    'lgogdownloader',
-                    '--directory', config.lgog_library,
-                    '--progress-interval', '1000',
-                    '--no-unicode',
-                    '--no-color',
-                    '--threads', '1',
-                    '--exclude', 'e,c',
-                    '--download',
-                    '--platform', str(_platform),
-                    '--game',
-                    '^'+game.name+'$'
-                ]
-                app.logger.debug("Starting download: %s", _opts)
-                _proc = Popen(_opts, stdout=PIPE, stderr=PIPE, stdin=PIPE,
-                              universal_newlines=True)
-                while _proc.poll() is None:
-                    game = _session.query(Game).filter(Game.name == game_name).one()
-                    if game.state == Status.stop:
-                        app.logger.info("Game %s downloaded stopped", game.name)
-                        _count = 100
-                        _proc.terminate()
-                        return
-                    _out = _proc.stdout.readline()
-                    _m_progress = _re_progress.search(_out)
-                    _m_remain = _re_remain.search(_out)
-                    if _m_remain is not None:
-                        _waiting = int(_m_remain.groups()[0])
-                        if _all == 0:
-                            _all = _waiting + 1
-                    if _m_progress is not None and _all != 0:
-                        # For multiple files each gets equal part of progress
-                        # bar
-                        _part = 100.0/_all
-                        # Calculate current file fraction of full progress bar
-                        _current_part = \
-                            _part * int(_m_progress.groups()[0]) / 100.0
-                        # Calculate fraction of finished files and add current
-                        # file progress
-                        _progress = \
-                            (_all - _waiting - 1) * _part + _current_part
-
-                    # app.logger.debug(_out)
-                    # app.logger.debug("PROGRESS: %s", _progress)
-                    if _progress > 100:
-                        app.logger.debug(
-                            "Bad progress: %s for %s with %s parts.",
-                            game.name, _progress, _all
-                        )
-                        app.logger.debug(_out)
-                    game.progress = round(_progress, 1)
-                    game.platform_ondisk = _platform
-                    _session.commit()
-                # Check return code. If lgogdowloader was not killed by signal
-                # Popen will not rise an exception
-                if _proc.returncode != 0:
-                    _err = _proc.stderr.read()
-                    if "Unable to read email and password" in _err:
-                        app.logger.warning("Login required.")
-                        _user.state = LoginStatus.logoff
-                        game.state = Status.failed
-                        _session.commit()
-                        return
-                    raise OSError((
-                        _proc.returncode,
-                        "lgogdownloader returned non zero exit code."
-                        "\nOUT: %s\nERR: %s" %
-                        (_out, _err)
-                        ))
-                break
-            except Exception:
-                app.logger.error(
-                    "Execution of lgogdownloader for %s raised an error",
-                    game.name, exc_info=True)
-                _count += 1
-        if _count == 5:
+
+        def _report(progress, downloaded):
+            if PROGRESS.update(game.name, round(progress, 1),
+                               int(downloaded)):
+                game.progress = round(progress, 1)
+                _session.commit()
+
+        try:
+            _all = _backend(game.name, _platform, threads, _report,
+                            _download.cancelled)
+        except LoginRequired:
+            _user.state = LoginStatus.logoff
+            game.state = Status.failed
+            _session.commit()
+            return
+        except (CommandCancelled, DownloadCancelled):
+            app.logger.info("Game %s downloaded stopped", game.name)
+            # The stop request may have been stored before the state above
+            game.state = Status.stop
+            _session.commit()
+            return
+        if _all is None:
             app.logger.error("Download of %s failed", game.name)
             game.state = Status.failed
-        elif _count > 5:
-            app.logger.debug("Terminate raises exception")
-            pass
         else:
             game.state = Status.done
             game.done_count = _all
             game.missing_count = 0
+            ONDISK.invalidate(game.name)
+            # All files were just downloaded, no status check is needed
+            game.last_checked = datetime.utcnow()
+            game.ondisk_fingerprint = ONDISK.fingerprint(game.name)
             app.logger.info("Game %s downloaded sucessfully", game.name)
         _session.commit()
     except Exception:
-        app.logger.error("Download of %s raised an error", game.name,
+        app.logger.error("Download of %s raised an error", game_name,
                          exc_info=True)
     finally:
+        PROGRESS.finish(game_name)
         Session.remove()
 
 
+def lgogdownloader_download(game_name, platform, threads, report, cancel):
+    """
+    Download a game with lgogdownloader, parsing the progress from its
+    output. Returns the number of downloaded files or None when all
+    attempts failed.
+    :param string game_name: - the name of a game to download
+    :param int platform: - selected platforms bitmask
+    :param int threads: - number of lgogdownloader download threads
+    :param callable report: - called with (progress in %, downloaded bytes)
+    :param Event cancel: - stop the download when the event is set
+    """
+    # Run in GOG library folder
+    os.chdir(config.lgog_library)
+    _count = 0  # Number of retries
+    _all = 0  # Number of files to download
+    _progress = 0  # Progress in %
+    _waiting = 0  # Number of files waiting in queue
+    # Extract progress for active file
+    _re_progress = re.compile(r"(\d+)%.*ETA")
+    # Extract number of files in queue
+    _re_remain = re.compile(r"Remaining:\s+(\d+)")
+    # Extract downloaded and total size of active file
+    _re_bytes = re.compile(
+        r"([\d.]+)\s*([kKMGT]?B)\s*/\s*([\d.]+)\s*([kKMGT]?B)")
+    _finished_bytes = 0  # Size of finished files
+    _file_bytes = (0, 0)  # Downloaded and total size of active file
+    while _count < 5:
+        try:
+            _opts = [
+                'lgogdownloader',
+                '--directory', config.lgog_library,
+                '--progress-interval', '1000',
+                '--no-unicode',
+                '--no-color',
+                '--threads', str(threads),
+                '--exclude', 'e,c',
+                '--download',
+                '--platform', str(platform),
+                '--game',
+                '^'+game_name+'$'
+            ]
+            app.logger.debug("Starting download: %s", _opts)
+            _proc = Command(_opts, kind='download')
+            for _stream, _out in _proc.lines(cancel=cancel):
+                if _stream != 'out':
+                    continue
+                _m_progress = _re_progress.search(_out)
+                _m_remain = _re_remain.search(_out)
+                _m_bytes = _re_bytes.search(_out)
+                if _m_bytes is not None:
+                    _done, _done_unit, _total, _total_unit = \
+                        _m_bytes.groups()
+                    _done = float(_done) * SIZE_UNITS[_done_unit.upper()]
+                    _total = float(_total) * SIZE_UNITS[_total_unit.upper()]
+                    # Next file started
+                    if _done < _file_bytes[0]:
+                        _finished_bytes += _file_bytes[1]
+                    _file_bytes = (_done, _total)
+                if _m_remain is not None:
+                    _waiting = int(_m_remain.groups()[0])
+                    if _all == 0:
+                        _all = _waiting + 1
+                if _m_progress is not None and _all != 0:
+                    # For multiple files each gets equal part of progress bar
+                    _part = 100.0/_all
+                    # Calculate current file fraction of full progress bar
+                    _current_part = \
+                        _part * int(_m_progress.groups()[0]) / 100.0
+                    # Calculate fraction of finished files and add current
+                    # file progress
+                    _progress = (_all - _waiting - 1) * _part + _current_part
+
+                # app.logger.debug(_out)
+                # app.logger.debug("PROGRESS: %s", _progress)
+                if _progress > 100:
+                    app.logger.debug(
+                        "Bad progress: %s for %s with %s parts.",
+                        game_name, _progress, _all
+                    )
+                    app.logger.debug(_out)
+                report(_progress, _finished_bytes + _file_bytes[0])
+            # Check return code. If lgogdowloader was not killed by signal
+            # Popen will not rise an exception
+            if _proc.returncode != 0:
+                _err = _proc.err
+                if "Unable to read email and password" in _err:
+                    app.logger.warning("Login required.")
+                    raise LoginRequired()
+                raise OSError((
+                    _proc.returncode,
+                    "lgogdownloader returned non zero exit code."
+                    "\nOUT: %s\nERR: %s" %
+                    (_proc.out, _err)
+                    ))
+            return _all
+        except (CommandCancelled, LoginRequired):
+            raise
+        except Exception:
+            app.logger.error(
+                "Execution of lgogdownloader for %s raised an error",
+                game_name, exc_info=True)
+            _count += 1
+    return None
+
+
+def http_download(game_name, platform, threads, report, cancel):
+    """
+    Download a game with the segmented HTTP engine. The installer URLs are
+    resolved against config.download_url. Returns the number of downloaded
+    files or None when all attempts failed.
+    :param string game_name: - the name of a game to download
+    :param int platform: - selected platforms bitmask
+    :param int threads: - unused, the engine uses config.download_segments
+    :param callable report: - called with (progress in %, downloaded bytes)
+    :param Event cancel: - stop the download when the event is set
+    """
+    if not config.download_url:
+        app.logger.error("The http download backend requires a download URL")
+        return None
+    _game_data = CATALOG.snapshot().get(game_name)
+    if _game_data is None:
+        app.logger.error("Game not found in lgogdownloader cache: %s",
+                         game_name)
+        return None
+    _files = installer_downloads(
+        _game_data, platform, config.download_url,
+        os.path.join(config.lgog_library, game_name))
+
+    def _progress(downloaded, total):
+        report(downloaded * 100.0 / total if total else 100.0, downloaded)
+
+    _count = 0  # Number of retries
+    while _count < 5:
+        try:
+            return HTTP_DOWNLOADER.download(_files, _progress, cancel)
+        except DownloadCancelled:
+            raise
+        except Exception:
+            app.logger.error("HTTP download of %s raised an error",
+                             game_name, exc_info=True)
+            _count += 1
+    return None
+
+
+#: Download backends selected by config.download_backend
+DOWNLOAD_BACKENDS = {
+    'lgogdownloader': lgogdownloader_download,
+    'http': http_download
+}
+
+
 def status(game_name):
     """
     Check game status and store in the DB.
     :param string game_name: - the name of a game to download
     """
+    status_batch([game_name])
+
+
+def status_batch(game_names):
+    """
+    Check status of many games and store it in the DB. Games sharing the
+    same platform selection are checked with a single lgogdownloader run for
+    every config.status_batch_size games and all results are written in one
+    transaction. A failed run is logged and the results of the other runs
+    are still stored.
+    :param list game_names: - names of games to check
+    """
     # All try block to get stack trace from worker thread
     try:
-        app.logger.debug("Check game status: %s", game_name)
-        try:
-            with open(os.path.join(config.lgog_cache, 'gamedetails.json'),
-                      encoding='utf-8') as _file:
-                data = json.load(_file)
-        except FileNotFoundError:
+        app.logger.debug("Check status of %s games", len(game_names))
+        if not os.path.isfile(CATALOG.path):
             app.logger.error("The lgogdownloader cache is missing.")
             return
-        if data is None:
-            app.logger.error("Game not found in lgogdownloader cache: %s",
-                             game_name)
+        _catalog = CATALOG.snapshot()
+        _names = []
+        for _name in game_names:
+            if _catalog.get(_name) is None:
+                app.logger.error("Game not found in lgogdownloader cache: %s",
+                                 _name)
+            else:
+                _names.append(_name)
+        if not _names:
             return
-        _available = 0
-        for game_data in data['games']:
-            if game_data['gamename'] == game_name and \
-                    'installers' in game_data:
-                for inst in game_data['installers']:
-                    _available |= inst['platform']
 
         _session = Session()
         _user = _session.query(User).one()
         if _user.state != LoginStatus.logon:
             app.logger.warning(
-                "Cannot check game status: %s. User not logged in to GOG.",
-                game_name
+                "Cannot check status of %s games. User not logged in to GOG.",
+                len(_names)
             )
             return
-        _res = [0, 0, 0]
-        try:
-            game = _session.query(Game).filter(Game.name == game_name).one()
+        _games = {_game.name: _game for _game in _session.query(Game).filter(
+            Game.name.in_(_names)).all()}
+        for _name in _names:
+            if _name not in _games:
+                app.logger.error("Game %s not found in the DB.", _name)
+        # Group games by selected platforms
+        _groups = {}
+        for _name, game in _games.items():
             _selected = game.platform
             if _selected < 0:
                 _selected = (game.platform_available & _user.platform)
-            _res = status_query(game.name, _selected)
+            _groups.setdefault(_selected, []).append(_name)
+        _results = {}
+        if VERIFIER.enabled:
+            # Games with known checksums are verified locally
+            _expected = {}
+            for _selected, _group in _groups.items():
+                for _name in list(_group):
+                    _known = VERIFIER.expected(
+                        _catalog.get(_name), ONDISK.files(_name),
+                        os.path.join(config.lgog_library, _name), _selected)
+                    if _known is not None:
+                        _expected[_name] = _known
+                        _group.remove(_name)
+            if _expected:
+                _results.update(VERIFIER.verify(_expected))
+                app.logger.info("Installers of %s games verified locally.",
+                                len(_expected))
+        # Games whose check finished, games of failed runs have no results
+        _checked = set(_results)
+        _size = config.status_batch_size
+        _chunks = [(_selected, _group[_start:_start + _size])
+                   for _selected, _group in _groups.items()
+                   for _start in range(0, len(_group), _size)]
+        for _selected, _chunk in _chunks:
+            try:
+                _results.update(status_query_batch(_chunk, _selected))
+            except LoginRequired:
+                _user.state = LoginStatus.logoff
+                break
+            except Exception:
+                # Results of the other chunks are still stored
+                app.logger.error("Status check of %s games failed: %s",
+                                 len(_chunk), ', '.join(_chunk),
+                                 exc_info=True)
+                continue
+            _checked.update(_chunk)
             app.logger.info(
-                "Status check complete for %s. Selected platforms: %s.",
-                game.name, _selected)
-        except LoginRequired:
-            _user.state = LoginStatus.logoff
-            _session.commit()
-            return
-        except NoResultFound:
-            app.logger.error("Game %s not found in the DB.", game_name)
-            return
-        if _res is None:
-            app.logger.error(
-                "No installers returned by GOG for game: %s, platforms: %s.",
-                game.name, _selected)
-            return
-        # TODO add to platform_ondisk based on the directory scan (after db removal)
-        game.done_count = _res[0]
-        game.missing_count = _res[1]
-        game.update_count = _res[2]
-        _session.add(game)
+                "Status check complete for %s games. "
+                "Selected platforms: %s.", len(_chunk), _selected)
+        for _name, game in _games.items():
+            _res = _results.get(_name)
+            if _res is None:
+                if _name in _checked:
+                    app.logger.error(
+                        "No installers returned by GOG for game: %s.", _name)
+                continue
+            # TODO add to platform_ondisk based on the directory scan (after db removal)
+            game.done_count = _res[0]
+            game.missing_count = _res[1]
+            game.update_count = _res[2]
+            game.last_checked = datetime.utcnow()
+            game.ondisk_fingerprint = ONDISK.fingerprint(_name)
         _session.commit()
+        LIBRARY.rebuild()
     except Exception:
         app.logger.error("Unhandled exception in a worker thread!",
                          exc_info=True)
@@ -358,18 +491,26 @@ def status_query(game_name, platform):
     :param string game_name: - the name of a game to download
     :param int platform: - selected platform bitmask
     """
+    return status_query_batch([game_name], platform).get(game_name)
+
+
+def status_query_batch(game_names, platform):
+    """
+    Execute a single status query for many games. Returns a dictionary with
+    (done, missing, update) file counts for every game with installers.
+    :param list game_names: - names of games to check
+    :param int platform: - selected platform bitmask
+    """
     # Run in GOG library folder
     os.chdir(config.lgog_library)
-    _found = False  # At leas one installer file returned by GOG API
-    _missing = 0  # Number of missing installer files
-    _update = 0  # Number of installer files that require update
-    _done = 0  # Number of downloaded installer files
     if platform == 0:
         app.logger.error("No platform selected")
-        _result = (_done, _missing, _update)
-        return _result
+        return {_name: (0, 0, 0) for _name in game_names}
+    # Number of downloaded, missing and requiring update installer files
+    _counts = {}
+    _pattern = '|'.join(re.escape(_name) for _name in game_names)
     # Extract file state
-    _re_status = re.compile(r"(\w\w\w?) %s (\S+)" % game_name)
+    _re_status = re.compile(r"(\w\w\w?) (%s) (\S+)" % _pattern)
     _opts = [
         'lgogdownloader',
         '--directory', config.lgog_library,
@@ -379,31 +520,33 @@ def status_query(game_name, platform):
         '--status',
         '--platform', str(platform),
         '--game',
-        '^'+game_name+'$'
+        '^(' + _pattern + ')$'
     ]
     app.logger.debug("Query status: %s", _opts)
-    _proc = Popen(_opts, stdout=PIPE, stderr=PIPE, universal_newlines=True)
+    _proc = Command(_opts, kind='status')
     _full_out = ""
-    while _proc.poll() is None:
-        _out = _proc.stdout.readline()
-        _full_out += _out
+    for _stream, _out in _proc.lines(
+            config.status_game_timeout * len(game_names)):
+        if _stream != 'out':
+            continue
+        _full_out += _out + "\n"
         _m_status = _re_status.search(_out)
         if _m_status is not None:
-            _found = True
-            _state = _m_status.groups()[0]
+            _state, _name, _file = _m_status.groups()
+            _count = _counts.setdefault(_name, [0, 0, 0])
             if _state == "ND" or _state == "FS":
-                _missing += 1
+                _count[1] += 1
             elif _state == "MD5":
-                _update += 1
+                _count[2] += 1
             elif _state == "OK":
-                _done += 1
+                _count[0] += 1
             else:
                 app.logger.error("Unknown installer state %s for file: %s",
-                                 _state, _m_status.groups()[1])
+                                 _state, _file)
     # Check return code. If lgogdowloader was not killed by signal Popen
     # will not rise an exception
     if _proc.returncode != 0:
-        _err = _proc.stderr.read()
+        _err = _proc.err
         if "Unable to read email and password" in _err:
             app.logger.warning("Login required.")
             raise LoginRequired()
@@ -413,17 +556,16 @@ def status_query(game_name, platform):
             "\nOUT: %s\nERR: %s" %
             (_full_out, _err)
             ))
-    if not _found:
+    if not _counts:
         app.logger.error("No installers found")
-        return None
     app.logger.debug(_full_out)
-    _result = (_done, _missing, _update)
-    return _result
+    return {_name: tuple(_count) for _name, _count in _counts.items()}
 
 
 def update():
     """
-    Execute lgogdownloader cache update.
+    Execute lgogdownloader cache update and plan the status checks. When the
+    update fails the installers are checked against the current catalog.
     """
     # All try block to get stack trace from worker thread
     try:
@@ -433,36 +575,89 @@ def update():
             app.logger.warning(
                 "Cannot update cache. User not logged in to GOG.")
             return
+        # Changes are found against the catalog before the update, even when
+        # a reader picks up the new file in the meantime
+        _old = CATALOG.snapshot()
         _opts = [
             'lgogdownloader',
             '--update-cache'
         ]
         app.logger.info("Starting cache update: %s", _opts)
-        _proc = Popen(_opts, stdout=PIPE, stderr=PIPE, universal_newlines=True)
-        _out, _err = _proc.communicate(timeout=config.command_timeout)
-        # Handle login requests from lgogdownloader
-        if "Unable to read email and password" in _err:
-            app.logger.error("Login required.")
-            _user.state = LoginStatus.logoff
+        try:
+            _proc = run(_opts, timeout=config.command_timeout,
+                        kind='update-cache')
+            _out, _err = _proc.out, _proc.err
+            # Handle login requests from lgogdownloader
+            if "Unable to read email and password" in _err:
+                app.logger.error("Login required.")
+                _user.state = LoginStatus.logoff
+                _session.commit()
+                return
+            # Check return code. If lgogdowloader was not killed by signal
+            # Popen will not rise an exception
+            if _proc.returncode != 0:
+                raise OSError((
+                    _proc.returncode,
+                    "lgogdownloader returned non zero exit code.\n%s\n%s" %
+                    (_out, _err)
+                    ))
+            _catalog, _changes = CATALOG.reload(since=_old)
+        except Exception:
+            # The periodic status checks still run on the current catalog
+            app.logger.error("lgogdownloader cache update failed",
+                             exc_info=True)
+            _catalog, _changes = _old, CatalogChanges()
+        else:
+            # Publish the new library before the installers are checked and
+            # before the clients are notified about the update
+            LIBRARY.build()
+            _user.last_update = datetime.utcnow()
             _session.commit()
-            _proc.terminate()
-            return
-        # Check return code. If lgogdowloader was not killed by signal Popen
-        # will not rise an exception
-        if _proc.returncode != 0:
-            raise OSError((
-                _proc.returncode,
-                "lgogdownloader returned non zero exit code.\n%s\n%s" %
-                (_out, _err)
-                ))
-        _user.last_update = datetime.utcnow()
-        _session.commit()
+            # Cached icons are skipped, so missing and failed ones are retried
+            ICONS.prefetch(_game.get('icon') for _game in _catalog)
+            app.logger.info("Cache update complete: %s.", _changes)
+        _urgent, _stale = stale_games(_session, _catalog, _changes)
+        app.logger.info(
+            "Status check of %s games now and %s games within %s s.",
+            len(_urgent), len(_stale), config.update_period)
+        STATUS_CHECKS.urgent(_urgent)
+        STATUS_CHECKS.plan(_stale, config.update_period)
     except Exception:
         app.logger.error("Cache update raised an error", exc_info=True)
     finally:
         Session.remove()
 
 
+def stale_games(session, catalog, changes):
+    """
+    Get (urgent, stale) names of downloaded games whose status has to be
+    checked after a cache update. Games with new or changed installers are
+    urgent. Games never checked, games with files changed since the last
+    check and games not checked for config.status_max_age are stale, never
+    checked games first. Other games are skipped.
+    :param Session session: - DB session
+    :param CatalogSnapshot catalog: - current catalog
+    :param CatalogChanges changes: - changes of the catalog
+    """
+    ONDISK.refresh(force=True)
+    _ondisk = {_name for _name in ONDISK.games()
+               if catalog.get(_name) is not None}
+    _urgent = _ondisk.intersection(changes.installers)
+    _oldest = datetime.utcnow() - timedelta(seconds=config.status_max_age)
+    _never = []
+    _stale = []
+    for _name, _checked, _fingerprint in session.query(
+            Game.name, Game.last_checked, Game.ondisk_fingerprint):
+        if _name not in _ondisk or _name in _urgent:
+            continue
+        if _checked is None:
+            _never.append(_name)
+        elif _checked < _oldest or \
+                _fingerprint != ONDISK.fingerprint(_name):
+            _stale.append(_name)
+    return sorted(_urgent), sorted(_never) + sorted(_stale)
+
+
 def update_loop(pause, function, functargs=()):
     """
     Function make a schedule a periodic action and execute it
@@ -473,9 +668,10 @@ def update_loop(pause, function, functargs=()):
     """
     app.logger.info("Schedule next event after: %s seconds", pause)
     Timer(pause, update_loop, (pause, function, functargs)).start()
-    # Execute the update function
+    # Execute the update function, it schedules the status checks
     functargs[0].submit(function)
-    # Execute status update for all downloaded games
-    for _name in os.listdir(config.lgog_library):
-        if os.path.isdir(os.path.join(config.lgog_library, _name)):
-            functargs[0].submit(status, _name)
+
+
+#: Status checks paced to avoid bursts of lgogdownloader queries
+STATUS_CHECKS = PacedScheduler(status_batch, config.status_batch_size,
+                               config.status_check_interval, name="Status")
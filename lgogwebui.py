@@ -8,12 +8,20 @@ manager for Linux.
 """
 
 import sys
-import json
 import os
+import re
+import mimetypes
+import json
+import base64
+import bisect
+import hashlib
+from datetime import datetime
+from functools import wraps
 from threading import Timer
-from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 
-from flask import render_template, jsonify, request, redirect, url_for
+from flask import render_template, jsonify, request, redirect, url_for, \
+    Response, make_response, send_file, g
 from flask_autoindex import AutoIndex
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy import or_
@@ -22,23 +30,116 @@ import main
 import config
 import lgogdaemon
 import models
+import jobs
+import events
+import profiling
+from assets import ASSETS
+from catalog import CATALOG
+from icons import ICONS, normalize_url
+from gametable import platform_flags
+from snapshot import LIBRARY
+from progress import PROGRESS
+from events import EVENTS, format_sse
+from metrics import METRICS, REQUEST_LATENCY
+from scheduler import PriorityScheduler, TrackedExecutor
 from models import Game, User, LoginStatus, Status, Session
 
 app = main.app
-download_scheduler = ThreadPoolExecutor(max_workers=2)
-update_scheduler = ThreadPoolExecutor(max_workers=2)
+download_scheduler = PriorityScheduler(
+    max_workers=config.download_workers,
+    max_threads=config.download_max_threads,
+    name="Download")
+update_scheduler = TrackedExecutor(max_workers=2, name="Update")
+# Login never waits for cache updates or status checks
+login_scheduler = TrackedExecutor(max_workers=1, name="Login")
 # Create instance of AutoIndex used to display contents of game download
 # directory. Explicitely disable add_url_rules as it would define some default
 # routes for "/"
 index = AutoIndex(app, config.lgog_library, add_url_rules=False)
+# Push game and login state changes to the event stream clients
+events.install(models.SESSION_FACTORY)
+# Time requests and allow profiling them when enabled
+profiler = None
+if config.profiling:
+    profiler = profiling.install(app, models.ENGINE,
+                                 config.slow_request_threshold,
+                                 config.profile_dir)
+
+
+def _schedule_download(game, priority=0):
+    """
+    Queue game download in the download scheduler.
+    :param string game: - game name
+    :param int priority: - higher priority downloads start first
+    """
+    download_scheduler.submit(game, lgogdaemon.download_job, game,
+                              config.download_threads, priority=priority,
+                              threads=config.download_threads)
+
+
+def _scheduler_stats():
+    """
+    Get (queued, running, workers) of the schedulers.
+    """
+    return {
+        'download': (len(download_scheduler.queued()),
+                     len(download_scheduler.running()),
+                     download_scheduler.max_workers),
+        'update': update_scheduler.counts() + (update_scheduler.max_workers,),
+        'login': login_scheduler.counts() + (login_scheduler.max_workers,),
+        'status': lgogdaemon.STATUS_CHECKS.counts() + (1,)
+        }
+
+
+def _last_update_age():
+    """
+    Get seconds since the last update of the lgogdownloader cache.
+    """
+    _user = Session().query(User).one_or_none()
+    if _user is None or _user.last_update is None:
+        return []
+    return [((), (datetime.utcnow() - _user.last_update).total_seconds())]
+
+
+for _index, _name, _doc in (
+        (0, 'lgogwebui_scheduler_queued', 'Jobs waiting in a scheduler.'),
+        (1, 'lgogwebui_scheduler_running', 'Jobs running in a scheduler.'),
+        (2, 'lgogwebui_scheduler_workers', 'Worker threads of a scheduler.')):
+    METRICS.gauge(_name, _doc, ('scheduler',), lambda _index=_index: [
+        ((_scheduler,), _stats[_index])
+        for _scheduler, _stats in sorted(_scheduler_stats().items())])
+METRICS.gauge('lgogwebui_download_progress_percent',
+              'Progress of active downloads.', ('game',),
+              lambda: [((_download.game_name,), _download.progress)
+                       for _download in PROGRESS.active()])
+METRICS.gauge('lgogwebui_download_bytes',
+              'Bytes downloaded by active downloads.', ('game',),
+              lambda: [((_download.game_name,), _download.downloaded)
+                       for _download in PROGRESS.active()])
+METRICS.gauge('lgogwebui_cache_update_age_seconds',
+              'Time since the last lgogdownloader cache update.', (),
+              _last_update_age)
+
+
+def _store_queue():
+    """
+    Persist the current order of queued downloads.
+    """
+    jobs.store_order(download_scheduler.ordered())
+
 
 # Define logger handlers and start update timer
 if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
     _session = Session()
     app.logger.info("Initialize lgogwebui ...")
     app.logger.info(sys.version)
-    # Make sure that the database exists
-    models.Base.metadata.create_all(models.ENGINE)
+    # Fingerprint and compress the assets used by the templates
+    try:
+        ASSETS.build()
+    except OSError:
+        app.logger.error("Build of static assets failed", exc_info=True)
+    # Make sure that the database exists and is up to date
+    models.init_db(models.ENGINE)
     # Make sure that login state exists in the DB
     try:
         _user = _session.query(User).one()
@@ -53,16 +154,72 @@ if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
     Timer(5, lgogdaemon.update_loop,
           (config.update_period, lgogdaemon.update,
               (update_scheduler,))).start()
-    # Add to the download queue games marked in the DB
-    _games = _session.query(Game).all()
+    # Add jobs for games marked for download by older versions
+    _games = _session.query(Game).filter(
+        or_(Game.state == Status.queued, Game.state == Status.running)).all()
     for _game in _games:
-        if _game.state == Status.queued or _game.state == Status.running:
-            app.logger.info("Found %s game for download: %s",
-                            _game.name, _game.state)
-            download_scheduler.submit(lgogdaemon.download, _game.name)
+        jobs.enqueue(_game.name)
+    # Restore the download queue in the original order
+    for _name, _priority in jobs.pending():
+        app.logger.info("Found game for download: %s", _name)
+        _schedule_download(_name, _priority)
     Session.remove()
 
 
+#: Time in seconds the clients may cache responses that never change
+IMMUTABLE_MAX_AGE = 365 * 86400
+
+
+@app.url_defaults
+def asset_url(endpoint, values):
+    """Point asset URLs to the fingerprinted files."""
+    if endpoint == 'asset' and 'filename' in values:
+        values['filename'] = ASSETS.url_name(values['filename'])
+
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """
+    Serve a static asset. Fingerprinted assets are served precompressed in
+    the encoding accepted by the client and cached forever.
+    :param filename: - asset name
+    """
+    _accepted = [_encoding for _encoding, _quality in request.accept_encodings
+                 if _quality > 0]
+    _found = ASSETS.find(filename, _accepted)
+    if _found is None:
+        return "Unknown asset", 404
+    _path, _encoding, _immutable = _found
+    _mimetype = mimetypes.guess_type(filename)[0] or \
+        'application/octet-stream'
+    _response = send_file(_path, mimetype=_mimetype, conditional=True,
+                          max_age=IMMUTABLE_MAX_AGE if _immutable else None)
+    if _encoding is not None:
+        _response.headers['Content-Encoding'] = _encoding
+    _response.vary.add('Accept-Encoding')
+    if _immutable:
+        _response.cache_control.public = True
+        _response.cache_control.immutable = True
+    return _response
+
+
+@app.before_request
+def request_timer():
+    """Remember the start of the request."""
+    g.request_start = perf_counter()
+
+
+@app.after_request
+def request_metrics(response):
+    """Record latency of the request."""
+    _start = g.get('request_start')
+    if _start is not None:
+        _route = request.url_rule.rule if request.url_rule else 'unknown'
+        REQUEST_LATENCY.observe(perf_counter() - _start, _route,
+                                request.method)
+    return response
+
+
 @app.after_request
 def session_cleaner(response):
     """Cleanup session ater each request."""
@@ -70,131 +227,209 @@ def session_cleaner(response):
     return response
 
 
+def _etag():
+    """
+    Compute entity tag of the current request. It changes whenever a game,
+    the user or the catalog changes, so it can be checked before any DB or
+    template work is done. The version is kept in the memory of the process,
+    which is why lgogwebui supports a single worker process only.
+    """
+    _hash = hashlib.sha1()
+    _hash.update(repr((
+        request.full_path,
+        request.environ.get('SCRIPT_NAME', ''),
+        CATALOG.snapshot().signature
+        )).encode('utf-8'))
+    if request.method == 'POST':
+        _hash.update(request.get_data())
+    return "%s-%s-%s" % (EVENTS.epoch, EVENTS.version,
+                         _hash.hexdigest()[:16])
+
+
+def conditional(func):
+    """
+    Decorator answering conditional requests of a route with 304 Not Modified
+    when nothing changed since the entity tag sent by the client.
+    """
+    @wraps(func)
+    def _wrapper(*args, **kwargs):
+        _tag = _etag()
+        if request.if_none_match.contains(_tag):
+            _response = make_response('', 304)
+        else:
+            _response = make_response(func(*args, **kwargs))
+            if _response.status_code != 200:
+                return _response
+        _response.set_etag(_tag)
+        _response.cache_control.no_cache = True
+        return _response
+    return _wrapper
+
+
 @app.route('/')
+@conditional
 def library():
     """Display the main page."""
-    _session = Session()
-    # TODO store in some cache
-    data = {
-        'games': []
-    }
-    try:
-        with open(os.path.join(
-                  config.lgog_cache, 'gamedetails.json'),
-                  encoding='utf-8') as f:
-            data = json.load(f)
-    except FileNotFoundError:
-        pass
-
-    _user = _session.query(User).one()
+    _snapshot = LIBRARY.snapshot()
+    _user = Session().query(User).one()
     _user_data = {
             'state': _user.state.name,
-            'selected': {}
+            'selected': platform_flags(_user.platform)
             }
-    _user_data['selected']['windows'] = (_user.platform & 1 == 1)
-    _user_data['selected']['macos'] = (_user.platform & 2 == 2)
-    _user_data['selected']['linux'] = (_user.platform & 4 == 4)
-    _metadata = []
-    for game_data in data['games']:
-        _db_found = False
-        _available = 0
-        _selected = 0
-        _meta = {
-                'gamename': game_data['gamename'],
-                'title': game_data['title'],
-                'icon': game_data['icon']
-                }
-
-        if 'installers' not in game_data:
-            continue
-        for inst in game_data['installers']:
-            _available |= inst['platform']
-
-        try:
-            db_game = _session.query(Game).filter(
-                Game.name == game_data['gamename']).one()
-            _db_found = True
-            if db_game.platform_available != _available:
-                db_game.platform_available = _available
-                _session.add(db_game)
-            # app.logger.debug("Game in DB: %s", db_game.name)
-        except NoResultFound:
-            _name = game_data['gamename']
-            db_game = Game()
-            db_game.name = _name
-            db_game.state = Status.new
-            db_game.platform_available = _available
-            _game_dir = os.path.join(config.lgog_library, _name)
-            if os.path.isdir(_game_dir):
-                _platform_linux = False
-                _platform_mac = False
-                _platform_windows = False
-                # Search for downloaded installers
-                for _file in os.listdir(_game_dir):
-                    if not os.path.isdir(os.path.join(_game_dir, _file)):
-                        if _file.endswith('.sh'):
-                            _platform_linux = True
-                        elif _file.endswith('.exe'):
-                            _platform_windows = True
-                        elif _file.endswith('.pkg'):
-                            _platform_mac = True
-                        elif _file.endswith('.dmg'):
-                            _platform_mac = True
-                _platform = 0
-                if _platform_windows:
-                    _platform |= 1
-                if _platform_mac:
-                    _platform |= 2
-                if _platform_linux:
-                    _platform |= 4
-                if _platform > 0:
-                    db_game.platform_ondisk = _platform
-                    db_game.state = Status.done
-                    if (_platform & _user.platform) == 0:
-                        db_game.platform = _platform
-            _session.add(db_game)
-        _session.commit()
+    _root = request.environ['SCRIPT_NAME'] or ''
+    return _snapshot.rendered(
+        (_root, _user_data['state'], _user.platform),
+        lambda: render_template('library.html', data=_snapshot.records,
+                                user=_user_data, root_url=_root,
+                                catalog=_snapshot.catalog_id))
+
+
+#: Sort keys supported by the JSON library API
+API_SORT_KEYS = {
+    'name': lambda _table, _row: _table.names[_row],
+    'title': lambda _table, _row: _table.titles[_row].lower(),
+    'state': lambda _table, _row: Status(_table.state[_row]).name,
+    'progress': lambda _table, _row: int(_table.progress[_row]),
+    'missing_count': lambda _table, _row: _table.missing_count[_row],
+    'update_count': lambda _table, _row: _table.update_count[_row]
+    }
+#: Types of the values of the sort keys
+API_SORT_TYPES = {
+    'name': str,
+    'title': str,
+    'state': str,
+    'progress': int,
+    'missing_count': int,
+    'update_count': int
+    }
 
-        _meta['state'] = db_game.state.name
-        _meta['progress'] = int(db_game.progress)
-        _meta['done_count'] = int(db_game.done_count)
-        _meta['missing_count'] = int(db_game.missing_count)
-        _meta['update_count'] = int(db_game.update_count)
-        _meta['user_selected'] = False
-        if db_game.platform >= 0:
-            _selected = db_game.platform
-            _meta['user_selected'] = True
-        else:
-            _selected = (_available & _user.platform)
-        if _meta['missing_count'] == 0 and _selected != (db_game.platform_ondisk & _selected):
-            _meta['missing_count'] = 1
-        _ondisk = db_game.platform_ondisk
-        _meta['available'] = {}
-        _meta['selected'] = {}
-        _meta['ondisk'] = {}
-        _meta['available']['windows'] = (_available & 1 == 1)
-        _meta['available']['macos'] = (_available & 2 == 2)
-        _meta['available']['linux'] = (_available & 4 == 4)
-        _meta['selected']['windows'] = (_selected & 1 == 1)
-        _meta['selected']['macos'] = (_selected & 2 == 2)
-        _meta['selected']['linux'] = (_selected & 4 == 4)
-        _meta['ondisk']['windows'] = (_ondisk & 1 == 1)
-        _meta['ondisk']['macos'] = (_ondisk & 2 == 2)
-        _meta['ondisk']['linux'] = (_ondisk & 4 == 4)
-        # app.logger.debug("%s\n%s\n%s", game_data["gamename"],
-        #                  game_data["selected"], game_data["available"])
-        _metadata.append(_meta)
-        if _db_found and db_game.state == Status.done and \
-                db_game.platform != (
-                    db_game.platform_ondisk & db_game.platform
-                ):
-            db_game.state = Status.missing
-            _session.add(db_game)
-        _session.commit()
 
-    # app.logger.debug(_metadata)
-    _root = request.environ['SCRIPT_NAME'] or ''
-    return render_template('library.html', data=_metadata, user=_user_data, root_url=_root)
+def _encode_cursor(key):
+    return base64.urlsafe_b64encode(
+        json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor, key_type):
+    """
+    Decode a cursor sent by a client. Raises ValueError unless it is a sort
+    key value of the given type and a game name.
+    :param string cursor: - next_cursor of the previous page
+    :param type key_type: - type of the values of the sort key
+    """
+    _key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    # bool is a subclass of int, but never a sort key value
+    if not isinstance(_key, list) or len(_key) != 2 or \
+            type(_key[0]) is not key_type or type(_key[1]) is not str:
+        raise ValueError("Invalid cursor: %s" % cursor)
+    return tuple(_key)
+
+
+def _int_arg(name, default=None):
+    """
+    Read an integer from the request arguments.
+    :param string name: - argument name
+    :param int default: - value of a missing argument
+    """
+    _value = request.args.get(name)
+    if _value is None:
+        return default
+    return int(_value)
+
+
+def _platform_arg(name):
+    """
+    Read platform bitmask from the request arguments.
+    :param string name: - argument name
+    """
+    _value = request.args.get(name)
+    if _value is None:
+        return None
+    _mask = int(_value)
+    if _mask < 0 or _mask > 7:
+        raise ValueError("Unknown platform mask: %s" % _value)
+    return _mask
+
+
+@app.route('/api/games', methods=['GET'])
+@conditional
+def api_games():
+    """
+    Get a page of the game library as JSON.
+
+    Supported query arguments:
+    - state: comma separated list of game states
+    - available, selected, ondisk: platform bitmask that has to be set
+    - missing, update: 1 to list only games with missing files / updates,
+      0 to list games without them
+    - search: case insensitive substring of game title or name
+    - sort: one of API_SORT_KEYS, prefixed with "-" for descending order
+    - limit: page size (default 100, max 1000)
+    - cursor: value of next_cursor returned with the previous page
+    """
+    try:
+        _states = None
+        if request.args.get('state'):
+            _states = [Status[_name]
+                       for _name in request.args['state'].split(',')]
+        _platforms = {_name: _platform_arg(_name)
+                      for _name in ('available', 'selected', 'ondisk')}
+        _missing = _int_arg('missing')
+        _update = _int_arg('update')
+        _search = request.args.get('search', '').lower()
+        _sort = request.args.get('sort', 'title')
+        _descending = _sort.startswith('-')
+        _sort_key = API_SORT_KEYS[_sort.lstrip('-')]
+        _limit = min(max(_int_arg('limit', 100), 1), 1000)
+        _cursor = None
+        if request.args.get('cursor'):
+            _cursor = _decode_cursor(request.args['cursor'],
+                                     API_SORT_TYPES[_sort.lstrip('-')])
+    except (KeyError, ValueError) as _error:
+        app.logger.error("Bad library API request: %s", _error)
+        return "Bad request: %s" % _error, 400
+
+    _table = LIBRARY.snapshot().table
+
+    # Filters are combined as bitsets over the whole table
+    _bits = _table.all
+    for _name, _mask in _platforms.items():
+        if _mask is not None:
+            _bits &= _table.with_platforms(_name, _mask)
+    if _states is not None:
+        _bits &= _table.with_states(_states)
+    if _missing is not None:
+        _bits &= _table.with_missing() if _missing else ~_table.with_missing()
+    if _update is not None:
+        _bits &= _table.with_updates() if _update else ~_table.with_updates()
+    _items = []
+    for _index in _table.rows(_bits):
+        if _search and _search not in _table.titles[_index].lower() and \
+                _search not in _table.names[_index]:
+            continue
+        _items.append(((_sort_key(_table, _index), _table.names[_index]),
+                       _index))
+    _items.sort(key=lambda _item: _item[0])
+    _keys = [_item[0] for _item in _items]
+    if _descending:
+        _end = len(_items)
+        if _cursor is not None:
+            _end = bisect.bisect_left(_keys, _cursor)
+        _page = _items[max(_end - _limit, 0):_end][::-1]
+        _more = _end - _limit > 0
+    else:
+        _start = 0
+        if _cursor is not None:
+            _start = bisect.bisect_right(_keys, _cursor)
+        _page = _items[_start:_start + _limit]
+        _more = _start + _limit < len(_items)
+    _result = {
+        'total': len(_items),
+        'games': _table.records(_index for _key, _index in _page),
+        'next_cursor': None
+        }
+    if _more and _page:
+        _result['next_cursor'] = _encode_cursor(_page[-1][0])
+    return jsonify(_result)
 
 
 @app.route('/platform/<game>/<platform>')
@@ -248,6 +483,7 @@ def toggle_platform(game, platform):
         if db_game.state == Status.missing:
             db_game.state = Status.done
     _session.commit()
+    LIBRARY.rebuild()
     return jsonify(_result)
 
 
@@ -295,6 +531,7 @@ def toggle_default_platform(platform):
             else:
                 _result[db_game.name] = {'missing': False}
     _session.commit()
+    LIBRARY.rebuild()
     return jsonify(_result)
 
 
@@ -312,18 +549,86 @@ def download(game):
     except NoResultFound:
         app.logger.error("Game %s not found in DB.", game)
         return "Unable to find the game in the database.", 500
+    _priority = request.args.get('priority', 0, type=int)
+    # Repeated requests must not queue the same game twice
+    if not jobs.enqueue(game, _priority):
+        if db_game.state in (Status.queued, Status.running):
+            app.logger.info("Download of %s already requested.", game)
+            return "OK"
+        # The job of a stopped or finished download is removed only when
+        # its worker returns
+        app.logger.info("Previous download of %s is still finishing.", game)
+        return "The previous download of the game is still finishing. " \
+            "Try again in a moment.", 409
     if db_game.state != Status.running:
         db_game.state = Status.queued
         db_game.progress = 0
         _session.commit()
-    download_scheduler.submit(lgogdaemon.download, game)
+        LIBRARY.rebuild()
+    _schedule_download(game, _priority)
+    return "OK"
+
+
+@app.route('/download_next/<game>')
+def download_next(game):
+    """
+    Request game download before all other queued downloads.
+    :param game: - game name
+    """
+    app.logger.info("Requesting next download of: %s.", game)
+    _result = "OK"
+    if not download_scheduler.move_to_front(game):
+        _result = download(game)
+        download_scheduler.move_to_front(game)
+    _store_queue()
+    return _result
+
+
+@app.route('/priority/<game>/<int(signed=True):priority>')
+def download_priority(game, priority):
+    """
+    Change priority of a queued download.
+    :param game: - game name
+    :param priority: - new priority, higher priority downloads start first
+    """
+    app.logger.info("Requesting priority %s for: %s.", priority, game)
+    if not download_scheduler.set_priority(game, priority):
+        return "The game is not queued for download.", 400
+    _store_queue()
     return "OK"
 
 
+@app.route('/queue', methods=['GET'])
+def download_queue():
+    """
+    Get running downloads and queued downloads in the order they will start.
+    """
+    return jsonify({
+        'running': download_scheduler.running(),
+        'queued': download_scheduler.queued()
+        })
+
+
+@app.route('/queue', methods=['POST'])
+def download_reorder():
+    """
+    Move listed queued downloads to the front of the queue.
+    The list of games should be sent as POST data.
+    """
+    _games = request.get_json()
+    if not isinstance(_games, list):
+        return "List of games expected.", 400
+    download_scheduler.reorder(_games)
+    _store_queue()
+    return download_queue()
+
+
 @app.route('/stop/<game>')
 def stop(game):
     """
-    Stop game download
+    Stop game download. A queued job is removed right away. A running job
+    is stopped through the cancellation event and removed by its worker
+    when the download returns.
     :param game: - game name
     """
     _session = Session()
@@ -336,10 +641,16 @@ def stop(game):
     if db_game.state == Status.running or db_game.state == Status.queued:
         db_game.state = Status.stop
         _session.commit()
+        LIBRARY.rebuild()
+    # Notify the download worker without waiting for it to poll the DB
+    download_scheduler.cancel(game)
+    jobs.cancel(game)
+    PROGRESS.cancel(game)
     return "OK"
 
 
 @app.route('/status', methods=['GET'])
+@conditional
 def status_all():
     """
     Get status of all active downloads.
@@ -353,6 +664,7 @@ def status_all():
 
 
 @app.route('/status', methods=['POST'])
+@conditional
 def status_selected():
     """
     Get status of selected downloads.
@@ -366,38 +678,58 @@ def status_selected():
     result = {}
     # logging.debug("Found %s games.", len(games))
     for game in games:
-        game_res = {
-                'state': game.state.name,
-                'progress': game.progress
-                }
-        # logging.debug("%s : %s", game.name, game.state)
-        if game.state == Status.done:
-            game_res['progress'] = 100
-        elif game.state != Status.queued and game.state != Status.running:
-            game_res['progress'] = 0
+        game_res = events.game_status(game)
+        # Live progress of active downloads is not persisted on every change
+        _download = PROGRESS.get(game.name)
+        if _download is not None and game.state == Status.running:
+            game_res['progress'] = _download.progress
         result[game.name] = game_res
     return jsonify(result)
 
 
 @app.route('/user_status', methods=['GET'])
+@conditional
 def user_status():
     """
     Get status of user session
     """
     _session = Session()
     _user = _session.query(User).one()
-    _last_update = _user.last_update
-    if _last_update is not None:
-        _last_update = int(_last_update.timestamp())
-    else:
-        _last_update = 0
-    result = {
-            'user_status': _user.state.name,
-            'last_update': _last_update
-            }
+    result = events.user_status(_user)
+    # Catalog of the served library page, see the library event
+    result['catalog'] = LIBRARY.snapshot().catalog_id
     return jsonify(result)
 
 
+@app.route('/events', methods=['GET'])
+def event_stream():
+    """
+    Stream download progress, game state and login state changes as
+    Server-Sent Events.
+    """
+    _last = request.headers.get('Last-Event-ID', type=int)
+    if _last is None or _last > EVENTS.seq:
+        _last = EVENTS.seq
+
+    def _generate(last):
+        # Tell the browser how long to wait before reconnecting
+        yield "retry: 5000\n\n"
+        while True:
+            _events = EVENTS.wait(last, config.events_keepalive)
+            if not _events:
+                yield ": keep-alive\n\n"
+                continue
+            for _seq, _kind, _data in _events:
+                last = _seq
+                yield format_sse(_seq, _kind, _data)
+
+    return Response(_generate(_last), mimetype='text/event-stream',
+                    headers={
+                        'Cache-Control': 'no-cache',
+                        'X-Accel-Buffering': 'no'
+                        })
+
+
 @app.route('/login', methods=['POST'])
 def login():
     """
@@ -405,7 +737,7 @@ def login():
     """
     user = request.form['user']
     password = request.form['password']
-    update_scheduler.submit(lgogdaemon.login, user, password)
+    login_scheduler.submit(lgogdaemon.login, user, password)
     return redirect(url_for('library'))
 
 
@@ -424,6 +756,65 @@ def login_2fa():
     return redirect(url_for('library'))
 
 
+@app.route('/icon/<key>')
+def icon(key):
+    """
+    Serve a game icon from the local icon cache. Icons missing in the cache
+    are downloaded on the first request.
+    :param key: - icon key, see icons.icon_key
+    """
+    if re.fullmatch('[0-9a-f]+', key) is None:
+        return "Unknown icon", 404
+    _cached = ICONS.find(key)
+    if _cached is None:
+        _snapshot = LIBRARY.snapshot()
+        _sources = _snapshot.rendered(('icons',), lambda: dict(
+            zip(_snapshot.table.icon_ids, _snapshot.table.icons)))
+        _url = _sources.get(key)
+        if _url is None:
+            return "Unknown icon", 404
+        _cached = ICONS.fetch(_url)
+        if _cached is None:
+            # Let the client try GOG directly
+            return redirect(normalize_url(_url))
+    # The key changes with the icon URL, so the response never changes
+    _response = send_file(_cached[0], mimetype=_cached[1],
+                          max_age=IMMUTABLE_MAX_AGE, conditional=True)
+    _response.cache_control.public = True
+    _response.cache_control.immutable = True
+    return _response
+
+
+@app.route('/profile', methods=['POST'])
+def profile():
+    """
+    Profile the next requests. Available when LGOG_PROFILING is enabled.
+
+    Supported query arguments:
+    - kind: cprofile (default) or tracemalloc
+    - path: path prefix of the profiled requests (default /)
+    - count: number of requests to profile (default 1)
+    """
+    if profiler is None:
+        return "Profiling is disabled.", 404
+    try:
+        profiler.profile_next(request.args.get('kind', 'cprofile'),
+                              request.args.get('path', '/'),
+                              request.args.get('count', 1, type=int))
+    except ValueError as _error:
+        return "Bad request: %s" % _error, 400
+    return "OK"
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Export metrics in the Prometheus text format.
+    """
+    return Response(METRICS.render(),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/gog-repo/<path:path>')
 def browse(path):
     """
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Metrics exported in the Prometheus text exposition format.
+"""
+
+from bisect import bisect_left
+from threading import Lock
+
+from main import app
+
+#: Default histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+#: Buckets of lgogdownloader run times in seconds
+COMMAND_BUCKETS = (0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600, 14400)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    _pairs = list(zip(names, values)) + list(extra)
+    if not _pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (_name, _escape(_value))
+                             for _name, _value in _pairs)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonically increasing value per label set.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+
+    def inc(self, *labels, amount=1):
+        """
+        Increase the value of a label set.
+        :param list labels: - label values in the order of self.labels
+        :param float amount: - increment
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        """
+        Get (suffix, label values, extra labels, value) of all samples.
+        """
+        with self._lock:
+            return [('', _labels, (), _value)
+                    for _labels, _value in sorted(self._values.items())]
+
+
+class Histogram:
+    """
+    Distribution of observed values per label set in fixed buckets.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = Lock()
+
+    def observe(self, value, *labels):
+        """
+        Record an observation.
+        :param float value: - observed value
+        :param list labels: - label values in the order of self.labels
+        """
+        _index = bisect_left(self.buckets, value)
+        with self._lock:
+            _counts = self._values.get(labels)
+            if _counts is None:
+                # Bucket counts, sum and count
+                _counts = self._values[labels] = \
+                    [0] * (len(self.buckets) + 1) + [0.0, 0]
+            _counts[_index] += 1
+            _counts[-2] += value
+            _counts[-1] += 1
+
+    def samples(self):
+        """
+        Get (suffix, label values, extra labels, value) of all samples.
+        """
+        _samples = []
+        with self._lock:
+            _values = [(_labels, list(_counts)) for _labels, _counts
+                       in sorted(self._values.items())]
+        for _labels, _counts in _values:
+            _cumulative = 0
+            for _bound, _count in zip(self.buckets + (float('inf'),),
+                                      _counts):
+                _cumulative += _count
+                _samples.append(('_bucket', _labels,
+                                 (('le', _format_value(float(_bound))),),
+                                 _cumulative))
+            _samples.append(('_sum', _labels, (), _counts[-2]))
+            _samples.append(('_count', _labels, (), _counts[-1]))
+        return _samples
+
+
+class Gauge:
+    """
+    Value computed when the metrics are collected. The callback returns
+    a list of (label values, value) tuples.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.callback = callback
+
+    def samples(self):
+        """
+        Get (suffix, label values, extra labels, value) of all samples.
+        """
+        return [('', tuple(_labels), (), _value)
+                for _labels, _value in self.callback()]
+
+
+class Registry:
+    """
+    Collection of metrics rendered together.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = Lock()
+
+    def register(self, metric):
+        """
+        Add a metric to the registry.
+        :param metric: - Counter, Histogram or Gauge
+        """
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        """
+        Create and register a counter.
+        """
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(),
+                  buckets=DEFAULT_BUCKETS):
+        """
+        Create and register a histogram.
+        """
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, labels=(), callback=None):
+        """
+        Create and register a gauge computed by the callback.
+        """
+        return self.register(Gauge(name, documentation, labels, callback))
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            _metrics = list(self._metrics)
+        _lines = []
+        for _metric in _metrics:
+            try:
+                _samples = _metric.samples()
+            except Exception:
+                app.logger.error("Collection of %s raised an error",
+                                 _metric.name, exc_info=True)
+                continue
+            _lines.append('# HELP %s %s' % (_metric.name,
+                                            _escape(_metric.documentation)))
+            _lines.append('# TYPE %s %s' % (_metric.name, _metric.kind))
+            for _suffix, _labels, _extra, _value in _samples:
+                _lines.append('%s%s%s %s' % (
+                    _metric.name, _suffix,
+                    _format_labels(_metric.labels, _labels, _extra),
+                    _format_value(_value)))
+        return '\n'.join(_lines) + '\n'
+
+
+#: Metrics of the web routes and the daemon workers
+METRICS = Registry()
+
+#: Latency of the web requests
+REQUEST_LATENCY = METRICS.histogram(
+    'lgogwebui_request_duration_seconds', 'Latency of HTTP requests.',
+    ('route', 'method'))
+#: Number of finished lgogdownloader runs
+COMMANDS = METRICS.counter(
+    'lgogwebui_commands_total', 'Finished lgogdownloader runs.',
+    ('kind', 'exit_code'))
+#: Run time of lgogdownloader
+COMMAND_DURATION = METRICS.histogram(
+    'lgogwebui_command_duration_seconds', 'Run time of lgogdownloader.',
+    ('kind',), COMMAND_BUCKETS)
+#: Games changed by the cache updates
+CATALOG_CHANGES = METRICS.counter(
+    'lgogwebui_catalog_changes_total',
+    'Games added, removed, with changed installers or updated by the cache '
+    'updates.', ('kind',))
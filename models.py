@@ -7,7 +7,8 @@ import logging
 import enum
 import config
 
-from sqlalchemy import Column, Integer, String, Enum
+from sqlalchemy import Column, Integer, String, Enum, Index, event, text, \
+    inspect
 from sqlalchemy.types import TIMESTAMP
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
@@ -43,6 +44,14 @@ class LoginStatus(enum.Enum):
     logon = 6
 
 
+class JobState(enum.Enum):
+    """
+    Enumerate for download job states.
+    """
+    queued = 1
+    running = 2
+
+
 class Game(Base):
     """
     Table to store current game state and settings.
@@ -67,6 +76,15 @@ class Game(Base):
     missing_count = Column(Integer, default=0)
     #: number of files ready for updates
     update_count = Column(Integer, default=0)
+    #: UTC timestamp of the last status check
+    last_checked = Column(TIMESTAMP)
+    #: fingerprint of the installer files at the last status check
+    ondisk_fingerprint = Column(String(40))
+
+    __table_args__ = (
+        Index('ix_games_name', 'name', unique=True),
+        Index('ix_games_state', 'state'),
+    )
 
 
 class User(Base):
@@ -83,9 +101,79 @@ class User(Base):
     last_update = Column(TIMESTAMP)
 
 
+class DownloadJob(Base):
+    """
+    Table with the persistent queue of downloads. There is at most one job
+    per game, finished jobs are removed.
+    """
+    __tablename__ = 'jobs'
+    job_id = Column(Integer, primary_key=True)
+    #: lgogdowloader game name
+    name = Column(String(250), nullable=False, unique=True)
+    #: job state
+    state = Column(Enum(JobState), default=JobState.queued, nullable=False)
+    #: jobs with higher priority are started first
+    priority = Column(Integer, default=0, nullable=False)
+    #: position in the queue among jobs with equal priority
+    position = Column(Integer, default=0, nullable=False)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Configure every new SQLite connection. WAL lets the web readers run
+    concurrently with the daemon writers and the busy timeout makes writers
+    wait for the lock instead of failing with "database is locked".
+    """
+    _cursor = dbapi_connection.cursor()
+    _cursor.execute("PRAGMA journal_mode=WAL")
+    _cursor.execute("PRAGMA synchronous=NORMAL")
+    _cursor.execute("PRAGMA busy_timeout=%d" % (config.db_busy_timeout * 1000))
+    _cursor.execute("PRAGMA temp_store=MEMORY")
+    _cursor.close()
+
+
+def create_db_engine(path, tuned=True):
+    """
+    Create an engine for a SQLite DB file.
+    :param string path: - path to the DB file
+    :param bool tuned: - enable WAL and the other connection settings
+    """
+    if not tuned:
+        return create_engine("sqlite:///%s" % path)
+    _engine = create_engine("sqlite:///%s" % path,
+                            connect_args={'timeout': config.db_busy_timeout})
+    event.listen(_engine, 'connect', _set_sqlite_pragmas)
+    return _engine
+
+
+def init_db(engine):
+    """
+    Create missing tables and migrate existing DBs in place.
+    :param Engine engine: - engine of the DB to initialize
+    """
+    Base.metadata.create_all(engine)
+    # Add columns introduced after the table was created
+    _columns = {_column['name']
+                for _column in inspect(engine).get_columns('games')}
+    with engine.begin() as _connection:
+        for _column in Game.__table__.columns:
+            if _column.name not in _columns:
+                _connection.execute(text(
+                    "ALTER TABLE games ADD COLUMN %s %s" % (
+                        _column.name, _column.type.compile(engine.dialect))))
+    with engine.begin() as _connection:
+        # Older versions could store a game more than once. Keep the first
+        # row so that the unique index can be created.
+        _connection.execute(text(
+            "DELETE FROM games WHERE game_id NOT IN "
+            "(SELECT MIN(game_id) FROM games GROUP BY name)"))
+    for _index in Game.__table__.indexes:
+        _index.create(engine, checkfirst=True)
+
+
 # Create an engine that stores data in a sqlte db file.
 # Store the database in the lgogdownoader cache directory.
-ENGINE = create_engine("sqlite:///%s/lgog-daemon.db" % config.lgog_cache)
+ENGINE = create_db_engine("%s/lgog-daemon.db" % config.lgog_cache)
 
 Base.metadata.bind = ENGINE
 
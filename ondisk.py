@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Persistent index of installer files downloaded into the GOG library.
+"""
+
+import os
+import json
+import hashlib
+from time import monotonic
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from main import app
+
+#: Suffixes of the partial files of the http download backend
+PARTIAL_SUFFIXES = ('.part', '.part.json')
+#: Installer file suffixes and platforms they belong to
+PLATFORM_SUFFIXES = {
+    '.exe': 1,
+    '.pkg': 2,
+    '.dmg': 2,
+    '.sh': 4
+}
+
+
+def file_platform(file_name):
+    """
+    Infer the platform of an installer from its file name.
+    :param string file_name: - installer file name
+    """
+    for _suffix, _platform in PLATFORM_SUFFIXES.items():
+        if file_name.endswith(_suffix):
+            return _platform
+    return 0
+
+
+def scan_directory(path):
+    """
+    List installer files in a game directory.
+    :param string path: - path to the game directory
+    """
+    _files = []
+    with os.scandir(path) as _entries:
+        for _entry in _entries:
+            if _entry.is_dir() or _entry.name.endswith(PARTIAL_SUFFIXES):
+                continue
+            _stat = _entry.stat()
+            _files.append({
+                'name': _entry.name,
+                'size': _stat.st_size,
+                'mtime': _stat.st_mtime_ns,
+                'platform': file_platform(_entry.name)
+            })
+    return _files
+
+
+class OnDiskIndex:
+    """
+    Index of installer files per game directory. Only directories with
+    a changed mtime are rescanned on refresh and the scans run in parallel,
+    which keeps refreshes cheap on network filesystems.
+    """
+
+    def __init__(self, root, path, workers=8, period=60):
+        #: Path to the GOG library
+        self.root = root
+        #: Path to the file storing the index
+        self.path = path
+        #: Number of parallel directory scans
+        self.workers = workers
+        #: Minimal time in seconds between automatic refreshes
+        self.period = period
+        self._dirs = None
+        self._refreshed = None
+        self._lock = Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, encoding='utf-8') as _file:
+                return json.load(_file)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            app.logger.warning("Corrupted on-disk index: %s", self.path)
+            return {}
+
+    def _write(self, dirs):
+        _tmp = self.path + '.tmp'
+        try:
+            with open(_tmp, 'w', encoding='utf-8') as _file:
+                json.dump(dirs, _file)
+            os.replace(_tmp, self.path)
+        except OSError:
+            app.logger.error("Unable to store on-disk index: %s", self.path,
+                             exc_info=True)
+
+    def _check(self, name, known):
+        _path = os.path.join(self.root, name)
+        try:
+            _mtime = os.stat(_path).st_mtime_ns
+            if known is not None and known['mtime'] == _mtime:
+                return name, known
+            return name, {'mtime': _mtime, 'files': scan_directory(_path)}
+        except OSError:
+            return name, None
+
+    def refresh(self, force=False):
+        """
+        Rescan directories that changed since the last refresh.
+        :param bool force: - refresh even if the refresh period did not pass
+        """
+        with self._lock:
+            if not force and self._refreshed is not None and \
+                    monotonic() - self._refreshed < self.period:
+                return
+            if self._dirs is None:
+                self._dirs = self._read()
+            try:
+                with os.scandir(self.root) as _entries:
+                    _names = [_entry.name for _entry in _entries
+                              if _entry.is_dir()]
+            except FileNotFoundError:
+                _names = []
+            with ThreadPoolExecutor(max_workers=self.workers) as _pool:
+                _results = _pool.map(
+                    lambda _name: self._check(_name, self._dirs.get(_name)),
+                    _names)
+                _dirs = {_name: _data for _name, _data in _results
+                         if _data is not None}
+            _changed = _dirs != self._dirs
+            self._dirs = _dirs
+            self._refreshed = monotonic()
+            if _changed:
+                app.logger.debug("On-disk index updated: %s directories.",
+                                 len(_dirs))
+                self._write(_dirs)
+
+    def invalidate(self, game_name):
+        """
+        Force rescan of a game directory, e.g. after a download.
+        :param string game_name: - lgogdownloader game name
+        """
+        with self._lock:
+            if self._dirs is None:
+                self._dirs = self._read()
+            _dirs = dict(self._dirs)
+            _name, _data = self._check(game_name, None)
+            if _data is None:
+                _dirs.pop(game_name, None)
+            else:
+                _dirs[game_name] = _data
+            self._dirs = _dirs
+            self._write(_dirs)
+
+    def _current(self):
+        if self._dirs is None:
+            self.refresh()
+        return self._dirs
+
+    def games(self):
+        """
+        Get names of all directories in the GOG library.
+        """
+        return list(self._current())
+
+    def files(self, game_name):
+        """
+        Get installer files stored for a game.
+        :param string game_name: - lgogdownloader game name
+        """
+        _data = self._current().get(game_name)
+        if _data is None:
+            return []
+        return _data['files']
+
+    def platform(self, game_name):
+        """
+        Get the bitmask of platforms with installers on disk for a game.
+        :param string game_name: - lgogdownloader game name
+        """
+        _platform = 0
+        for _file in self.files(game_name):
+            _platform |= _file['platform']
+        return _platform
+
+    def fingerprint(self, game_name):
+        """
+        Get a fingerprint of the installer files of a game. It changes when
+        a file is added, removed or modified. The files are listed from the
+        index, which notices added and removed files by the directory mtime,
+        but their sizes and mtimes are read here because a file modified in
+        place does not change the mtime of its directory.
+        :param string game_name: - lgogdownloader game name
+        """
+        _path = os.path.join(self.root, game_name)
+        _files = []
+        for _file in self.files(game_name):
+            try:
+                _stat = os.stat(os.path.join(_path, _file['name']))
+                _files.append((_file['name'], _stat.st_size,
+                               _stat.st_mtime_ns))
+            except OSError:
+                _files.append((_file['name'], None, None))
+        _files.sort()
+        return hashlib.sha1(json.dumps(_files).encode('utf-8')).hexdigest()
+
+
+#: Index of the GOG library shared by the web routes and the daemon workers
+ONDISK = OnDiskIndex(config.lgog_library,
+                     os.path.join(config.lgog_cache, 'ondisk-index.json'),
+                     period=config.ondisk_refresh_period)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Opt-in request timing and profiling middleware.
+"""
+
+import io
+import os
+import re
+import pstats
+import cProfile
+import tracemalloc
+from datetime import datetime
+from threading import Lock, local
+from time import perf_counter, thread_time
+
+from sqlalchemy import event
+
+from main import app
+
+#: Supported profilers
+PROFILERS = ('cprofile', 'tracemalloc')
+#: Request header selecting a profiler for the request
+PROFILE_HEADER = 'HTTP_X_LGOG_PROFILE'
+#: Number of entries in the text reports
+REPORT_LINES = 50
+
+_local = local()
+
+
+def _before_execute(conn, cursor, statement, parameters, context,
+                    executemany):
+    _local.statement_start = perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context,
+                   executemany):
+    _stats = getattr(_local, 'sql', None)
+    _start = getattr(_local, 'statement_start', None)
+    if _stats is not None and _start is not None:
+        _stats[0] += 1
+        _stats[1] += perf_counter() - _start
+
+
+class RequestProfiler:
+    """
+    WSGI middleware measuring wall and CPU time and SQL statements of every
+    request. Slow requests are logged. A request can be profiled with
+    cProfile or tracemalloc when it carries the X-Lgog-Profile header or
+    when profiling of the next requests was armed with profile_next; the
+    reports are written to the profile directory.
+    """
+
+    def __init__(self, wsgi_app, slow_threshold=1.0, profile_dir=None):
+        """
+        :param wsgi_app: - wrapped WSGI application
+        :param float slow_threshold: - requests taking longer (in seconds)
+                                       are logged
+        :param string profile_dir: - directory for the profiler reports
+        """
+        self.app = wsgi_app
+        self.slow_threshold = slow_threshold
+        self.profile_dir = profile_dir
+        self._armed = []
+        self._lock = Lock()
+        # Only one profiler of each kind may run at the same time
+        self._profiler_locks = {_kind: Lock() for _kind in PROFILERS}
+
+    def profile_next(self, kind, path='/', count=1):
+        """
+        Profile the next requests with path starting with a prefix.
+        :param string kind: - one of PROFILERS
+        :param string path: - path prefix of the profiled requests
+        :param int count: - number of requests to profile
+        """
+        if kind not in PROFILERS:
+            raise ValueError("Unknown profiler: %s" % kind)
+        with self._lock:
+            self._armed.append([kind, path, count])
+
+    def _requested_profiler(self, environ):
+        _kind = environ.get(PROFILE_HEADER, '').lower()
+        if _kind in PROFILERS:
+            return _kind
+        _path = environ.get('PATH_INFO', '')
+        with self._lock:
+            for _armed in self._armed:
+                if _path.startswith(_armed[1]):
+                    _armed[2] -= 1
+                    if _armed[2] <= 0:
+                        self._armed.remove(_armed)
+                    return _armed[0]
+        return None
+
+    def _report_path(self, environ, suffix):
+        _name = re.sub(r'[^A-Za-z0-9]+', '_',
+                       environ.get('PATH_INFO', '')).strip('_') or 'root'
+        os.makedirs(self.profile_dir, exist_ok=True)
+        return os.path.join(self.profile_dir, '%s-%s-%s.%s' % (
+            datetime.now().strftime('%Y%m%dT%H%M%S%f'),
+            environ.get('REQUEST_METHOD', 'GET'), _name[:60], suffix))
+
+    def _cprofile(self, environ, start_response):
+        _profile = cProfile.Profile()
+        _profile.enable()
+        try:
+            return self.app(environ, start_response)
+        finally:
+            _profile.disable()
+            _path = self._report_path(environ, 'prof')
+            _profile.dump_stats(_path)
+            _text = io.StringIO()
+            pstats.Stats(_profile, stream=_text).sort_stats(
+                'cumulative').print_stats(REPORT_LINES)
+            with open(_path[:-len('prof')] + 'txt', 'w',
+                      encoding='utf-8') as _file:
+                _file.write(_text.getvalue())
+            app.logger.info("Profile of %s written to %s",
+                            environ.get('PATH_INFO'), _path)
+
+    def _tracemalloc(self, environ, start_response):
+        tracemalloc.start(25)
+        try:
+            return self.app(environ, start_response)
+        finally:
+            _snapshot = tracemalloc.take_snapshot()
+            _current, _peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            _path = self._report_path(environ, 'txt')
+            with open(_path, 'w', encoding='utf-8') as _file:
+                _file.write("Peak traced memory: %s B, retained: %s B\n\n" %
+                            (_peak, _current))
+                for _stat in _snapshot.statistics('lineno')[:REPORT_LINES]:
+                    _file.write("%s\n" % _stat)
+            app.logger.info("Memory profile of %s written to %s",
+                            environ.get('PATH_INFO'), _path)
+
+    def _call(self, environ, start_response):
+        _kind = self._requested_profiler(environ)
+        if _kind is None or self.profile_dir is None:
+            return self.app(environ, start_response)
+        _lock = self._profiler_locks[_kind]
+        if not _lock.acquire(blocking=False):
+            app.logger.warning("Profiler %s busy, %s not profiled.", _kind,
+                               environ.get('PATH_INFO'))
+            return self.app(environ, start_response)
+        try:
+            if _kind == 'cprofile':
+                return self._cprofile(environ, start_response)
+            return self._tracemalloc(environ, start_response)
+        finally:
+            _lock.release()
+
+    def __call__(self, environ, start_response):
+        _local.sql = [0, 0.0]
+        _wall = perf_counter()
+        _cpu = thread_time()
+        try:
+            return self._call(environ, start_response)
+        finally:
+            _wall = perf_counter() - _wall
+            _cpu = thread_time() - _cpu
+            _count, _sql = _local.sql
+            _local.sql = None
+            if _wall >= self.slow_threshold:
+                app.logger.warning(
+                    "Slow request %s %s: wall %.3f s, CPU %.3f s, "
+                    "%s SQL statements in %.3f s",
+                    environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'),
+                    _wall, _cpu, _count, _sql)
+
+
+def install(flask_app, engine, slow_threshold=1.0, profile_dir=None):
+    """
+    Wrap a Flask application with the RequestProfiler and count SQL
+    statements executed by the engine. Returns the middleware.
+    :param Flask flask_app: - application to wrap
+    :param Engine engine: - SQLAlchemy engine used by the application
+    :param float slow_threshold: - requests taking longer are logged
+    :param string profile_dir: - directory for the profiler reports
+    """
+    event.listen(engine, 'before_cursor_execute', _before_execute)
+    event.listen(engine, 'after_cursor_execute', _after_execute)
+    _profiler = RequestProfiler(flask_app.wsgi_app, slow_threshold,
+                                profile_dir)
+    flask_app.wsgi_app = _profiler
+    return _profiler
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+In-memory registry with the live progress of active downloads.
+"""
+
+from time import monotonic
+from threading import Lock, Event
+
+import config
+from events import EVENTS
+
+
+class DownloadProgress:
+    """
+    Live state of a single active download.
+    """
+
+    def __init__(self, game_name, platform):
+        #: lgogdownloader game name
+        self.game_name = game_name
+        #: bitmask of platforms being downloaded
+        self.platform = platform
+        #: download progress in %
+        self.progress = 0.0
+        #: number of downloaded bytes
+        self.downloaded = 0
+        #: monotonic time of the start of the download
+        self.started = monotonic()
+        #: set when the download should be stopped
+        self.cancelled = Event()
+        #: monotonic time of the last write to the DB
+        self.persisted = monotonic()
+
+
+class ProgressRegistry:
+    """
+    Thread safe registry of active downloads. Workers report progress here
+    and the web routes read it directly, so the DB is only written on state
+    transitions or every persist_period seconds.
+    """
+
+    def __init__(self, persist_period=10):
+        #: Time in seconds between writes of the progress to the DB
+        self.persist_period = persist_period
+        self._downloads = {}
+        self._lock = Lock()
+
+    def start(self, game_name, platform):
+        """
+        Register an active download.
+        :param string game_name: - lgogdownloader game name
+        :param int platform: - bitmask of platforms being downloaded
+        """
+        _download = DownloadProgress(game_name, platform)
+        with self._lock:
+            self._downloads[game_name] = _download
+        return _download
+
+    def update(self, game_name, progress, downloaded=None):
+        """
+        Update progress of an active download. Returns True if the progress
+        should be persisted in the DB.
+        :param string game_name: - lgogdownloader game name
+        :param float progress: - download progress in %
+        :param int downloaded: - number of downloaded bytes
+        """
+        with self._lock:
+            _download = self._downloads.get(game_name)
+            if _download is None:
+                return False
+            if downloaded is not None:
+                _download.downloaded = downloaded
+            _changed = _download.progress != progress
+            _download.progress = progress
+            if _changed:
+                EVENTS.publish('progress', {game_name: {
+                    'state': 'running',
+                    'progress': progress
+                    }})
+            _now = monotonic()
+            if _now - _download.persisted >= self.persist_period:
+                _download.persisted = _now
+                return True
+        return False
+
+    def finish(self, game_name):
+        """
+        Remove a download from the registry.
+        :param string game_name: - lgogdownloader game name
+        """
+        with self._lock:
+            self._downloads.pop(game_name, None)
+
+    def cancel(self, game_name):
+        """
+        Request stop of an active download. Returns False if the game is not
+        being downloaded.
+        :param string game_name: - lgogdownloader game name
+        """
+        with self._lock:
+            _download = self._downloads.get(game_name)
+        if _download is None:
+            return False
+        _download.cancelled.set()
+        return True
+
+    def get(self, game_name):
+        """
+        Get live state of a download or None if the game is not active.
+        :param string game_name: - lgogdownloader game name
+        """
+        with self._lock:
+            return self._downloads.get(game_name)
+
+    def active(self):
+        """
+        Get live state of all active downloads.
+        """
+        with self._lock:
+            return list(self._downloads.values())
+
+
+#: Registry shared by the download workers and the web routes
+PROGRESS = ProgressRegistry(config.progress_persist_period)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Non-blocking runner for lgogdownloader commands.
+"""
+
+import os
+import re
+import codecs
+import selectors
+from collections import deque
+from subprocess import Popen, PIPE, TimeoutExpired
+from threading import Lock
+from time import monotonic
+
+from main import app
+from metrics import METRICS, COMMANDS, COMMAND_DURATION
+
+_running = {}
+_running_lock = Lock()
+
+
+def _running_commands():
+    with _running_lock:
+        return [((_kind,), _count) for _kind, _count in sorted(_running.items())]
+
+
+METRICS.gauge('lgogwebui_commands_running', 'Running lgogdownloader commands.',
+              ('kind',), _running_commands)
+
+
+class CommandCancelled(Exception):
+    """
+    Exception thrown when a command is stopped by the cancellation event.
+    """
+    pass
+
+
+class Command:
+    """
+    Subprocess with stdout and stderr multiplexed line by line. Both pipes
+    are drained as data arrives, so a chatty stream can never fill its pipe
+    and block the child. A partial line matching the prompt pattern is
+    reported immediately, which allows answering interactive questions.
+    """
+
+    #: Number of trailing output lines kept for error messages
+    TAIL = 100
+
+    def __init__(self, opts, prompt=None, stdin=False, kind='other'):
+        """
+        :param list opts: - command line
+        :param string prompt: - regex matching an unterminated prompt line
+        :param bool stdin: - open a pipe to the standard input
+        :param string kind: - type of the command reported in the metrics
+        """
+        self.opts = opts
+        self.kind = kind
+        self._started = monotonic()
+        self._finished = False
+        self._prompt = re.compile(prompt) if prompt is not None else None
+        self._proc = Popen(opts, stdout=PIPE, stderr=PIPE,
+                           stdin=PIPE if stdin else None)
+        # Counted once started, a command that fails to start never finishes
+        with _running_lock:
+            _running[kind] = _running.get(kind, 0) + 1
+        self._selector = selectors.DefaultSelector()
+        self._streams = {}
+        for _name, _pipe in (('out', self._proc.stdout),
+                             ('err', self._proc.stderr)):
+            os.set_blocking(_pipe.fileno(), False)
+            self._selector.register(_pipe, selectors.EVENT_READ, _name)
+            self._streams[_name] = {
+                'decoder': codecs.getincrementaldecoder('utf-8')('replace'),
+                'buffer': '',
+                'tail': deque(maxlen=self.TAIL)
+            }
+
+    @property
+    def returncode(self):
+        """
+        Exit code of the command or None if it is still running.
+        """
+        return self._proc.returncode
+
+    @property
+    def out(self):
+        """
+        Trailing lines of the standard output.
+        """
+        return '\n'.join(self._streams['out']['tail'])
+
+    @property
+    def err(self):
+        """
+        Trailing lines of the standard error.
+        """
+        return '\n'.join(self._streams['err']['tail'])
+
+    def write(self, text):
+        """
+        Write text to the standard input of the command.
+        :param string text: - text to write
+        """
+        self._proc.stdin.write(text.encode('utf-8'))
+        self._proc.stdin.flush()
+
+    def terminate(self):
+        """
+        Stop the command and wait until it exits.
+        """
+        if self._proc.poll() is None:
+            self._proc.terminate()
+            try:
+                self._proc.wait(5)
+            except TimeoutExpired:
+                self._proc.kill()
+                self._proc.wait()
+        self._close()
+        self._record()
+
+    def _record(self):
+        if self._finished:
+            return
+        self._finished = True
+        with _running_lock:
+            _running[self.kind] -= 1
+        COMMANDS.inc(self.kind, str(self._proc.returncode))
+        COMMAND_DURATION.observe(monotonic() - self._started, self.kind)
+
+    def _close(self):
+        if self._selector.get_map():
+            for _key in list(self._selector.get_map().values()):
+                self._selector.unregister(_key.fileobj)
+                _key.fileobj.close()
+        if self._proc.stdin is not None and not self._proc.stdin.closed:
+            self._proc.stdin.close()
+
+    def _split(self, name, data, final=False):
+        _stream = self._streams[name]
+        _stream['buffer'] += _stream['decoder'].decode(data, final)
+        _lines = _stream['buffer'].split('\n')
+        _stream['buffer'] = _lines.pop()
+        if _stream['buffer'] and (
+                final or (self._prompt is not None and
+                          self._prompt.search(_stream['buffer']))):
+            _lines.append(_stream['buffer'])
+            _stream['buffer'] = ''
+        for _line in _lines:
+            _line = _line.rstrip('\r')
+            _stream['tail'].append(_line)
+            yield name, _line
+
+    def lines(self, timeout=None, cancel=None, poll=0.5):
+        """
+        Iterate over (stream, line) tuples until the command exits. Stream is
+        either 'out' or 'err'.
+        :param float timeout: - maximal run time in seconds
+        :param Event cancel: - stop the command when the event is set
+        :param float poll: - maximal time between cancellation checks
+        """
+        _deadline = None
+        if timeout is not None:
+            _deadline = monotonic() + timeout
+        try:
+            while self._selector.get_map():
+                if cancel is not None and cancel.is_set():
+                    self.terminate()
+                    raise CommandCancelled()
+                _wait = poll
+                if _deadline is not None:
+                    _wait = min(_wait, _deadline - monotonic())
+                    if _wait <= 0:
+                        self.terminate()
+                        raise TimeoutExpired(self.opts, timeout,
+                                             self.out, self.err)
+                for _key, _mask in self._selector.select(_wait):
+                    _data = os.read(_key.fileobj.fileno(), 65536)
+                    if not _data:
+                        self._selector.unregister(_key.fileobj)
+                        _key.fileobj.close()
+                        yield from self._split(_key.data, b'', final=True)
+                        continue
+                    yield from self._split(_key.data, _data)
+            self._proc.wait()
+        finally:
+            # Generator closed early or an error occurred
+            if self._proc.poll() is None:
+                app.logger.debug("Terminate command: %s", self.opts[:2])
+            self.terminate()
+
+
+def run(opts, timeout=None, cancel=None, kind='other'):
+    """
+    Run a command to completion and return the Command with collected output.
+    :param list opts: - command line
+    :param float timeout: - maximal run time in seconds
+    :param Event cancel: - stop the command when the event is set
+    :param string kind: - type of the command reported in the metrics
+    """
+    _command = Command(opts, kind=kind)
+    for _stream, _line in _command.lines(timeout, cancel):
+        pass
+    return _command
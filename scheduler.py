@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Schedulers of the download, update and status check jobs.
+"""
+
+from math import ceil
+from itertools import count
+from threading import Condition, Lock, Thread
+from time import monotonic
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from main import app
+
+
+class Job:
+    """
+    Scheduled call of a function.
+    """
+
+    def __init__(self, key, func, args, priority, threads, seq):
+        #: Unique key of the job, e.g. game name
+        self.key = key
+        self.func = func
+        self.args = args
+        #: Jobs with higher priority are started first
+        self.priority = priority
+        #: Number of threads used by the job
+        self.threads = threads
+        #: Submission order, used for jobs with equal priority
+        self.seq = seq
+        self.future = Future()
+
+    def order(self):
+        """
+        Sort key of the job in the queue.
+        """
+        return (-self.priority, self.seq)
+
+
+class PriorityScheduler:
+    """
+    Pool of worker threads executing queued jobs ordered by priority.
+    Besides the number of workers, the total number of threads declared by
+    the running jobs is limited, so a few jobs with many threads cannot
+    oversubscribe the disk.
+    """
+
+    def __init__(self, max_workers=2, max_threads=None, name="Scheduler"):
+        """
+        :param int max_workers: - number of jobs executed concurrently
+        :param int max_threads: - limit of threads used by all running jobs
+        :param string name: - prefix of worker thread names
+        """
+        self.max_workers = max_workers
+        self.max_threads = max_threads
+        self._queue = {}
+        self._running = {}
+        self._threads = 0
+        self._seq = count()
+        self._cond = Condition()
+        self._shutdown = False
+        for _index in range(max_workers):
+            Thread(target=self._worker, name="%s-%s" % (name, _index),
+                   daemon=True).start()
+
+    def submit(self, key, func, *args, priority=0, threads=1):
+        """
+        Queue a job. If a job with the same key is already queued it is
+        returned instead.
+        :param string key: - unique key of the job
+        :param callable func: - function to execute
+        :param int priority: - jobs with higher priority are started first
+        :param int threads: - number of threads used by the job
+        """
+        if self.max_threads is not None:
+            threads = min(threads, self.max_threads)
+        with self._cond:
+            if key in self._queue:
+                return self._queue[key].future
+            _job = Job(key, func, args, priority, threads, next(self._seq))
+            self._queue[key] = _job
+            self._cond.notify_all()
+            return _job.future
+
+    def set_priority(self, key, priority):
+        """
+        Change priority of a queued job. Returns False if the job is not
+        queued.
+        :param string key: - unique key of the job
+        :param int priority: - new priority
+        """
+        with self._cond:
+            _job = self._queue.get(key)
+            if _job is None:
+                return False
+            _job.priority = priority
+            self._cond.notify_all()
+            return True
+
+    def move_to_front(self, key):
+        """
+        Make a queued job the next one to start.
+        :param string key: - unique key of the job
+        """
+        with self._cond:
+            if key not in self._queue:
+                return False
+            _top = max(_job.priority for _job in self._queue.values())
+            _job = self._queue[key]
+            _job.priority = _top
+            _job.seq = -next(self._seq)
+            self._cond.notify_all()
+            return True
+
+    def reorder(self, keys):
+        """
+        Set the order of queued jobs. Listed jobs are moved to the front of
+        the queue in the given order, remaining jobs keep their order.
+        :param list keys: - keys of the jobs
+        """
+        with self._cond:
+            _keys = [_key for _key in keys if _key in self._queue]
+            if not _keys:
+                return []
+            _top = max(_job.priority for _job in self._queue.values())
+            _first = -next(self._seq) - len(_keys)
+            for _index, _key in enumerate(_keys):
+                _job = self._queue[_key]
+                _job.priority = _top
+                _job.seq = _first + _index
+            self._cond.notify_all()
+            return _keys
+
+    def cancel(self, key):
+        """
+        Remove a job from the queue. Running jobs are not affected.
+        :param string key: - unique key of the job
+        """
+        with self._cond:
+            _job = self._queue.pop(key, None)
+        if _job is None:
+            return False
+        _job.future.cancel()
+        return True
+
+    def queued(self):
+        """
+        Get keys of queued jobs in the order they will be started.
+        """
+        with self._cond:
+            return [_job.key for _job in
+                    sorted(self._queue.values(), key=Job.order)]
+
+    def ordered(self):
+        """
+        Get (key, priority) of queued jobs in the order they will be started.
+        """
+        with self._cond:
+            return [(_job.key, _job.priority) for _job in
+                    sorted(self._queue.values(), key=Job.order)]
+
+    def running(self):
+        """
+        Get keys of running jobs.
+        """
+        with self._cond:
+            return list(self._running)
+
+    def shutdown(self):
+        """
+        Stop the workers after the running jobs finish.
+        """
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+
+    def _next(self):
+        # Highest priority job that fits into the thread limit. A job is never
+        # started while another one with the same key is running.
+        for _job in sorted(self._queue.values(), key=Job.order):
+            if _job.key in self._running:
+                continue
+            if self.max_threads is None or \
+                    self._threads + _job.threads <= self.max_threads:
+                return _job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                _job = None
+                while not self._shutdown:
+                    _job = self._next()
+                    if _job is not None:
+                        break
+                    self._cond.wait()
+                if _job is None:
+                    return
+                del self._queue[_job.key]
+                self._running[_job.key] = _job
+                self._threads += _job.threads
+            if _job.future.set_running_or_notify_cancel():
+                try:
+                    _job.future.set_result(_job.func(*_job.args))
+                except Exception as _error:
+                    app.logger.error("Job %s raised an error", _job.key,
+                                     exc_info=True)
+                    _job.future.set_exception(_error)
+            with self._cond:
+                self._running.pop(_job.key, None)
+                self._threads -= _job.threads
+                self._cond.notify_all()
+
+
+class TrackedExecutor(ThreadPoolExecutor):
+    """
+    Thread pool counting queued and running tasks.
+    """
+
+    def __init__(self, max_workers=2, name="Executor"):
+        super().__init__(max_workers=max_workers, thread_name_prefix=name)
+        self.max_workers = max_workers
+        self._queued = 0
+        self._active = 0
+        self._counter_lock = Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._counter_lock:
+            self._queued += 1
+
+        def _call():
+            with self._counter_lock:
+                self._queued -= 1
+                self._active += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._counter_lock:
+                    self._active -= 1
+        return super().submit(_call)
+
+    def counts(self):
+        """
+        Get numbers of (queued, running) tasks.
+        """
+        with self._counter_lock:
+            return self._queued, self._active
+
+
+class PacedScheduler:
+    """
+    Single worker calling a function with batches of keys, e.g. game names
+    to check. Every key has a due time, so periodic work can be spread over
+    a period instead of running in a burst, and urgent keys are handled
+    first. Consecutive runs are separated by at least min_interval seconds.
+    """
+
+    def __init__(self, func, batch_size=50, min_interval=0, name="Paced"):
+        """
+        :param callable func: - function called with a list of keys
+        :param int batch_size: - maximal number of keys of a single call
+        :param float min_interval: - minimal time between two calls
+        :param string name: - name of the worker thread
+        """
+        self.func = func
+        self.batch_size = batch_size
+        self.min_interval = min_interval
+        self.name = name
+        self._due = {}
+        self._running = []
+        self._last = None
+        self._cond = Condition()
+        self._thread = None
+
+    def _add(self, keys, due):
+        # Must be called with the lock held
+        for _key, _due in zip(keys, due):
+            # A key keeps the earlier of its due times
+            if _key not in self._due or self._due[_key] > _due:
+                self._due[_key] = _due
+        if self._thread is None:
+            self._thread = Thread(target=self._worker, name=self.name,
+                                  daemon=True)
+            self._thread.start()
+        self._cond.notify_all()
+
+    def plan(self, keys, period):
+        """
+        Spread keys evenly over a period. The keys are handled in the given
+        order in batches of batch_size. Keys that are already queued keep
+        their due time.
+        :param list keys: - keys to handle
+        :param float period: - time in seconds to spread the keys over
+        """
+        with self._cond:
+            keys = [_key for _key in keys if _key not in self._due]
+            if not keys:
+                return
+            _interval = period / ceil(len(keys) / self.batch_size)
+            _now = monotonic()
+            self._add(keys, [_now + (_index // self.batch_size) * _interval
+                             for _index in range(len(keys))])
+
+    def urgent(self, keys):
+        """
+        Handle keys as soon as possible.
+        :param list keys: - keys to handle
+        """
+        keys = list(keys)
+        if not keys:
+            return
+        with self._cond:
+            self._add(keys, [monotonic()] * len(keys))
+
+    def due(self):
+        """
+        Get keys that are due and not yet handled.
+        """
+        _now = monotonic()
+        with self._cond:
+            return [_key for _key, _due in self._due.items() if _due <= _now]
+
+    def counts(self):
+        """
+        Get numbers of (queued, running) keys.
+        """
+        with self._cond:
+            return len(self._due), len(self._running)
+
+    def _wait(self):
+        # Must be called with the lock held, returns the next batch
+        while True:
+            _now = monotonic()
+            if self._due:
+                _next = min(self._due.values())
+                if self._last is not None:
+                    _next = max(_next, self._last + self.min_interval)
+                if _next <= _now:
+                    break
+                self._cond.wait(_next - _now)
+            else:
+                self._cond.wait()
+        _batch = sorted((_key for _key, _due in self._due.items()
+                         if _due <= _now),
+                        key=self._due.get)[:self.batch_size]
+        for _key in _batch:
+            del self._due[_key]
+        return _batch
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._running = self._wait()
+            try:
+                self.func(self._running)
+            except Exception:
+                app.logger.error("%s job raised an error", self.name,
+                                 exc_info=True)
+            finally:
+                with self._cond:
+                    self._running = []
+                    self._last = monotonic()
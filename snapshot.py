@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Precomputed view of the game library served by the main page.
+"""
+
+import hashlib
+from itertools import count
+from threading import Condition, Lock, Thread
+from time import monotonic
+
+from sqlalchemy.exc import IntegrityError
+
+import config
+from main import app
+from catalog import CATALOG, available_platforms
+from events import EVENTS
+from gametable import GameTable, selected_platforms
+from ondisk import ONDISK
+from models import Game, User, Status, SESSION_FACTORY
+
+
+def game_row(db_game):
+    """
+    Get the DB state of a game as a dictionary.
+    :param Game db_game: - game loaded from the DB
+    """
+    return {
+        'game_id': db_game.game_id,
+        'platform': db_game.platform,
+        'platform_available': db_game.platform_available,
+        'platform_ondisk': db_game.platform_ondisk,
+        'progress': db_game.progress,
+        'state': db_game.state,
+        'done_count': db_game.done_count,
+        'missing_count': db_game.missing_count,
+        'update_count': db_game.update_count
+        }
+
+
+def new_game_row(name, available):
+    """
+    Get the DB state of a game that is not yet stored in the DB.
+    :param string name: - game name
+    :param int available: - bitmask of available platforms
+    """
+    return {
+        'name': name,
+        'platform': -1,
+        'platform_available': available,
+        'platform_ondisk': 0,
+        'progress': 0,
+        'state': Status.new,
+        'done_count': 0,
+        'missing_count': 0,
+        'update_count': 0
+        }
+
+
+def catalog_id(signature):
+    """
+    Get the identifier of a catalog version sent to the clients. It is
+    derived from the catalog file, so every process reports the same one.
+    :param tuple signature: - signature of the catalog file
+    """
+    if signature is None:
+        return ''
+    return hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()[:16]
+
+
+class LibrarySnapshot:
+    """
+    Immutable result of a reconciliation of the catalog with the DB.
+    """
+
+    def __init__(self, version, table, user_platform, catalog_signature):
+        #: Number of the build, increases with every rebuild
+        self.version = version
+        #: GameTable with all games of the catalog
+        self.table = table
+        #: Default platforms of the user the table was built with
+        self.user_platform = user_platform
+        #: Signature of the catalog the snapshot was built from
+        self.catalog_signature = catalog_signature
+        #: Identifier of the catalog sent to the clients
+        self.catalog_id = catalog_id(catalog_signature)
+        #: Game descriptions in the catalog order
+        self.records = tuple(table.records())
+        self._rendered = {}
+        self._lock = Lock()
+
+    def rendered(self, key, render):
+        """
+        Get a rendering of the snapshot, e.g. the main page for a given
+        script root. Each rendering is computed only once per snapshot.
+        :param tuple key: - key of the rendering
+        :param callable render: - function computing the rendering
+        """
+        with self._lock:
+            if key not in self._rendered:
+                self._rendered[key] = render()
+            return self._rendered[key]
+
+
+def reconcile(session):
+    """
+    Reconcile the catalog with the DB. New games are added with the state
+    found on disk, changed available platforms and games with missing
+    platforms are updated. All writes are done in bulk with one commit.
+    Returns (table rows, user platform, catalog signature).
+    :param Session session: - DB session
+    """
+    _catalog = CATALOG.snapshot()
+    ONDISK.refresh()
+    _user = session.query(User).one()
+    _user_platform = _user.platform
+    _db_games = {_game.name: _game for _game in session.query(Game).all()}
+    _rows = []
+    _inserts = []
+    _updates = []
+    for game_data in _catalog:
+        if 'installers' not in game_data:
+            continue
+        _available = available_platforms(game_data)
+
+        db_game = _db_games.get(game_data['gamename'])
+        if db_game is not None:
+            _row = game_row(db_game)
+            _update = {}
+            if _row['platform_available'] != _available:
+                _update['platform_available'] = _available
+        else:
+            _name = game_data['gamename']
+            _row = new_game_row(_name, _available)
+            _update = None
+            # Search for downloaded installers
+            _platform = ONDISK.platform(_name)
+            if _platform > 0:
+                _row['platform_ondisk'] = _platform
+                _row['state'] = Status.done
+                if (_platform & _user_platform) == 0:
+                    _row['platform'] = _platform
+            _inserts.append(_row)
+
+        _rows.append((game_data, _available, _row))
+        # Games using the default platforms have platform -1
+        _selected = selected_platforms(_row['platform'], _available,
+                                       _user_platform)
+        if _update is not None and _row['state'] == Status.done and \
+                _selected != (_row['platform_ondisk'] & _selected):
+            # The published row shows the state written to the DB
+            _update['state'] = _row['state'] = Status.missing
+        if _update:
+            _update['game_id'] = _row['game_id']
+            _updates.append(_update)
+
+    if _inserts:
+        session.bulk_insert_mappings(Game, _inserts)
+    if _updates:
+        session.bulk_update_mappings(Game, _updates)
+    try:
+        session.commit()
+    except IntegrityError:
+        # Games were added concurrently, e.g. by a status check
+        app.logger.debug("Games added by a concurrent transaction.")
+        session.rollback()
+    if _inserts or _updates:
+        # Bulk writes bypass the session events
+        EVENTS.touch()
+    return _rows, _user_platform, _catalog.signature
+
+
+class LibraryBuilder:
+    """
+    Owner of the current library snapshot. Rebuilds are requested by the
+    code changing the library (cache updates, downloads, platform toggles)
+    and executed by a single background thread, so readers never wait for
+    the reconciliation and concurrent requests do not compete for DB writes.
+    Requests arriving during a rebuild are coalesced into one more rebuild.
+    """
+
+    def __init__(self, delay=1):
+        """
+        :param float delay: - time to collect rebuild requests before a
+                              rebuild starts
+        """
+        self.delay = delay
+        self._snapshot = None
+        self._versions = count(1)
+        self._requested = None
+        self._cond = Condition()
+        self._build_lock = Lock()
+        self._thread = None
+
+    def build(self):
+        """
+        Rebuild the snapshot synchronously and return it. The build uses
+        its own DB session, so the session of the calling thread is kept.
+        """
+        with self._build_lock:
+            _session = SESSION_FACTORY()
+            try:
+                _rows, _platform, _signature = reconcile(_session)
+            finally:
+                _session.close()
+            _snapshot = LibrarySnapshot(next(self._versions),
+                                        GameTable(_rows, _platform),
+                                        _platform, _signature)
+            with self._cond:
+                _previous = self._snapshot
+                self._snapshot = _snapshot
+        # Clients holding a page of the previous snapshot are outdated
+        EVENTS.touch()
+        if _previous is None or \
+                _previous.catalog_signature != _snapshot.catalog_signature:
+            # Pages of an older catalog reload once the new one is served
+            EVENTS.publish('library', {'catalog': _snapshot.catalog_id})
+        app.logger.debug("Library snapshot %s built: %s games.",
+                         _snapshot.version, len(_snapshot.table))
+        return _snapshot
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._requested is not None)
+                _wait = self._requested + self.delay - monotonic()
+                if _wait > 0:
+                    self._cond.wait(_wait)
+                    continue
+                self._requested = None
+            try:
+                self.build()
+            except Exception:
+                app.logger.error("Library rebuild raised an error",
+                                 exc_info=True)
+
+    def rebuild(self):
+        """
+        Request a rebuild of the snapshot in the background.
+        """
+        with self._cond:
+            if self._requested is None:
+                self._requested = monotonic()
+            if self._thread is None:
+                self._thread = Thread(target=self._worker,
+                                      name="LibraryBuilder", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def snapshot(self):
+        """
+        Get the current snapshot. The first call builds it synchronously,
+        a change of the catalog file requests a rebuild.
+        """
+        with self._cond:
+            _snapshot = self._snapshot
+        if _snapshot is None:
+            return self.build()
+        if _snapshot.catalog_signature != CATALOG.snapshot().signature:
+            self.rebuild()
+        return _snapshot
+
+
+#: Library snapshot shared by the web routes, rebuilt by the daemon workers
+LIBRARY = LibraryBuilder(config.library_rebuild_delay)
@@ -1,20 +1,24 @@
 var active_games = []
 var user_status = ""
 var download_filter = false
-var timestamp = 0
+var event_source = null
+var PLATFORM_NAMES = {1: "windows", 2: "macos", 4: "linux"}
+
+function toggle_selected(game, platform, missing) {
+    var selected = Object.assign({}, game.selected);
+    selected[PLATFORM_NAMES[platform]] = !selected[PLATFORM_NAMES[platform]];
+    return {
+        selected: selected,
+        missing_count: missing ? Math.max(game.missing_count, 1) : 0
+    };
+}
 
 function toggle_platform(game, platform) {
     $.get(root_url+"/platform/"+game+"/"+platform, function(data){
-        $("#"+game+"_platform_1").addClass("selected");
-        $("#"+game+"_platform_2").addClass("selected");
-        $("#"+game+"_platform_4").addClass("selected");
-        $("#"+game+"_platform_"+platform).toggleClass("disabled");
         console.log( "Toggle result: " + data )
-        if(data.missing) {
-            $("#"+game+"_download").show();
-        } else {
-            $("#"+game+"_download").hide();
-        }
+        var changes = toggle_selected(library_game(game), platform, data.missing);
+        changes.user_selected = true;
+        library_update(game, changes);
     })
     .fail(function(jqXHR, textStatus, errorThrown) {
         console.log(textStatus)
@@ -27,12 +31,8 @@ function toggle_default_platform(platform) {
         $("#platform_"+platform).toggleClass("disabled");
         Object.keys(data).forEach(function(game) {
             console.log( "Toggle " + game + " :missing=" + data[game].missing )
-            $("#"+game+"_platform_"+platform).toggleClass("disabled");
-            if(data[game].missing) {
-                $("#"+game+"_download").show();
-            } else {
-                $("#"+game+"_download").hide();
-            }
+            library_update(game, toggle_selected(library_game(game), platform,
+                                                 data[game].missing));
         })
     })
     .fail(function(jqXHR, textStatus, errorThrown) {
@@ -46,14 +46,11 @@ function game_download(game) {
     $.get(root_url+"/download/"+game, function(data){
         console.log( "download scheduled" );
         active_games.push(game)
-        $("#"+game+"_progress").show();
-        $("#"+game+"_spinner").show();
-        $("#"+game+"_download").hide();
-        $("#"+game+"_update").hide();
+        library_update(game, {state: "queued", progress: 0});
     })
     .fail(function(jqXHR, textStatus, errorThrown) {
         console.log(textStatus)
-        alert( textStatus );
+        alert( jqXHR.responseText || textStatus );
     });
 }
 
@@ -61,11 +58,12 @@ function game_stop(game) {
     console.log( "stop download" );
     $.get(root_url+"/stop/"+game, function(data){
         console.log( "stop requested" );
-        $("#"+game+"_progress").hide();
-        $("#"+game+"_spinner").hide();
-        $("#"+game+"_download").show();
-        $("#"+game+"_update").hide();
-        $("#"+game+"_repo").show();
+        var _game = library_game(game);
+        library_update(game, {
+            state: "stop",
+            missing_count: Math.max(_game.missing_count, 1),
+            ondisk: Object.assign({}, _game.selected)
+        });
         const index = active_games.indexOf(game);
         active_games.splice(index, 1);
     })
@@ -75,7 +73,90 @@ function game_stop(game) {
     });
 }
 
+function update_games(data) {
+    Object.keys(data).forEach(function(game) {
+        console.log(game)
+        const index = active_games.indexOf(game);
+        if (data[game].state === 'running' || data[game].state === 'queued') {
+            console.log("Active download - update")
+            if(index < 0) {
+                active_games.push(game)
+            }
+            library_update(game, {state: data[game].state,
+                                  progress: data[game].progress});
+        } else if (index >= 0 && data[game].state === 'done') {
+            console.log("Download finished")
+            library_update(game, {
+                state: "done",
+                progress: data[game].progress,
+                missing_count: 0,
+                update_count: 0,
+                ondisk: Object.assign({}, library_game(game).selected)
+            });
+            active_games.splice(index, 1);
+        } else if (index >= 0 && data[game].state !== 'new') {
+            console.log("Download interrupted: " + data[game].state)
+            library_update(game, {
+                state: data[game].state,
+                missing_count: Math.max(library_game(game).missing_count, 1)
+            });
+            active_games.splice(index, 1);
+        }
+    });
+    if(active_games.length > 0) {
+        $("#download_count").text(active_games.length.toString());
+        $("#download_status").show();
+    } else {
+        $("#download_count").text("0");
+        if(!download_filter) {
+            $("#download_status").hide();
+        }
+    }
+}
+
+function update_library(data) {
+    // The library is served from a snapshot of a newer catalog
+    if(data.catalog !== undefined && data.catalog !== catalog_id) {
+        console.log("Library updated. Reload page")
+        location.reload();
+    }
+}
+
+function update_user(data) {
+    if(data.last_update == 0) {
+        $("#loading").show()
+    }
+    update_library(data);
+    if(user_status != data.user_status) {
+        console.log(data.user_status)
+        user_status = data.user_status
+        if(data.user_status === "running_2fa") {
+            $("#user_icon").find("i").attr('class','fas fa-spinner fa-spin');
+            $("#user_icon").find("span").text("Login in progress ...");
+            document.getElementById('2fa').style.display='block'
+        } else if (data.user_status === "logon") {
+            $("#user_icon").find("i").attr('class','fas fa-user');
+            $("#user_icon").find("span").text("Logged to GOG.com");
+        } else if (data.user_status === "recaptcha") {
+            $("#user_icon").find("i").attr('class','far fa-clock');
+            $("#user_icon").find("span").text("Login requires solving reCAPTCHA. Try again later ...");
+        } else if (data.user_status === "running") {
+            $("#user_icon").find("i").attr('class','fas fa-spinner fa-spin');
+            $("#user_icon").find("span").text("Login in progress ...");
+        } else {
+            $("#user_icon").find("i").attr('class','fas fa-user-slash');
+            $("#user_icon").find("span").text("GOG.com login required");
+            document.getElementById('login').style.display='block'
+        }
+    }
+}
+
 function execute_query() {
+    // Poll only when the event stream is not available
+    if(event_source !== null && event_source.readyState === EventSource.OPEN) {
+        setTimeout(execute_query, 5000);
+        return;
+    }
     if(active_games.length > 0) {
         console.log("Query active downloads: " + active_games);
         $.ajax({
@@ -87,62 +168,12 @@ function execute_query() {
             async: false,
             success: function(data) {
                 console.log(data)
-                Object.keys(data).forEach(function(game) {
-                    console.log(game)
-                    if (data[game].state === 'running') {
-                        console.log("Active download - update")
-                        $("#"+game+"_progress").find("span").text(data[game].progress+" %");
-                    } else if (data[game].state === 'done') {
-                        console.log("Download finished")
-                        $("#"+game+"_progress").find("span").text(data[game].progress+" %");
-                        $("#"+game+"_progress").hide();
-                        $("#"+game+"_spinner").hide();
-                        $("#"+game+"_repo").show();
-                        const index = active_games.indexOf(game);
-                        active_games.splice(index, 1);
-                    }
-                });
-                if(active_games.length > 0) {
-                    $("#download_count").text(active_games.length.toString());
-                    $("#download_status").show();
-                } else {
-                    $("#download_count").text("0");
-                    if(!download_filter) {
-                        $("#download_status").hide();
-                    }
-                }
+                update_games(data)
             }
         });
     }
     $.get(root_url+"/user_status", function(data){
-        if(data.last_update == 0) {
-            $("#loading").show()
-        } else if (data.last_update > timestamp) {
-            console.log("Cache updated. Reload page")
-            location.reload();
-        }
-        if(user_status != data.user_status) {
-            console.log(data.user_status)
-            user_status = data.user_status
-            if(data.user_status === "running_2fa") {
-                $("#user_icon").find("i").attr('class','fas fa-spinner fa-spin');
-                $("#user_icon").find("span").text("Login in progress ...");
-                document.getElementById('2fa').style.display='block'
-            } else if (data.user_status === "logon") {
-                $("#user_icon").find("i").attr('class','fas fa-user');
-                $("#user_icon").find("span").text("Logged to GOG.com");
-            } else if (data.user_status === "recaptcha") {
-                $("#user_icon").find("i").attr('class','far fa-clock');
-                $("#user_icon").find("span").text("Login requires solving reCAPTCHA. Try again later ...");
-            } else if (data.user_status === "running") {
-                $("#user_icon").find("i").attr('class','fas fa-spinner fa-spin');
-                $("#user_icon").find("span").text("Login in progress ...");
-            } else {
-                $("#user_icon").find("i").attr('class','fas fa-user-slash');
-                $("#user_icon").find("span").text("GOG.com login required");
-                document.getElementById('login').style.display='block'
-            }
-        }
+        update_user(data)
     })
     .fail(function(jqXHR, textStatus, errorThrown) {
         console.log(jqXHR)
@@ -153,18 +184,43 @@ function execute_query() {
     setTimeout(execute_query, 5000); // you could choose not to continue on failure...
 }
 
-function filter_games(){
-    var $games = $(".game");
+function connect_events() {
+    if(typeof(EventSource) === "undefined") {
+        console.log("Server-Sent Events not supported. Fallback to polling.")
+        return;
+    }
+    event_source = new EventSource(root_url+"/events");
+    event_source.addEventListener("progress", function(e) {
+        update_games(JSON.parse(e.data))
+    });
+    event_source.addEventListener("status", function(e) {
+        update_games(JSON.parse(e.data))
+    });
+    event_source.addEventListener("user", function(e) {
+        update_user(JSON.parse(e.data))
+    });
+    event_source.addEventListener("library", function(e) {
+        update_library(JSON.parse(e.data))
+    });
+    event_source.onopen = function() {
+        console.log("Event stream connected")
+        // Catch up with changes made before the stream was opened
+        $.get(root_url+"/user_status", update_user);
+    };
+    event_source.onerror = function() {
+        // The browser reconnects automatically, poll in the meantime
+        console.log("Event stream disconnected. Fallback to polling.")
+    };
+}
 
+function filter_games(){
     $('#game_filter').keyup(function(){
         var val = '^(?=.*\\b' + $.trim($(this).val()).split(/\s+/).join('\\b)(?=.*\\b') + ').*$',
-        reg = RegExp(val, 'i'),
-        text;
+        reg = RegExp(val, 'i');
 
-        $games.show().filter(function(){
-            text = $(this).text().replace(/\s+/g, ' ');
-            return !reg.test(text);
-        }).hide();
+        library_filter(function(game) {
+            return reg.test(game.title + ' ' + game.gamename);
+        });
 
         $('#game_clear').show()
         download_filter = false
@@ -174,28 +230,28 @@ function filter_games(){
 function clear_filter(){
     $('#game_filter').val('')
     $('#game_clear').hide()
-    $(".game").show()
+    library_filter(null)
 }
 
 function filter_downloads(){
     if(download_filter) {
         download_filter = false
-        $(".game").show()
+        library_filter(null)
         if(active_games.length == 0) {
             $("#download_status").hide();
         }
     } else {
         clear_filter()
         download_filter = true
-        $(".game").hide()
-        active_games.forEach(function(game) {
-            $("#" + game).show()
+        library_filter(function(game) {
+            return active_games.indexOf(game.gamename) >= 0;
         })
     }
 }
 
 $(document).ready(function() {
-    timestamp = Math.floor(new Date().getTime() / 1000)
+    library_init(JSON.parse(document.getElementById('library_data').textContent),
+                 document.getElementById('library'));
     // Get the modal
     var modal = document.getElementById('login');
     var modal2 = document.getElementById('2fa');
@@ -220,6 +276,7 @@ $(document).ready(function() {
         alert( "error" );
     });
     filter_games();
+    connect_events();
     // run the first time; all subsequent calls will take care of themselves
     setTimeout(execute_query, 5000);
 });
@@ -0,0 +1,218 @@
+// Virtualized view of the game library. Only the cards in (and close to)
+// the viewport exist in the DOM, icons are loaded when a card becomes
+// visible. Game data is kept in memory, updates re-render single cards.
+
+var library = {
+    games: [],          // all games in the catalog order
+    index: {},          // game name -> game
+    visible: [],        // games passing the current filter
+    container: null,    // element holding the whole (virtual) library
+    view: null,         // element with the rendered cards
+    columns: 1,
+    card_width: 0,
+    card_height: 0,
+    first: -1,          // first rendered game in library.visible
+    last: -1,           // last rendered game in library.visible
+    overscan: 2,        // rows rendered above and below the viewport
+    observer: null,
+    scheduled: false
+}
+
+var PLATFORMS = [[4, "linux", "fab fa-linux"], [2, "macos", "fab fa-apple"],
+                 [1, "windows", "fab fa-windows"]]
+
+function escape_html(text) {
+    return String(text).replace(/[&<>"']/g, function(c) {
+        return {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;",
+                "'": "&#39;"}[c];
+    });
+}
+
+function game_active(game) {
+    return game.state === "running" || game.state === "queued";
+}
+
+function icon_url(game) {
+    // Icons are served from the local cache when available
+    if(game.icon_id) {
+        return root_url + '/icon/' + game.icon_id;
+    }
+    return game.icon;
+}
+
+function game_card(game) {
+    var name = escape_html(game.gamename);
+    var title = escape_html(game.title);
+    var active = game_active(game);
+    var ondisk = game.ondisk.linux || game.ondisk.macos || game.ondisk.windows;
+    var html = '<div class="game" id="' + name + '">'
+        + '<a name="' + name + '"></a>'
+        + '<div class="search"><a target="_blank" href="https://www.gog.com/games?search='
+        + encodeURIComponent(game.title) + '"><i class="fas fa-search" aria-hidden="true"></i></a></div>';
+    PLATFORMS.forEach(function(platform) {
+        var id = name + '_platform_' + platform[0];
+        if(!game.available[platform[1]]) {
+            html += '<div class="platform invisible" id="' + id + '"><i class="'
+                + platform[2] + '" aria-hidden="true"></i></div>';
+        } else {
+            html += '<div class="platform'
+                + (game.selected[platform[1]] ? '' : ' disabled')
+                + (game.user_selected ? ' selected' : '')
+                + '" id="' + id + '" onclick="toggle_platform(\'' + name + '\', \''
+                + platform[0] + '\')"><i class="' + platform[2]
+                + '" aria-hidden="true"></i></div>';
+        }
+    });
+    html += '<a target="_blank" href="https://www.gog.com/game/' + name + '">'
+        + '<div class="icon"><img class="icon" data-src="' + escape_html(icon_url(game))
+        + '" alt=""></div>'
+        + '<div class="link">' + title + '</div></a>'
+        // Game REPO - far right
+        + '<div class="check' + (ondisk ? '' : ' hidden') + '" id="' + name + '_repo">'
+        + '<a target="_blank" href="' + root_url + '/gog-repo/' + name
+        + '"><i class="fas fa-archive" aria-hidden="true"></i></a></div>'
+        // Game download button
+        + '<div class="check' + (active || game.missing_count == 0 ? ' hidden' : '')
+        + '" id="' + name + '_download" onclick="game_download(\'' + name + '\')">'
+        + '<i class="fas fa-download" aria-hidden="true"></i></div>'
+        // Game update button
+        + '<div class="check'
+        + (active || game.update_count == 0 || game.missing_count > 0 ? ' hidden' : '')
+        + '" id="' + name + '_update" onclick="game_download(\'' + name + '\')">'
+        + '<i class="fas fa-download" aria-hidden="true"></i></div>'
+        // Spinner
+        + '<div class="check' + (active ? '' : ' hidden') + '" id="' + name
+        + '_spinner" onclick="game_stop(\'' + name + '\')">'
+        + '<i class="fas fa-spinner fa-spin" aria-hidden="true"></i></div>'
+        // Progress
+        + '<div class="check' + (active ? '' : ' hidden') + '" id="' + name
+        + '_progress"><span>' + game.progress + ' %</span></div>'
+        + '<div class="check invisible"><span>|</span></div>'
+        + '</div>';
+    return html;
+}
+
+function load_icon(img) {
+    if(img.dataset.src) {
+        img.src = img.dataset.src;
+        img.removeAttribute("data-src");
+    }
+}
+
+function observe_icons(element) {
+    $(element).find("img[data-src]").each(function() {
+        if(library.observer !== null) {
+            library.observer.observe(this);
+        } else {
+            load_icon(this);
+        }
+    });
+}
+
+function library_measure() {
+    // Size of a card including margins, measured on the first game
+    if(library.games.length == 0) {
+        return;
+    }
+    var probe = $(game_card(library.games[0])).css("visibility", "hidden");
+    $(library.view).append(probe);
+    library.card_width = probe.outerWidth(true);
+    library.card_height = probe.outerHeight(true);
+    probe.remove();
+    library.columns = Math.max(1, Math.floor(
+        library.container.clientWidth / library.card_width));
+}
+
+function library_render(force) {
+    library.scheduled = false;
+    if(library.card_height == 0) {
+        library_measure();
+        if(library.card_height == 0) {
+            return;
+        }
+    }
+    var rows = Math.ceil(library.visible.length / library.columns);
+    library.container.style.height = (rows * library.card_height) + "px";
+    var top = library.container.getBoundingClientRect().top;
+    var first_row = Math.max(0, Math.floor(-top / library.card_height) - library.overscan);
+    var last_row = Math.min(rows, Math.ceil((window.innerHeight - top) / library.card_height) + library.overscan);
+    var first = first_row * library.columns;
+    var last = Math.min(library.visible.length, last_row * library.columns);
+    if(!force && first == library.first && last == library.last) {
+        return;
+    }
+    library.first = first;
+    library.last = last;
+    var html = [];
+    for(var i = first; i < last; i++) {
+        html.push(game_card(library.visible[i]));
+    }
+    if(library.observer !== null) {
+        library.observer.disconnect();
+    }
+    library.view.style.top = (first_row * library.card_height) + "px";
+    library.view.innerHTML = html.join("");
+    observe_icons(library.view);
+}
+
+function library_schedule() {
+    if(!library.scheduled) {
+        library.scheduled = true;
+        window.requestAnimationFrame(function() { library_render(false); });
+    }
+}
+
+function library_init(games, container) {
+    library.games = games;
+    library.visible = games;
+    library.index = {};
+    games.forEach(function(game) { library.index[game.gamename] = game; });
+    library.container = container;
+    library.view = document.createElement("div");
+    library.view.className = "library_view";
+    container.appendChild(library.view);
+    if(typeof(IntersectionObserver) !== "undefined") {
+        library.observer = new IntersectionObserver(function(entries) {
+            entries.forEach(function(entry) {
+                if(entry.isIntersecting) {
+                    load_icon(entry.target);
+                    library.observer.unobserve(entry.target);
+                }
+            });
+        }, {rootMargin: "200px"});
+    }
+    window.addEventListener("scroll", library_schedule, {passive: true});
+    window.addEventListener("resize", function() {
+        library.card_height = 0;
+        library.first = -1;
+        library_schedule();
+    });
+    library_render(true);
+}
+
+function library_filter(predicate) {
+    if(predicate === null) {
+        library.visible = library.games;
+    } else {
+        library.visible = library.games.filter(predicate);
+    }
+    library_render(true);
+}
+
+function library_game(name) {
+    return library.index[name];
+}
+
+function library_update(name, changes) {
+    var game = library.index[name];
+    if(game === undefined) {
+        return;
+    }
+    Object.assign(game, changes);
+    var element = document.getElementById(name);
+    if(element !== null) {
+        var card = $(game_card(game));
+        $(element).replaceWith(card);
+        observe_icons(card);
+    }
+}
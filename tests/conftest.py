@@ -0,0 +1,64 @@
+"""
+Common setup of the tests. lgogwebui reads its paths from the environment
+when it is imported, so they point to a temporary directory before any
+module of the application is loaded.
+"""
+
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#: Temporary lgogdownloader cache and GOG library shared by the tests
+TEST_DIR = tempfile.mkdtemp(prefix='lgog-test-')
+atexit.register(shutil.rmtree, TEST_DIR, True)
+
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+os.environ.update({
+    'LGOG_CACHE': os.path.join(TEST_DIR, 'cache'),
+    'LGOG_ICONS': os.path.join(TEST_DIR, 'icons'),
+    'GOG_DIR': os.path.join(TEST_DIR, 'library')
+})
+for _name in ('cache', 'icons', 'library'):
+    os.makedirs(os.path.join(TEST_DIR, _name))
+
+
+@pytest.fixture
+def db():
+    """
+    Empty DB with a logged in user.
+    """
+    import models
+    models.Base.metadata.drop_all(models.ENGINE)
+    models.init_db(models.ENGINE)
+    _session = models.Session()
+    _session.add(models.User(state=models.LoginStatus.logon, platform=5))
+    _session.commit()
+    models.Session.remove()
+    yield models
+    models.Session.remove()
+
+
+@pytest.fixture
+def client(db):
+    """
+    Test client of lgogwebui serving a small synthetic library.
+    """
+    import threading
+    from synthetic import write_catalog
+    from catalog import CATALOG
+    write_catalog(CATALOG.path, 20)
+    CATALOG.reload()
+    import lgogwebui
+    from snapshot import LIBRARY
+    # The update timer started on import would run against the test DB
+    for _thread in threading.enumerate():
+        if isinstance(_thread, threading.Timer):
+            _thread.cancel()
+    LIBRARY.build()
+    return lgogwebui.app.test_client()
@@ -0,0 +1,44 @@
+"""
+JSON library API.
+"""
+
+import json
+import base64
+
+import pytest
+
+
+def _cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+def test_pages(client):
+    _names = []
+    _cursor_arg = ''
+    while True:
+        _page = client.get('/api/games?sort=-name&limit=7' +
+                           _cursor_arg).get_json()
+        _names += [_game['gamename'] for _game in _page['games']]
+        if _page['next_cursor'] is None:
+            break
+        _cursor_arg = '&cursor=' + _page['next_cursor']
+    assert _names == sorted(_names, reverse=True)
+    assert len(_names) == 20
+
+
+@pytest.mark.parametrize('query', [
+    'cursor=' + _cursor([1, 2]),
+    'cursor=' + _cursor('5'),
+    'cursor=' + _cursor(['a', 'b', 'c']),
+    'sort=progress&cursor=' + _cursor(['a', 'game_00001']),
+    'sort=progress&cursor=' + _cursor([True, 'game_00001']),
+    'cursor=not-base64!',
+    'cursor=' + base64.urlsafe_b64encode(b'\xff').decode(),
+    'limit=abc',
+    'missing=yes',
+    'sort=size',
+    'state=unknown',
+    'available=8'
+])
+def test_bad_request(client, query):
+    assert client.get('/api/games?' + query).status_code == 400
@@ -0,0 +1,180 @@
+"""
+Download worker state transitions.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def worker(client, monkeypatch):
+    """
+    Download function with a backend recording its calls.
+    """
+    import lgogdaemon
+    from models import Game, Session, Status
+    _session = Session()
+    _session.query(Game).filter(Game.name == 'game_00001').one().state = \
+        Status.queued
+    _session.commit()
+    Session.remove()
+    _calls = []
+
+    def _backend(game_name, platform, threads, report, cancel):
+        _calls.append(game_name)
+        if cancel.is_set():
+            raise lgogdaemon.DownloadCancelled()
+        report(100, 1024)
+        return 1
+    monkeypatch.setitem(lgogdaemon.DOWNLOAD_BACKENDS, 'lgogdownloader',
+                        _backend)
+    return SimpleNamespace(download=lgogdaemon.download, calls=_calls)
+
+
+def _state(name):
+    from models import Game, Session
+    _state = Session().query(Game).filter(Game.name == name).one().state
+    Session.remove()
+    return _state
+
+
+def test_download(worker):
+    from models import Status
+    worker.download('game_00001')
+    assert worker.calls == ['game_00001']
+    assert _state('game_00001') == Status.done
+
+
+def _stop(name):
+    """
+    Do what the stop route does.
+    """
+    from models import Game, Session, Status
+    from progress import PROGRESS
+    _session = Session.session_factory()
+    _session.query(Game).filter(Game.name == name).one().state = Status.stop
+    _session.commit()
+    _session.close()
+    PROGRESS.cancel(name)
+
+
+def test_stop_before_registration(worker, monkeypatch):
+    from models import Status
+    from progress import PROGRESS
+    _start = PROGRESS.start
+
+    def _stopped_start(game_name, platform):
+        # The stop request arrives before the download is registered
+        _stop(game_name)
+        return _start(game_name, platform)
+    monkeypatch.setattr(PROGRESS, 'start', _stopped_start)
+    worker.download('game_00001')
+    assert worker.calls == []
+    assert _state('game_00001') == Status.stop
+
+
+def test_stop_after_registration(worker, monkeypatch):
+    from models import Status
+    from progress import PROGRESS
+    _start = PROGRESS.start
+
+    def _stopped_start(game_name, platform):
+        _download = _start(game_name, platform)
+        _stop(game_name)
+        return _download
+    monkeypatch.setattr(PROGRESS, 'start', _stopped_start)
+    worker.download('game_00001')
+    assert _state('game_00001') == Status.stop
+
+
+def test_download_request_while_stopping(client, monkeypatch):
+    import jobs
+    import lgogwebui
+    from models import Game, Session, Status
+    monkeypatch.setattr(lgogwebui, '_schedule_download',
+                        lambda game, priority=0: None)
+    assert client.get('/download/game_00002').status_code == 200
+    # Repeated requests are idempotent
+    assert client.get('/download/game_00002').status_code == 200
+    assert jobs.claim('game_00002')
+    _session = Session()
+    _session.query(Game).filter(Game.name == 'game_00002').one().state = \
+        Status.stop
+    _session.commit()
+    Session.remove()
+    # The running job of the stopped download was not removed yet
+    assert client.get('/download/game_00002').status_code == 409
+    jobs.finish('game_00002')
+    assert client.get('/download/game_00002').status_code == 200
+
+
+def test_update_publishes_library_first(client, monkeypatch):
+    """
+    Clients told about the update get the library of the new catalog.
+    """
+    import lgogdaemon
+    from models import SESSION_FACTORY, Session, User
+    from snapshot import LIBRARY
+    _build = LIBRARY.build
+    _seen = []
+
+    def _record_build():
+        _session = SESSION_FACTORY()
+        _seen.append(_session.query(User).one().last_update)
+        _session.close()
+        return _build()
+    monkeypatch.setattr(lgogdaemon, 'run', lambda *args, **kwargs:
+                        SimpleNamespace(out='', err='', returncode=0))
+    monkeypatch.setattr(LIBRARY, 'build', _record_build)
+    _icons = []
+    monkeypatch.setattr(lgogdaemon.ICONS, 'prefetch',
+                        lambda urls: _icons.extend(urls))
+    monkeypatch.setattr(lgogdaemon.STATUS_CHECKS, 'urgent', lambda names: None)
+    monkeypatch.setattr(lgogdaemon.STATUS_CHECKS, 'plan',
+                        lambda names, period: None)
+    lgogdaemon.update()
+    assert _seen == [None]
+    # Icons of unchanged games are prefetched too
+    assert len(_icons) == 20
+    assert Session().query(User).one().last_update is not None
+    Session.remove()
+
+
+def test_status_batch_keeps_finished_chunks(client, monkeypatch):
+    import lgogdaemon
+    from models import Game, Session
+
+    def _query(names, platform):
+        if 'game_00002' in names:
+            raise OSError("lgogdownloader timed out")
+        return {_name: (1, 2, 3) for _name in names}
+    monkeypatch.setattr(lgogdaemon, 'status_query_batch', _query)
+    monkeypatch.setattr(lgogdaemon.config, 'status_batch_size', 1)
+    monkeypatch.setattr(lgogdaemon.VERIFIER, 'workers', 0)
+    lgogdaemon.status_batch(['game_00001', 'game_00002', 'game_00003'])
+    _counts = {_game.name: (_game.done_count, _game.missing_count,
+                            _game.update_count, _game.last_checked is None)
+               for _game in Session().query(Game).filter(Game.name.in_(
+                   ['game_00001', 'game_00002', 'game_00003']))}
+    Session.remove()
+    assert _counts['game_00001'] == (1, 2, 3, False)
+    assert _counts['game_00003'] == (1, 2, 3, False)
+    assert _counts['game_00002'][3]
+
+
+def test_failed_update_plans_status_checks(client, monkeypatch):
+    import lgogdaemon
+    _planned = []
+
+    def _fail(*args, **kwargs):
+        raise OSError("lgogdownloader timed out")
+    monkeypatch.setattr(lgogdaemon, 'run', _fail)
+    monkeypatch.setattr(lgogdaemon, 'stale_games', lambda session, catalog,
+                        changes: (['game_00001'], ['game_00002']))
+    monkeypatch.setattr(lgogdaemon.STATUS_CHECKS, 'urgent',
+                        lambda names: _planned.append(names))
+    monkeypatch.setattr(lgogdaemon.STATUS_CHECKS, 'plan',
+                        lambda names, period: _planned.append(names))
+    lgogdaemon.update()
+    assert _planned == [['game_00001'], ['game_00002']]
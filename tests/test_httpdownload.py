@@ -0,0 +1,134 @@
+"""
+Segmented HTTP downloads against the stand-in range server.
+"""
+
+import os
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import range_server
+
+#: Size of the downloaded files, not a multiple of the segment size
+SIZE = 2**20 + 123
+#: Size of the first half of a partial file
+HALF = SIZE // 2
+
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch):
+    import httpdownload
+    monkeypatch.setattr(httpdownload, 'MIN_SEGMENT', 64 * 1024)
+    monkeypatch.setattr(httpdownload, 'MAX_BACKOFF', 0)
+
+
+@pytest.fixture
+def server():
+    _servers = []
+
+    def _serve(**kwargs):
+        _server = range_server.serve(size=SIZE, **kwargs)
+        _servers.append(_server)
+        return 'http://%s:%s/game/setup_game.exe' % _server.server_address[:2]
+    yield _serve
+    for _server in _servers:
+        _server.shutdown()
+        _server.server_close()
+
+
+def _recording_downloader(**kwargs):
+    from httpdownload import HttpDownloader
+    _downloader = HttpDownloader(**kwargs)
+    _ranges = []
+    _request = _downloader.pool.request
+
+    def _record(method, url, headers=None):
+        if method == 'GET':
+            _ranges.append((headers or {}).get('Range'))
+        return _request(method, url, headers)
+    _downloader.pool.request = _record
+    return _downloader, _ranges
+
+
+def _generated(start, end):
+    return b''.join(range_server.generated(_offset, min(
+        range_server.CHUNK_SIZE, end - _offset))
+        for _offset in range(start, end, range_server.CHUNK_SIZE))
+
+
+def _partial(path):
+    """
+    Write a partial file with the first half downloaded. The downloaded
+    part is zeros, unlike the served data.
+    """
+    with open(path + '.part', 'wb') as _file:
+        _file.write(bytes(SIZE))
+    with open(path + '.part.json', 'w') as _file:
+        json.dump({'size': SIZE, 'segments': [[0, SIZE, HALF]]}, _file)
+
+
+def _read(path):
+    with open(path, 'rb') as _file:
+        return _file.read()
+
+
+def test_segments(server, tmp_path):
+    _path = str(tmp_path / 'setup_game.exe')
+    _downloader, _ranges = _recording_downloader(segments=4)
+    _progress = []
+    assert _downloader.download(
+        [{'url': server(), 'path': _path,
+          'md5': range_server.generated_md5(SIZE)}],
+        lambda _done, _total: _progress.append((_done, _total))) == 1
+    assert _read(_path) == _generated(0, SIZE)
+    assert len(set(_ranges)) == 4
+    assert _progress[-1] == (SIZE, SIZE)
+    assert os.listdir(str(tmp_path)) == ['setup_game.exe']
+
+
+def test_resume(server, tmp_path):
+    _path = str(tmp_path / 'setup_game.exe')
+    _partial(_path)
+    _downloader, _ranges = _recording_downloader(segments=4)
+    _downloader.download([{'url': server(), 'path': _path}])
+    # Only the missing part is requested, the downloaded part is kept
+    assert _ranges == ['bytes=%s-%s' % (HALF, SIZE - 1)]
+    assert _read(_path) == bytes(HALF) + _generated(HALF, SIZE)
+    assert not os.path.exists(_path + '.part.json')
+
+
+def test_retry_truncated(server, tmp_path, monkeypatch):
+    # The first two responses are cut off in the middle
+    _draws = iter([0.0, 0.0])
+    monkeypatch.setattr(range_server, 'random', SimpleNamespace(
+        random=lambda: next(_draws, 1.0),
+        randrange=lambda start, end: (start + end) // 2))
+    _path = str(tmp_path / 'setup_game.exe')
+    _downloader, _ranges = _recording_downloader(segments=2)
+    _downloader.download([{'url': server(error_rate=1.0), 'path': _path,
+                           'md5': range_server.generated_md5(SIZE)}])
+    # Each segment is requested again from its last written byte
+    assert len(_ranges) == 4
+    assert _read(_path) == _generated(0, SIZE)
+
+
+def test_checksum_mismatch(server, tmp_path):
+    from httpdownload import DownloadError
+    _path = str(tmp_path / 'setup_game.exe')
+    _downloader, _ranges = _recording_downloader(segments=4)
+    with pytest.raises(DownloadError):
+        _downloader.download([{'url': server(), 'path': _path,
+                               'md5': '0' * 32}])
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_ranges_ignored(server, tmp_path):
+    _path = str(tmp_path / 'setup_game.exe')
+    _partial(_path)
+    _downloader, _ranges = _recording_downloader(segments=4)
+    _downloader.download([{'url': server(ranges=False), 'path': _path,
+                           'md5': range_server.generated_md5(SIZE)}])
+    # The whole file sent for the range request replaces the partial file
+    assert _ranges == ['bytes=%s-%s' % (HALF, SIZE - 1)]
+    assert _read(_path) == _generated(0, SIZE)
@@ -0,0 +1,30 @@
+"""
+Icon cache prefetch.
+"""
+
+import threading
+
+ICON = b'\x89PNG\r\n\x1a\n' + b'\x00' * 16
+
+
+def test_prefetch_queued(tmp_path, monkeypatch):
+    import icons
+    monkeypatch.setattr(icons, 'thumbnail', lambda data, size: data)
+    _release = threading.Event()
+    _fetched = []
+
+    def _fetcher(url):
+        _release.wait(10)
+        _fetched.append(url)
+        return ICON
+    _cache = icons.IconCache(str(tmp_path), fetcher=_fetcher)
+    assert _cache.prefetch(['//icons/a.png', None])
+    # URLs given during a running prefetch are downloaded by it
+    assert not _cache.prefetch(['//icons/b.png', '//icons/a.png'])
+    _release.set()
+    for _thread in threading.enumerate():
+        if _thread.name == 'IconPrefetch':
+            _thread.join(10)
+    assert sorted(_fetched) == ['https://icons/a.png', 'https://icons/b.png']
+    assert _cache.find(icons.icon_key('//icons/b.png')) is not None
+    assert not _cache.prefetch([])
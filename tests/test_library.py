@@ -0,0 +1,48 @@
+"""
+Reload of the library page after a catalog update.
+"""
+
+import os
+
+
+def test_catalog_reload_signal(client):
+    from catalog import CATALOG
+    from events import EVENTS
+    from snapshot import LIBRARY
+    from synthetic import write_catalog
+    _old = client.get('/user_status').get_json()['catalog']
+    assert _old
+    assert 'var catalog_id = "%s"' % _old in client.get('/').get_data(
+        as_text=True)
+    _seq = EVENTS.seq
+    write_catalog(CATALOG.path, 21)
+    _stat = os.stat(CATALOG.path)
+    os.utime(CATALOG.path, ns=(_stat.st_atime_ns, _stat.st_mtime_ns + 10**9))
+    CATALOG.reload()
+    # The signal is sent once the library of the new catalog is served
+    assert not [_event for _event in EVENTS.wait(_seq, 0)
+                if _event[1] == 'library']
+    LIBRARY.build()
+    _events = [_data for _, _kind, _data in EVENTS.wait(_seq, 0)
+               if _kind == 'library']
+    _new = client.get('/user_status').get_json()['catalog']
+    assert _events == [{'catalog': _new}]
+    assert _new != _old
+    assert 'var catalog_id = "%s"' % _new in client.get('/').get_data(
+        as_text=True)
+    # Rebuilds of the same catalog keep the open pages
+    _seq = EVENTS.seq
+    LIBRARY.build()
+    assert not [_event for _event in EVENTS.wait(_seq, 0)
+                if _event[1] == 'library']
+
+
+def test_build_keeps_caller_session(client):
+    from models import Session, User
+    from snapshot import LIBRARY
+    _session = Session()
+    _user = _session.query(User).one()
+    LIBRARY.build()
+    assert Session() is _session
+    assert _user in _session
+    Session.remove()
@@ -0,0 +1,26 @@
+"""
+Index of the downloaded installer files.
+"""
+
+import os
+
+
+def test_fingerprint_modified_file(tmp_path):
+    from ondisk import OnDiskIndex
+    _game = tmp_path / 'library' / 'game'
+    _game.mkdir(parents=True)
+    _installer = _game / 'setup_game_1.0.exe'
+    _installer.write_bytes(b'a' * 10)
+    _index = OnDiskIndex(str(tmp_path / 'library'), str(tmp_path / 'index'))
+    _index.refresh(force=True)
+    _old = _index.fingerprint('game')
+    _dir_stat = os.stat(_game)
+    # A file rewritten in place keeps the mtime of its directory
+    _installer.write_bytes(b'b' * 20)
+    os.utime(_game, ns=(_dir_stat.st_atime_ns, _dir_stat.st_mtime_ns))
+    _index.refresh(force=True)
+    assert _index.fingerprint('game') != _old
+    _modified = _index.fingerprint('game')
+    _installer.unlink()
+    os.utime(_game, ns=(_dir_stat.st_atime_ns, _dir_stat.st_mtime_ns))
+    assert _index.fingerprint('game') not in (_old, _modified)
@@ -0,0 +1,76 @@
+"""
+Reconciliation of the catalog with the Game table.
+"""
+
+import pytest
+from sqlalchemy import event
+
+from synthetic import write_catalog
+
+#: Size of the synthetic catalog
+GAMES = 5000
+
+
+@pytest.fixture
+def catalog():
+    from catalog import CATALOG
+    write_catalog(CATALOG.path, GAMES)
+    CATALOG.reload()
+
+
+def _statements(function):
+    """
+    Run a function and get the SQL statements it executed.
+    """
+    import models
+    _statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        _statements.append(statement)
+    event.listen(models.ENGINE, 'before_cursor_execute', _count)
+    try:
+        function()
+    finally:
+        event.remove(models.ENGINE, 'before_cursor_execute', _count)
+    return _statements
+
+
+def test_reconcile_statements(db, catalog):
+    from snapshot import reconcile
+
+    def _reconcile():
+        _rows, _platform, _signature = reconcile(db.Session())
+        db.Session.remove()
+        assert len(_rows) == GAMES
+
+    # Select of the user and the games, one bulk insert
+    assert len(_statements(_reconcile)) <= 3
+    assert db.Session().query(db.Game).count() == GAMES
+    db.Session.remove()
+    # Nothing to write once the games are stored
+    assert len(_statements(_reconcile)) <= 2
+
+
+def test_reconcile_missing(db, catalog):
+    from snapshot import LIBRARY, reconcile
+    reconcile(db.Session())
+    _session = db.Session()
+    _game = _session.query(db.Game).filter(
+        db.Game.name == 'game_00001').one()
+    _game.state = db.Status.done
+    _game.platform_ondisk = 0
+    _session.commit()
+    db.Session.remove()
+
+    def _build():
+        LIBRARY.build()
+
+    # Select of the user and the games, one bulk update
+    assert len(_statements(_build)) <= 3
+    _state = db.Session().query(db.Game.state).filter(
+        db.Game.name == 'game_00001').scalar()
+    db.Session.remove()
+    assert _state == db.Status.missing
+    _records = {_record['gamename']: _record
+                for _record in LIBRARY.snapshot().records}
+    assert _records['game_00001']['state'] == 'missing'
@@ -0,0 +1,22 @@
+"""
+Runner of the lgogdownloader commands.
+"""
+
+import pytest
+
+
+def test_failed_start_not_counted():
+    import runner
+    _before = runner._running_commands()
+    with pytest.raises(OSError):
+        runner.Command(['/nonexistent/lgogdownloader'], kind='status')
+    assert runner._running_commands() == _before
+
+
+def test_finished_command_not_counted():
+    import runner
+    _before = dict(runner._running_commands())
+    _proc = runner.run(['true'], kind='status')
+    assert _proc.returncode == 0
+    assert dict(runner._running_commands()).get(('status',), 0) == \
+        _before.get(('status',), 0)
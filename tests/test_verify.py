@@ -0,0 +1,119 @@
+"""
+Local verification of the installer checksums.
+"""
+
+import os
+import hashlib
+
+import pytest
+
+
+def _md5(data):
+    return hashlib.md5(data).hexdigest()
+
+
+@pytest.fixture
+def verifier(tmp_path):
+    from verify import Verifier
+    (tmp_path / 'xml').mkdir()
+    (tmp_path / 'game').mkdir()
+    return Verifier(str(tmp_path / 'cache.json'), str(tmp_path / 'xml'))
+
+
+def _installer(name, md5=None, platform=1):
+    _inst = {'platform': platform, 'path': '/game/' + name}
+    if md5 is not None:
+        _inst['md5'] = md5
+    return _inst
+
+
+def _check(verifier, tmp_path, installers, platform=1):
+    from ondisk import scan_directory
+    _directory = str(tmp_path / 'game')
+    _expected = verifier.expected({'installers': installers},
+                                  scan_directory(_directory), _directory,
+                                  platform)
+    if _expected is None:
+        return None
+    return verifier.verify({'game': _expected})['game']
+
+
+def test_new_version_missing(verifier, tmp_path):
+    # The old installer matches its own XML, the new one was not downloaded
+    (tmp_path / 'game' / 'setup_g_1.0.exe').write_bytes(b'old')
+    (tmp_path / 'xml' / 'setup_g_1.0.exe.xml').write_text(
+        '<file md5="%s"/>' % _md5(b'old'))
+    assert _check(verifier, tmp_path,
+                  [_installer('setup_g_2.0.exe', _md5(b'new'))]) == (0, 1, 0)
+
+
+def test_counts_per_installer(verifier, tmp_path):
+    _game = tmp_path / 'game'
+    _game.joinpath('setup_g.exe').write_bytes(b'exe')
+    # Parts of a multi-file installer not listed in the catalog
+    _game.joinpath('setup_g-1.bin').write_bytes(b'part 1')
+    _game.joinpath('setup_g-2.bin').write_bytes(b'part 2')
+    (tmp_path / 'xml' / 'setup_g-1.bin.xml').write_text(
+        '<file md5="%s"/>' % _md5(b'part 1'))
+    _game.joinpath('setup_h.exe').write_bytes(b'changed')
+    _game.joinpath('setup_mac.pkg').write_bytes(b'other platform')
+    assert _check(verifier, tmp_path, [
+        _installer('setup_g.exe', _md5(b'exe')),
+        _installer('setup_h.exe', _md5(b'h')),
+        _installer('setup_i.exe'),
+        _installer('setup_mac.pkg', _md5(b'mac'), platform=2),
+    ]) == (1, 1, 1)
+
+
+def test_unreadable_installer(verifier, tmp_path):
+    _path = tmp_path / 'game' / 'setup_g.exe'
+    _path.write_bytes(b'exe')
+    os.chmod(_path, 0)
+    if os.access(_path, os.R_OK):
+        pytest.skip("Files are readable regardless of permissions")
+    assert _check(verifier, tmp_path,
+                  [_installer('setup_g.exe', _md5(b'exe'))]) == (0, 1, 0)
+
+
+def test_unknown_checksum(verifier, tmp_path):
+    (tmp_path / 'game' / 'setup_g.exe').write_bytes(b'exe')
+    assert _check(verifier, tmp_path, [_installer('setup_g.exe')]) is None
+
+
+def test_waiting_verification_does_not_block(tmp_path, monkeypatch):
+    import threading
+    import verify
+    monkeypatch.setattr(verify, 'BUSY_POLL', 0.01)
+    _busy = threading.Event()
+    _asked = threading.Event()
+
+    def _downloading():
+        _asked.set()
+        return _busy.is_set()
+    _verifier = verify.Verifier(str(tmp_path / 'cache.json'),
+                                str(tmp_path), busy=_downloading)
+    _cached = tmp_path / 'cached.exe'
+    _cached.write_bytes(b'cached')
+    _new = tmp_path / 'new.exe'
+    _new.write_bytes(b'new')
+    assert _verifier.checksums([str(_cached)]) == {
+        str(_cached): _md5(b'cached')}
+    _busy.set()
+    _asked.clear()
+    _waiting = threading.Thread(target=_verifier.checksums,
+                                args=([str(_new)],))
+    _waiting.start()
+    assert _asked.wait(5)
+    # Cached results are served while the other call waits for downloads
+    _results = []
+    _reader = threading.Thread(target=lambda: _results.append(
+        _verifier.checksums([str(_cached)])))
+    _reader.start()
+    _reader.join(1)
+    _blocked = _reader.is_alive()
+    _busy.clear()
+    _waiting.join(5)
+    _reader.join(5)
+    assert not _blocked
+    assert _results == [{str(_cached): _md5(b'cached')}]
+    assert _verifier.checksums([str(_new)]) == {str(_new): _md5(b'new')}
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Local verification of downloaded installers against the checksums in the
+lgogdownloader cache.
+"""
+
+import os
+import json
+import mmap
+import hashlib
+from time import monotonic, sleep
+from threading import Lock
+from xml.etree.ElementTree import iterparse, ParseError
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import config
+from main import app
+from progress import PROGRESS
+
+#: Size of the blocks hashed at once
+BLOCK_SIZE = 8 * 2**20
+#: Time between checks whether the downloads finished
+BUSY_POLL = 5
+
+
+def hash_file(path, rate=None):
+    """
+    Compute the MD5 checksum of a file. The file is mapped into memory,
+    files that cannot be mapped are read in large blocks.
+    :param string path: - path to the file
+    :param float rate: - limit of the read rate in bytes per second
+    """
+    _md5 = hashlib.md5()
+    _start = monotonic()
+    _done = 0
+    with open(path, 'rb') as _file:
+        try:
+            _map = mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files and filesystems without mmap support
+            _map = None
+        if _map is not None:
+            if hasattr(_map, 'madvise'):
+                _map.madvise(mmap.MADV_SEQUENTIAL)
+            with _map, memoryview(_map) as _view:
+                for _offset in range(0, len(_map), BLOCK_SIZE):
+                    with _view[_offset:_offset + BLOCK_SIZE] as _block:
+                        _md5.update(_block)
+                        _done += len(_block)
+                    _throttle(_start, _done, rate)
+        else:
+            _buffer = bytearray(BLOCK_SIZE)
+            with memoryview(_buffer) as _view:
+                while True:
+                    _size = _file.readinto(_buffer)
+                    if not _size:
+                        break
+                    _md5.update(_view[:_size])
+                    _done += _size
+                    _throttle(_start, _done, rate)
+    return _md5.hexdigest()
+
+
+def _throttle(start, done, rate):
+    if rate:
+        _ahead = done / rate - (monotonic() - start)
+        if _ahead > 0:
+            sleep(_ahead)
+
+
+def xml_checksum(xml_dir, file_name):
+    """
+    Get the MD5 checksum of an installer from the XML file stored by
+    lgogdownloader, or None.
+    :param string xml_dir: - directory with the lgogdownloader XML files
+    :param string file_name: - installer file name
+    """
+    try:
+        for _event, _element in iterparse(
+                os.path.join(xml_dir, file_name + '.xml'), ('start',)):
+            # The checksum of the whole file is an attribute of the root
+            return _element.get('md5') or None
+    except (OSError, ParseError):
+        return None
+    return None
+
+
+def installer_file_name(installer):
+    """
+    Get the local file name of an installer from its catalog record.
+    :param dict installer: - installer record from the catalog
+    """
+    return os.path.basename(installer.get('filepath') or
+                            installer.get('path', ''))
+
+
+class Verifier:
+    """
+    Checksum verification of installer files in a pool of threads.
+    Results are stored by path together with the size, mtime and inode of
+    the file, so only new or modified files are ever hashed again. The
+    verification waits while downloads are active and every thread reads
+    at most rate bytes per second.
+    """
+
+    def __init__(self, cache_path, xml_dir, workers=2, rate=None,
+                 busy=None):
+        """
+        :param string cache_path: - path to the file storing the results
+        :param string xml_dir: - directory with the lgogdownloader XML files
+        :param int workers: - number of threads, 0 disables verification
+        :param float rate: - limit of the read rate of every thread in bytes
+                             per second
+        :param callable busy: - returns True while the disk should be left
+                                to other work
+        """
+        #: Path to the file storing the results
+        self.cache_path = cache_path
+        #: Directory with the lgogdownloader XML files
+        self.xml_dir = xml_dir
+        #: Number of hashing threads
+        self.workers = workers
+        #: Read rate limit of every thread in bytes per second
+        self.rate = rate
+        #: Returns True while verification should wait
+        self.busy = busy
+        self._cache = None
+        self._pool = None
+        self._lock = Lock()
+
+    @property
+    def enabled(self):
+        """
+        True if the verification is enabled.
+        """
+        return self.workers > 0
+
+    def _load(self):
+        if self._cache is None:
+            try:
+                with open(self.cache_path, encoding='utf-8') as _file:
+                    self._cache = json.load(_file)
+            except FileNotFoundError:
+                self._cache = {}
+            except ValueError:
+                app.logger.warning("Corrupted checksum cache: %s",
+                                   self.cache_path)
+                self._cache = {}
+        return self._cache
+
+    def _save(self):
+        _tmp = self.cache_path + '.tmp'
+        try:
+            with open(_tmp, 'w', encoding='utf-8') as _file:
+                json.dump(self._cache, _file)
+            os.replace(_tmp, self.cache_path)
+        except OSError:
+            app.logger.error("Unable to store checksum cache: %s",
+                             self.cache_path, exc_info=True)
+
+    def _executor(self):
+        if self._pool is None:
+            # hashlib releases the GIL while hashing large blocks, so the
+            # threads use all cores without forking the web server
+            self._pool = ThreadPoolExecutor(self.workers,
+                                            thread_name_prefix="Verify")
+        return self._pool
+
+    def _wait(self):
+        if self.busy is None:
+            return
+        _logged = False
+        while self.busy():
+            if not _logged:
+                app.logger.info("Checksum verification paused by downloads")
+                _logged = True
+            sleep(BUSY_POLL)
+
+    def checksums(self, paths):
+        """
+        Get MD5 checksums of files. Returns a dictionary path: checksum,
+        files that cannot be read are left out.
+        :param list paths: - paths to the files
+        """
+        _result = {}
+        _todo = {}
+        with self._lock:
+            _cache = self._load()
+            for _path in paths:
+                try:
+                    _stat = os.stat(_path)
+                except OSError:
+                    continue
+                _key = [_stat.st_size, _stat.st_mtime_ns, _stat.st_ino]
+                _cached = _cache.get(_path)
+                if _cached is not None and _cached[:3] == _key:
+                    _result[_path] = _cached[3]
+                else:
+                    _todo[_path] = _key
+            if not _todo:
+                return _result
+            _pool = self._executor()
+        # The lock is not held while hashing, so other callers are not
+        # blocked while the verification waits for the downloads
+        app.logger.info("Verifying checksums of %s files", len(_todo))
+        _paths = list(_todo)
+        _pending = {}
+        _hashed = {}
+        while _paths or _pending:
+            # One file per thread in flight, so the verification can
+            # pause between files while downloads are active
+            while _paths and len(_pending) < self.workers:
+                self._wait()
+                _path = _paths.pop()
+                _pending[_pool.submit(hash_file, _path, self.rate)] = _path
+            _finished, _ = wait(_pending, return_when=FIRST_COMPLETED)
+            for _future in _finished:
+                _path = _pending.pop(_future)
+                try:
+                    _hashed[_path] = _future.result()
+                except OSError as _error:
+                    app.logger.warning("Unable to verify %s: %s", _path,
+                                       _error)
+        with self._lock:
+            for _path, _md5 in _hashed.items():
+                self._cache[_path] = _todo[_path] + [_md5]
+            self._save()
+        _result.update(_hashed)
+        return _result
+
+    def expected(self, game_data, files, directory, platform):
+        """
+        Get the checksums the installer files of a game should have.
+        Returns a list of (path, checksum) with an item for every installer
+        of the selected platforms in the catalog, or None when a checksum of
+        a downloaded installer is not known and the check has to be left to
+        lgogdownloader. Installers not on disk need no checksum, their
+        checksum is None. Files on disk the catalog does not list, e.g.
+        parts of multi-file installers, are not checked.
+        :param dict game_data: - game record from the catalog
+        :param list files: - installer files on disk, see ondisk.scan_directory
+        :param string directory: - path to the game directory
+        :param int platform: - selected platforms bitmask
+        """
+        _ondisk = {_file['name'] for _file in files}
+        _expected = []
+        for _inst in game_data.get('installers', ()):
+            if not _inst['platform'] & platform:
+                continue
+            _name = installer_file_name(_inst)
+            if not _name:
+                return None
+            _md5 = None
+            if _name in _ondisk:
+                _md5 = _inst.get('md5') or xml_checksum(self.xml_dir, _name)
+                if _md5 is None:
+                    return None
+                _md5 = _md5.lower()
+            _expected.append((os.path.join(directory, _name), _md5))
+        return _expected
+
+    def verify(self, games):
+        """
+        Verify installers of many games at once. Returns (done, missing,
+        update) installer counts per game like an lgogdownloader status
+        query. Installers that are missing or cannot be read are missing,
+        installers with a wrong checksum need an update.
+        :param dict games: - game name: result of expected
+        """
+        _actual = self.checksums([_path for _expected in games.values()
+                                  for _path, _md5 in _expected
+                                  if _md5 is not None])
+        _results = {}
+        for _name, _expected in games.items():
+            _counts = [0, 0, 0]
+            for _path, _md5 in _expected:
+                _checksum = _actual.get(_path) if _md5 is not None else None
+                if _checksum is None:
+                    _counts[1] += 1
+                elif _checksum == _md5:
+                    _counts[0] += 1
+                else:
+                    _counts[2] += 1
+            _results[_name] = tuple(_counts)
+        return _results
+
+
+#: Verifier of the installers in the GOG library
+VERIFIER = Verifier(os.path.join(config.lgog_cache, 'verify-cache.json'),
+                    os.path.join(config.lgog_cache, 'xml'),
+                    config.verify_workers, config.verify_rate * 2**20,
+                    busy=lambda: bool(PROGRESS.active()))